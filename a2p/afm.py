@@ -0,0 +1,928 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM AFM parsing: streaming, fast (regular expressions) and lazy (see LazyAfm) readers, binary cache of parsed metrics.
+"""
+
+import array
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import operator
+import os
+import re
+import struct
+import sys
+import typing
+
+from a2p.common import NO_STATS, PFM_KERNS_LIMIT, STRING_ENCODING, gc_paused, Stats, write_file_atomic
+from a2p.encoding import Encoding
+
+
+METRICS_FORMAT = 1  # version of binary format of parsed metrics (see AfmMetrics.to_bytes), bumped on changes
+METRICS_HEADER = struct.Struct("<4sHhi32sII")  # magic, format, reserved, kern limit (0: none), AFM sha256, lengths
+METRICS_SUFFIX = ".a2pm"  # sidecar file of parsed metrics (AFM name + suffix)
+WEIGTHS = {  # magic numbers
+    'Light': 300,
+    'Regular': 400,
+    'Normal': 400,
+    'Book': 400,
+    'Medium': 500,
+    'Demi': 500,
+    'Bold': 700,
+    'Black': 1000,
+}
+AFM_HEADERS_DEFAULTS = {
+    'FontName': "FontAnna",
+    'Weight': WEIGTHS['Regular'],
+    'ItalicAngle': 0,
+    'IsFixedPitch': 'false',
+    'CapHeight': 750,
+    'XHeight': 400,
+    'Descender': -250,
+    'Ascender': 750,
+    'UnderlinePosition': -200,
+    'UnderlineThickness': 40,
+    'EncodingScheme': "FontSpecific",  # not used
+    'Version': "0.000",  # not used
+    'FullName': "FontAnna",  # not used
+    'FamilyName': "FontAnna",  # not used
+}
+
+KERNS_CHUNK_SIZE = 1 << 18  # bytes of KernPairs section parsed at once by the fast parser
+AFM_SECTIONS = {  # section keywords indexed by LazyAfm: keyword of the section after which they are searched
+    "StartCharMetrics": None,  # after the StartFontMetrics line
+    "EndCharMetrics": "StartCharMetrics",
+    "StartKernPairs": "EndCharMetrics",
+    "EndKernPairs": "StartKernPairs",
+    "StartComposites": "EndCharMetrics",
+    "EndComposites": "StartComposites",
+}
+AFM_INDEX_SUFFIX = ".a2pidx"  # sidecar file of AFM section index (AFM name + suffix)
+KERNS_CHUNK_PAIRS = 1 << 14  # kern pairs collected by read_afm before pruning
+KERNS_PARALLEL_THRESHOLD = 4 << 20  # bytes of KernPairs section below which kerns are parsed serially anyway
+AFM_CHAR_METRICS_RE = re.compile(  # C, WX and N fields of a CharMetrics line, in any order
+    rb"^(?=(?:[^\n;]*;)*?[ \t]*C[ \t]+(-?\d+))"
+    rb"(?=(?:[^\n;]*;)*?[ \t]*WX[ \t]+([^\s;]+))"
+    rb"(?=(?:[^\n;]*;)*?[ \t]*N[ \t]+([^\s;]+))",
+    re.MULTILINE,
+)
+AFM_KERN_PAIRS_RE = re.compile(  # KPX line, or the first character of any other non-blank line
+    rb"^[ \t]*(?:KPX[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)|(\S))", re.MULTILINE
+)
+
+
+class AfmMetrics:
+    """
+    Compact metrics of a font: widths of 256 codes in a typed array with a presence mask, and kern pairs
+    in parallel typed columns (first code, second code, value). Kern tables are pruned, sorted and packed
+    into PFM without creating per-pair objects; afm_widths and afm_kerns are list views as returned by readers.
+    """
+
+    __slots__ = ("widths", "present", "kern_a", "kern_b", "kern_values")
+
+    def __init__(self):
+        self.widths = array.array("d", bytes(8 * 256))
+        self.present = bytearray(256)
+        self.kern_a = array.array("B")
+        self.kern_b = array.array("B")
+        self.kern_values = array.array("d")
+
+    @classmethod
+    def from_lists(cls, afm_widths: list | None, afm_kerns: list | None) -> "AfmMetrics":
+        """ Makes metrics out of reader lists: widths (None for missing codes) and (code, code, kern) tuples. """
+        metrics = cls()
+        for code, width in enumerate(afm_widths or ()):
+            if width is not None:
+                metrics.widths[code] = width
+                metrics.present[code] = 1
+        if afm_kerns:
+            codes_a, codes_b, kerns = zip(*afm_kerns)
+            metrics.kern_a = array.array("B", codes_a)
+            metrics.kern_b = array.array("B", codes_b)
+            metrics.kern_values = array.array("d", kerns)
+        return metrics
+
+    @property
+    def kerns_num(self) -> int:
+        """ Returns number of kern pairs kept. """
+        return len(self.kern_values)
+
+    def to_bytes(self, afm_values: dict, afm_digest: bytes, kern_limit: int | None) -> bytes:
+        """
+        Serializes parse result into versioned binary format (no pickle): METRICS_HEADER, afm_values as JSON,
+        widths (256 doubles), presence mask, kern columns (codes as bytes, values as doubles), little endian.
+        afm_digest (sha256 of AFM) and kern_limit used by the parser are stored to validate the data when loaded.
+        """
+        values = json.dumps(afm_values, separators=(",", ":")).encode("utf-8")
+        widths, kern_values = array.array("d", self.widths), array.array("d", self.kern_values)
+        if sys.byteorder != "little":
+            widths.byteswap()
+            kern_values.byteswap()
+        header = METRICS_HEADER.pack(b"A2PM", METRICS_FORMAT, 0, kern_limit or 0, afm_digest, len(values), self.kerns_num)
+        return b"".join((header, values, widths.tobytes(), self.present, self.kern_a.tobytes(), self.kern_b.tobytes(),
+                         kern_values.tobytes()))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, afm_digest: bytes | None = None, kern_limit: int | None = None) -> typing.Tuple[dict, "AfmMetrics"]:
+        """ Deserializes data made by to_bytes into afm_values and metrics, ValueError if it is invalid or does not match. """
+        if len(data) < METRICS_HEADER.size:
+            raise ValueError("A2P: Metrics data truncated.")
+        magic, version, _, limit, digest, values_length, kerns_num = METRICS_HEADER.unpack_from(data)
+        if magic != b"A2PM" or version != METRICS_FORMAT:
+            raise ValueError(f"A2P: Not metrics data of format {METRICS_FORMAT}.")
+        if afm_digest is not None and (digest != afm_digest or limit != (kern_limit or 0)):
+            raise ValueError("A2P: Metrics data made of different AFM or with different kern limit.")
+        offset = METRICS_HEADER.size
+        if len(data) != offset + values_length + 256 * 9 + 10 * kerns_num:
+            raise ValueError("A2P: Metrics data truncated.")
+        view = memoryview(data)
+        afm_values = json.loads(bytes(view[offset:offset + values_length]))
+        offset += values_length
+        metrics = cls()
+        metrics.widths = array.array("d", view[offset:offset + 2048].tobytes())
+        metrics.present = bytearray(view[offset + 2048:offset + 2304])
+        offset += 2304
+        metrics.kern_a = array.array("B", view[offset:offset + kerns_num].tobytes())
+        metrics.kern_b = array.array("B", view[offset + kerns_num:offset + 2 * kerns_num].tobytes())
+        metrics.kern_values = array.array("d", view[offset + 2 * kerns_num:].tobytes())
+        if sys.byteorder != "little":
+            metrics.widths.byteswap()
+            metrics.kern_values.byteswap()
+        return afm_values, metrics
+
+    @property
+    def afm_widths(self) -> typing.List[float | None]:
+        """ Widths as a list of 256 values, None for missing codes. """
+        return [width if present else None for width, present in zip(self.widths, self.present)]
+
+    @property
+    def afm_kerns(self) -> typing.List[typing.Tuple[int, int, float]]:
+        """ Kern pairs as a list of (code, code, kern) tuples. """
+        return list(zip(self.kern_a, self.kern_b, self.kern_values))
+
+    def take_kerns(self, indexes: typing.Sequence[int]):
+        """ Keeps only kern pairs of given indexes, in their order. """
+        if len(indexes) < 2:  # itemgetter of one index does not return a tuple
+            indexes = list(indexes)
+            self.kern_a = array.array("B", [self.kern_a[index] for index in indexes])
+            self.kern_b = array.array("B", [self.kern_b[index] for index in indexes])
+            self.kern_values = array.array("d", [self.kern_values[index] for index in indexes])
+            return
+        take = operator.itemgetter(*indexes)
+        self.kern_a = array.array("B", take(self.kern_a))
+        self.kern_b = array.array("B", take(self.kern_b))
+        self.kern_values = array.array("d", take(self.kern_values))
+
+    def select_kerns(self, limit: int) -> float | None:
+        """
+        Keeps limit kerns of the biggest magnitude ordered by magnitude (of equal values earlier pairs first,
+        like stable sorting of all kerns). Returns magnitude of the biggest dropped kern, or None.
+        """
+        magnitudes = list(map(abs, self.kern_values))
+        if len(magnitudes) > 4 * limit:
+            selected = heapq.nlargest(limit + 1, range(len(magnitudes)), key=magnitudes.__getitem__)
+        else:  # sorting is faster when most kerns are kept, both are stable
+            selected = sorted(range(len(magnitudes)), key=magnitudes.__getitem__, reverse=True)[:limit + 1]
+        dropped_max = magnitudes[selected.pop()] if len(selected) > limit else None
+        self.take_kerns(selected)
+        return dropped_max
+
+    def sort_kerns(self):
+        """ Sorts kern pairs in the order of PFM kern table: by second code, then by first one (stable). """
+        keys = [code_b << 8 | code_a for code_a, code_b in zip(self.kern_a, self.kern_b)]
+        self.take_kerns(sorted(range(len(keys)), key=keys.__getitem__))
+
+    def pack_kerns_into(self, buffer, offset: int = 0):
+        """ Packs kern pairs as PFM KERNPAIR structures (BBh, little endian) into a writable buffer. """
+        kerns_num = self.kerns_num
+        values = array.array("h", map(round, self.kern_values))  # was: int() !
+        if sys.byteorder != "little":
+            values.byteswap()
+        values = values.tobytes()
+        packed = bytearray(4 * kerns_num)
+        packed[0::4] = self.kern_a.tobytes()
+        packed[1::4] = self.kern_b.tobytes()
+        packed[2::4] = values[0::2]
+        packed[3::4] = values[1::2]
+        buffer[offset:offset + len(packed)] = packed
+
+
+class TopKerns:
+    """
+    Keeps limit kerns of the biggest magnitude out of a stream of kern pairs, in bounded memory (a heap).
+    Selection is the same as stable sorting all kerns by magnitude and cutting the list: of equal values earlier pairs win.
+    """
+
+    def __init__(self, limit: int = PFM_KERNS_LIMIT):
+        self.limit = limit
+        self.heap = []
+        self.total = 0
+        self.dropped_max = None
+
+    def extend(self, afm_kerns: typing.Iterable[typing.Tuple[int, int, float]]):
+        """ Adds kern pairs (in the order of AFM file). """
+        heap = self.heap
+        index = self.total
+        for code_a, code_b, kern in afm_kerns:  # push inlined, this loop is hot
+            item = (abs(kern), -index, code_a, code_b, kern)
+            index += 1
+            if len(heap) < self.limit:
+                heapq.heappush(heap, item)
+                continue
+            if item > heap[0]:
+                item = heapq.heapreplace(heap, item)
+            if self.dropped_max is None or item[0] > self.dropped_max:
+                self.dropped_max = item[0]
+        self.total = index
+
+    def extend_columns(self, codes_a: typing.Iterable[int], codes_b: typing.Iterable[int], kerns: typing.Iterable[float]):
+        """
+        Same as extend for kern pairs given as columns (see AfmReader.parse_kern_fields), faster for big chunks:
+        only limit biggest kerns of the columns (selected by heapq.nlargest, stable like sorting) go through the heap.
+        """
+        codes_a, codes_b, kerns = list(codes_a), list(codes_b), list(kerns)
+        selected = range(len(kerns))
+        if len(kerns) > self.limit:
+            magnitudes = list(map(abs, kerns))
+            selected = heapq.nlargest(self.limit + 1, selected, key=magnitudes.__getitem__)
+            self.drop(magnitudes[selected.pop()])
+            selected.sort()
+        for i in selected:
+            self.push((abs(kerns[i]), -(self.total + i), codes_a[i], codes_b[i], kerns[i]))
+        self.total += len(kerns)
+
+    def push(self, item: tuple):
+        """ Adds heap item (magnitude, -index, code, code, kern), drops the smallest one if there are too many. """
+        heap = self.heap
+        if len(heap) < self.limit:
+            heapq.heappush(heap, item)
+            return
+        if item > heap[0]:
+            item = heapq.heapreplace(heap, item)
+        self.drop(item[0])
+
+    def drop(self, magnitude: float):
+        """ Records a dropped kern. """
+        if self.dropped_max is None or magnitude > self.dropped_max:
+            self.dropped_max = magnitude
+
+    def merge(self, other: "TopKerns"):
+        """
+        Adds kerns selected by other instance from the pairs following all already added ones (e.g. the next chunk).
+        Pairs missing in other one cannot be selected here either, so the result is the same as of a single instance.
+        """
+        self.extend(other.kerns())
+        self.total += other.total - len(other.heap)
+        if other.dropped_max is not None and (self.dropped_max is None or other.dropped_max > self.dropped_max):
+            self.dropped_max = other.dropped_max
+
+    def kerns(self) -> typing.List[typing.Tuple[int, int, float]]:
+        """ Returns selected kerns in the order of AFM file. """
+        return [item[2:] for item in sorted(self.heap, key=lambda item: -item[1])]
+
+    def update_values(self, afm_values: dict):
+        """ Records the original number of kerns and the biggest dropped value for PfmWriter.prepare_kerns. """
+        if self.total > len(self.heap):
+            afm_values["KERNS_TOTAL"] = self.total
+            afm_values["KERNS_DROPPED_MAX"] = self.dropped_max
+
+
+class AfmGlyphs(typing.NamedTuple):
+    """
+    Glyph name indexed metrics of an AFM, parsed once (see AfmReader.parse_afm_glyphs) and turned into
+    reader-like data for the native encoding of the AFM or for any number of encoding vectors.
+    """
+    values: dict  # AFM header values
+    metrics: list  # (code, width, name) of all glyphs in AFM order, code -1 for unencoded ones
+    kerns: list  # (name_a, name_b, kern) of all kern pairs of known glyphs in AFM order
+
+    def encode(self, encoding: Encoding | None = None) -> typing.Tuple[dict, list, list]:
+        """ Returns afm_values, afm_widths and afm_kerns (as returned by AfmReader) for the encoding. """
+        afm_values = dict(self.values)
+        if encoding is None:
+            entries = [(code, width, name) for code, width, name in self.metrics if code >= 0]
+        else:
+            widths = {name: width for _, width, name in self.metrics}
+            entries = [(code, widths[name], name) for code, name in enumerate(encoding.vector) if name in widths]
+            afm_values["PFMcharset"] = encoding.charset
+        afm_widths, afm_codes = AfmReader.collect_widths(entries, afm_values)
+
+        if encoding is None:
+            codes = {name: (code,) for name, code in afm_codes.items()}
+        else:
+            codes = {}
+            for code, _, name in entries:
+                codes[name] = codes.get(name, ()) + (code,)
+        afm_kerns = []
+        for name_a, name_b, kern in self.kerns:
+            codes_a = codes.get(name_a)
+            if codes_a is not None:
+                codes_b = codes.get(name_b)
+                if codes_b is not None:
+                    afm_kerns.extend((code_a, code_b, kern) for code_a in codes_a for code_b in codes_b)
+        return afm_values, afm_widths, afm_kerns
+
+
+class AfmReader:
+    """
+    Simple AFM file reader, reads AFM and converts it into data structures:
+    dict with font properties, and two lists with characters widths and kerns.
+    """
+
+    @staticmethod
+    def parse_header_line(line: str, afm_values: dict):
+        """ Parses one line of AFM header (part before StartCharMetrics) into afm_values. """
+        fields = line.strip().split()
+        if fields[0] in AFM_HEADERS_DEFAULTS:
+            afm_values[fields[0]] = fields[1]
+        elif line.startswith("PFMParams"):  # obsolete convention
+            afm_values["PFMname"] = fields[2]
+            afm_values["PFMbold"] = fields[3]
+            afm_values["PFMitalic"] = fields[4]
+        elif line.startswith("PFM parameters"):
+            if len(fields) >= 4 and fields[3] != "*":
+                afm_values["PFMname"] = fields[3]
+            if len(fields) >= 5 and fields[4] != "*":
+                afm_values["PFMbold"] = fields[4]
+            if len(fields) >= 6 and fields[5] != "*":
+                afm_values["PFMitalic"] = fields[5]
+            if len(fields) >= 7 and fields[6] != "*":
+                afm_values["PFMcharset"] = int(fields[6], 16) if fields[6].startswith("0x") else int(fields[6])
+        elif line.startswith("Notice"):
+            afm_values["Notice"] = line[7:].strip()
+        elif line.startswith("FontBBox"):
+            afm_values["llx"] = float(fields[1].strip(",;"))
+            afm_values["lly"] = float(fields[2].strip(",;"))
+            afm_values["urx"] = float(fields[3].strip(",;"))
+            afm_values["ury"] = float(fields[4].strip(",;"))
+
+    @staticmethod
+    def parse_header_lines(lines: typing.Iterable[str], afm_values: dict, first_line: int = 2):
+        """
+        Parses AFM header lines (numbered from first_line) into afm_values, up to StartCharMetrics line.
+        Blank lines are skipped, malformed ones raise ValueError.
+        """
+        for line_number, line in enumerate(lines, first_line):
+            if line.startswith("StartCharMetrics"):
+                break
+            if not line.strip():
+                continue
+            try:
+                AfmReader.parse_header_line(line, afm_values)
+            except (IndexError, ValueError) as exc:
+                raise ValueError(f"A2P: Malformed AFM header line {line_number}: {line.strip()}") from exc
+
+    @staticmethod
+    def char_metrics_entries(lines: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[int, float, str]]:
+        """ Yields (code, width, name) of encoded glyphs of CharMetrics lines (fields by position), up to EndCharMetrics. """
+        for line in lines:
+            if line.startswith("EndCharMetrics"):
+                break
+            fields = line.strip().split()
+            char_code = int(fields[1])
+            if char_code >= 0:  # was > 0 !
+                yield char_code, float(fields[4]), fields[7]
+
+    @staticmethod
+    def read_afm(
+        afm_filename: str,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+    ) -> typing.Tuple[dict, list, list]:
+        """
+        Reads AFM from file and organize font info into data structures.
+        With kern_limit only that many biggest kerns are kept while reading (see TopKerns).
+        """
+        afm_values: typing.Dict[str, str | int | float] = {}
+        afm_kerns: typing.List[typing.Tuple[int, int, float]] = []
+        top_kerns = TopKerns(kern_limit) if kern_limit else None
+
+        with stats.phase("read_afm"), open(afm_filename, "r", encoding=STRING_ENCODING) as afm_file:
+            first_line = afm_file.readline()
+            if not first_line.startswith("StartFontMetrics"):
+                raise RuntimeError("A2P: Not an AFM file (improper header).")
+            if stats.enabled:
+                afm_file = AfmReader.counted_lines(afm_file, stats)
+
+            AfmReader.parse_header_lines(afm_file, afm_values)
+            afm_widths, afm_codes = AfmReader.collect_widths(AfmReader.char_metrics_entries(afm_file), afm_values)
+
+            for line in afm_file:
+                if line.startswith("StartKernPairs"):
+                    break
+            for line in afm_file:
+                if line.startswith("EndKernPairs"):
+                    break
+                fields = line.strip().split()
+                head, char_a, char_b, kern = fields[0], fields[1], fields[2], float(fields[3])
+
+                if head != "KPX":
+                    raise ValueError("Malformed AFM kern table")
+
+                if char_a in afm_codes and char_b in afm_codes:
+                    afm_kerns.append((afm_codes[char_a], afm_codes[char_b], kern))
+                    if top_kerns and len(afm_kerns) >= KERNS_CHUNK_PAIRS:
+                        with stats.phase("select_kerns"):
+                            top_kerns.extend(afm_kerns)
+                        afm_kerns.clear()
+
+        stats.count("glyphs", len(afm_codes))
+        if top_kerns:
+            with stats.phase("select_kerns"):
+                top_kerns.extend(afm_kerns)
+            top_kerns.update_values(afm_values)
+            afm_kerns = top_kerns.kerns()
+        stats.count("kern_pairs_read", top_kerns.total if top_kerns else len(afm_kerns))
+        return afm_values, afm_widths, afm_kerns
+
+    @staticmethod
+    def counted_lines(lines: typing.Iterable[str], stats: Stats) -> typing.Iterator[str]:
+        """ Passes lines through, counting them (lines_scanned, first line included) in stats. """
+        count = 1
+        try:
+            for count, line in enumerate(lines, 2):
+                yield line
+        finally:
+            stats.count("lines_scanned", count)
+
+    @staticmethod
+    def parse_afm_header(afm_data: bytes) -> dict:
+        """ Parses AFM header given as bytes (without the first StartFontMetrics line) into afm_values. """
+        afm_values: typing.Dict[str, str | int | float] = {}
+        text = bytes(afm_data).decode(STRING_ENCODING).replace("\r\n", "\n").replace("\r", "\n")
+        AfmReader.parse_header_lines((line + "\n" for line in text.split("\n")), afm_values)
+        return afm_values
+
+    @staticmethod
+    def parse_char_metrics(afm_data: bytes, afm_values: dict) -> typing.Tuple[list, dict]:
+        """
+        Parses CharMetrics section given as bytes, fields are found by key (C, WX, N) not by position.
+        Sets computed values in afm_values and returns widths and mapping of glyph names (as bytes) to codes.
+        """
+        entries = ((char_code, float(width), char_name) for code, width, char_name in AFM_CHAR_METRICS_RE.findall(afm_data)
+                   if (char_code := int(code)) >= 0)
+        return AfmReader.collect_widths(entries, afm_values)
+
+    @staticmethod
+    def collect_widths(entries: typing.Iterable[tuple], afm_values: dict) -> typing.Tuple[list, dict]:
+        """
+        Makes widths table and mapping of glyph names to codes out of (code, width, name) entries of encoded glyphs
+        (names as str or bytes), sets computed values in afm_values.
+        """
+        afm_widths: typing.List[float | None] = [None] * 256
+        afm_codes = {}
+        default_char = ""
+        first_char = 255
+        last_char = 0
+        avg_width = 0
+        max_width = 0
+        for char_code, width, char_name in entries:
+            afm_widths[char_code] = width
+            afm_codes[char_name] = char_code
+            if char_code < first_char:
+                first_char = char_code
+            if char_code > last_char:
+                last_char = char_code
+            if width > max_width:
+                max_width = width
+
+            if char_name in (b"X", "X"):
+                avg_width = width
+            if char_name in (b"bullet", "bullet"):
+                default_char = char_code
+        afm_values["DEFAULT_CHAR"] = default_char
+        afm_values["FIRST_CHAR"] = first_char
+        afm_values["LAST_CHAR"] = last_char
+        afm_values["AVG_WIDTH"] = avg_width
+        afm_values["MAX_WIDTH"] = max_width
+        return afm_widths, afm_codes
+
+    @staticmethod
+    def parse_kern_pairs(afm_data: bytes, afm_codes: dict) -> typing.List[typing.Tuple[int, int, float]]:
+        """ Parses KernPairs section given as bytes, pairs of glyphs missing in afm_codes are skipped. """
+        return list(zip(*AfmReader.parse_kern_fields(afm_data, afm_codes)))
+
+    @staticmethod
+    def parse_kern_columns(afm_data: bytes, afm_codes: dict, metrics: AfmMetrics):
+        """ Same as parse_kern_pairs, but kerns are appended to typed columns of metrics. """
+        codes_a, codes_b, kerns = AfmReader.parse_kern_fields(afm_data, afm_codes)
+        metrics.kern_a.extend(codes_a)
+        metrics.kern_b.extend(codes_b)
+        metrics.kern_values.extend(kerns)
+
+    @staticmethod
+    def count_kern_pairs(afm_data: bytes, afm_codes: dict) -> int:
+        """ Counts kern pairs of KernPairs section given as bytes which parse_kern_fields would return, without parsing values. """
+        afm_data = b"\n" + bytes(afm_data)
+        pairs_num = afm_data.count(b"\nKPX ")
+        fields = afm_data.replace(b"\nKPX ", b"\n").split()
+        if len(fields) == 3 * pairs_num:
+            known = afm_codes.__contains__
+            return sum(map(operator.and_, map(known, fields[0::3]), map(known, fields[1::3])))
+        return len(AfmReader.parse_kern_fields(afm_data, afm_codes)[0])
+
+    @staticmethod
+    def parse_kern_fields(afm_data: bytes, afm_codes: dict) -> typing.Tuple[typing.Iterable, typing.Iterable, typing.Iterable]:
+        """ Parses KernPairs section given as bytes into iterables of first codes, second codes and kerns. """
+        afm_data = b"\n" + bytes(afm_data)
+        pairs_num = afm_data.count(b"\nKPX ")
+        fields = afm_data.replace(b"\nKPX ", b"\n").split()
+        if len(fields) == 3 * pairs_num:  # regular table, every line is 'KPX a b kern'
+            names_a, names_b, kerns = fields[0::3], fields[1::3], fields[2::3]
+            known = afm_codes.__contains__
+            selected = list(map(operator.and_, map(known, names_a), map(known, names_b)))
+            return (
+                map(afm_codes.get, itertools.compress(names_a, selected)),
+                map(afm_codes.get, itertools.compress(names_b, selected)),
+                map(float, itertools.compress(kerns, selected)),
+            )
+
+        codes_a, codes_b, values = [], [], []
+        for char_a, char_b, kern, malformed in AFM_KERN_PAIRS_RE.findall(afm_data):
+            if malformed:
+                raise ValueError("Malformed AFM kern table")
+            code_a = afm_codes.get(char_a)
+            if code_a is not None:
+                code_b = afm_codes.get(char_b)
+                if code_b is not None:
+                    codes_a.append(code_a)
+                    codes_b.append(code_b)
+                    values.append(float(kern))
+        return codes_a, codes_b, values
+
+    @staticmethod
+    def parse_afm(
+        afm_data: bytes,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+    ) -> typing.Tuple[dict, list, list]:
+        """
+        Parses AFM given as bytes-like object (bytes, memoryview, mmap...), faster equivalent of read_afm.
+        Sections are located with a single scan and parsed without splitting data into lines.
+        With kern_limit kerns are parsed in chunks and only that many biggest are kept (see TopKerns).
+        """
+        afm_values, metrics = AfmReader.parse_afm_metrics(afm_data, kern_limit, stats)
+        return afm_values, metrics.afm_widths, metrics.afm_kerns
+
+    @staticmethod
+    def parse_afm_metrics(
+        afm_data: bytes,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+        kern_workers: int = 1,
+    ) -> typing.Tuple[dict, AfmMetrics]:
+        """
+        Same as parse_afm, but widths and kerns are returned as compact AfmMetrics (see PfmWriter.prepare_metrics).
+        With kern_workers > 1 big KernPairs sections are parsed by a pool of processes (see LazyAfm.parse_kerns_parallel).
+        """
+        with gc_paused(), stats.phase("parse_afm"):
+            return AfmReader._parse_afm(afm_data, kern_limit, stats, kern_workers)
+
+    @staticmethod
+    def _parse_afm(afm_data: bytes, kern_limit: int | None, stats: Stats, kern_workers: int = 1) -> typing.Tuple[dict, AfmMetrics]:
+        afm = LazyAfm(afm_data, kern_limit, stats, kern_workers)
+        if stats.enabled:
+            stats.count("lines_scanned", bytes(afm.data).count(b"\n"))  # mmap has no count, copying is fine here
+        metrics = afm.metrics
+        return afm.values, metrics
+
+    @staticmethod
+    def parse_afm_glyphs(afm_data: bytes, stats: Stats = NO_STATS) -> AfmGlyphs:
+        """
+        Parses AFM given as bytes-like object into glyph name indexed metrics, including unencoded glyphs
+        and all their kerns, to be encoded any number of times (see AfmGlyphs.encode).
+        """
+        with gc_paused(), stats.phase("parse_afm"):
+            afm = LazyAfm(afm_data)
+            metrics = [(int(code), float(width), char_name) for code, width, char_name
+                       in AFM_CHAR_METRICS_RE.findall(afm.section_data("StartCharMetrics", "EndCharMetrics"))]
+            names = {char_name: char_name for _, _, char_name in metrics}
+            kerns = AfmReader.parse_kern_pairs(afm.section_data("StartKernPairs", "EndKernPairs"), names)
+            afm_values = afm.values
+        stats.count("glyphs", len(metrics))
+        stats.count("kern_pairs_read", len(kerns))
+        return AfmGlyphs(afm_values, metrics, kerns)
+
+    @staticmethod
+    def find_line(afm_data: bytes, keyword: bytes, start: int) -> typing.Tuple[int, int]:
+        """
+        Finds the first line starting with keyword at or after start, returns offsets of the line
+        and of the next one (or twice the size of data if there is no such line).
+        """
+        size = len(afm_data)
+        line_start = afm_data.find(b"\n" + keyword, max(start - 1, 0)) + 1
+        if not line_start:
+            return size, size
+        return line_start, afm_data.find(b"\n", line_start) + 1 or size
+
+    @staticmethod
+    def split_lines(afm_data: bytes, start: int, end: int, chunk_size: int) -> typing.Iterator[typing.Tuple[int, int]]:
+        """ Splits range of data into chunks of about chunk_size bytes, ending at line ends. """
+        while start < end:
+            chunk_end = min(afm_data.find(b"\n", min(start + chunk_size, end) - 1) + 1 or end, end)
+            yield start, chunk_end
+            start = chunk_end
+
+    @staticmethod
+    def read_afm_mmap(
+        afm_filename: str,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+    ) -> typing.Tuple[dict, list, list]:
+        """ Reads AFM from memory mapped file with the fast parser (see parse_afm). """
+        afm_values, metrics = AfmReader.read_afm_metrics(afm_filename, kern_limit, stats)
+        return afm_values, metrics.afm_widths, metrics.afm_kerns
+
+    @staticmethod
+    def read_afm_metrics(
+        afm_filename: str,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+        kern_workers: int = 1,
+    ) -> typing.Tuple[dict, AfmMetrics]:
+        """ Same as read_afm_mmap, but widths and kerns are returned as compact AfmMetrics. """
+        with open(afm_filename, "rb") as afm_file:
+            if os.fstat(afm_file.fileno()).st_size == 0:
+                return AfmReader.parse_afm_metrics(b"", kern_limit, stats, kern_workers)
+            with mmap.mmap(afm_file.fileno(), 0, access=mmap.ACCESS_READ) as afm_data:
+                return AfmReader.parse_afm_metrics(afm_data, kern_limit, stats, kern_workers)
+
+    @staticmethod
+    def read_afm_header(afm_filename: str) -> dict:
+        """ Reads only the header of AFM file (values before StartCharMetrics), the rest of the file is not touched. """
+        with LazyAfm.open(afm_filename) as afm:
+            return afm.values
+
+    @staticmethod
+    def read_afm_stream(
+        afm_source: typing.BinaryIO | bytes,
+        kern_limit: int | None = None,
+        stats: Stats = NO_STATS,
+    ) -> typing.Tuple[dict, list, list]:
+        """ Reads AFM from a binary stream (e.g. archive member) or from a buffer with the fast parser. """
+        afm_data = afm_source.read() if hasattr(afm_source, "read") else afm_source
+        return AfmReader.parse_afm(afm_data, kern_limit, stats)
+
+
+class LazyAfm:
+    """
+    AFM given as bytes-like object (bytes, mmap...) parsed section by section when first accessed:
+    values (header only), widths and codes (CharMetrics), metrics (widths and kerns, see AfmMetrics).
+    Sections are located with bytes.find and their offsets kept in sections, so header-only queries touch
+    only the beginning of the file. Offsets of files can be stored in an index file (see save_index).
+    """
+
+    def __init__(self, afm_data: bytes, kern_limit: int | None = None, stats: Stats = NO_STATS, kern_workers: int = 1):
+        if not hasattr(afm_data, "find"):  # e.g. memoryview
+            afm_data = bytes(afm_data)
+        head = afm_data[:4096]
+        if not head.startswith(b"StartFontMetrics"):
+            raise RuntimeError("A2P: Not an AFM file (improper header).")
+        if b"\n" not in head and b"\r" in head:  # classic Mac line endings
+            afm_data = bytes(afm_data).replace(b"\r", b"\n")
+        self.data = afm_data
+        self.kern_limit = kern_limit
+        self.stats = stats
+        self.kern_workers = kern_workers
+        self.header_start = afm_data.find(b"\n") + 1  # after StartFontMetrics line
+        self.sections: typing.Dict[str, typing.Tuple[int, int]] = {}
+        self.afm_filename = None
+        self.afm_stat = None
+        self.index_dir = None
+
+    @classmethod
+    def open(cls, afm_filename: str, kern_limit: int | None = None, stats: Stats = NO_STATS,
+             use_index: bool = False, index_dir: str | None = None) -> "LazyAfm":
+        """
+        Opens AFM file (memory mapped), with use_index section offsets are taken from a valid index file,
+        kept in index_dir or with no index_dir in a sidecar file next to the AFM (see index_path).
+        """
+        with open(afm_filename, "rb") as afm_file:
+            afm_stat = os.fstat(afm_file.fileno())
+            afm_data = mmap.mmap(afm_file.fileno(), 0, access=mmap.ACCESS_READ) if afm_stat.st_size else b""
+        try:
+            afm = cls(afm_data, kern_limit, stats)
+        except Exception:
+            if isinstance(afm_data, mmap.mmap):
+                afm_data.close()
+            raise
+        afm.afm_filename = afm_filename
+        afm.afm_stat = afm_stat
+        afm.index_dir = index_dir
+        if use_index:
+            afm.load_index()
+        return afm
+
+    def close(self):
+        """ Releases memory map of the AFM file, if any. """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def locate(self, keyword: str) -> typing.Tuple[int, int]:
+        """ Returns offsets of the section line and of the next one (size of data twice for missing section). """
+        if keyword not in self.sections:
+            after = AFM_SECTIONS[keyword]
+            start = self.header_start if after is None else self.locate(after)[1]
+            self.sections[keyword] = AfmReader.find_line(self.data, keyword.encode("ascii"), start)
+        return self.sections[keyword]
+
+    def section_data(self, start_keyword: str, end_keyword: str) -> bytes:
+        """ Returns contents of a section, between its start and end lines. """
+        return self.data[self.locate(start_keyword)[1]:self.locate(end_keyword)[0]]
+
+    def index(self) -> typing.Dict[str, typing.Tuple[int, int]]:
+        """ Locates all sections (see AFM_SECTIONS), returns their offsets. """
+        for keyword in AFM_SECTIONS:
+            self.locate(keyword)
+        return dict(self.sections)
+
+    def index_path(self) -> str:
+        """ Returns path of index file: in index_dir named by hash of AFM path, or next to AFM (NAME.afm.a2pidx). """
+        if self.index_dir is None:
+            return self.afm_filename + AFM_INDEX_SUFFIX
+        key = hashlib.sha256(os.path.abspath(self.afm_filename).encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.index_dir, key[:2], key + AFM_INDEX_SUFFIX)
+
+    def load_index(self) -> bool:
+        """ Takes section offsets from sidecar file if it matches size and mtime of AFM, returns if it did. """
+        try:
+            with open(self.index_path(), "r", encoding="utf-8") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return False
+        if index.get("size") != self.afm_stat.st_size or index.get("mtime_ns") != self.afm_stat.st_mtime_ns:
+            return False
+        self.sections.update({keyword: tuple(offsets) for keyword, offsets in index["sections"].items()
+                              if keyword in AFM_SECTIONS})
+        return True
+
+    def save_index(self):
+        """ Writes section offsets into index file (atomically). """
+        index = {"size": self.afm_stat.st_size, "mtime_ns": self.afm_stat.st_mtime_ns, "sections": self.index()}
+        write_file_atomic(self.index_path(), json.dumps(index).encode("utf-8"))
+
+    @functools.cached_property
+    def values(self) -> dict:
+        """ Header values (afm_values); values computed from CharMetrics and kerns are added when they are parsed. """
+        return AfmReader.parse_afm_header(self.data[self.header_start:self.locate("StartCharMetrics")[0]])
+
+    @functools.cached_property
+    def _char_metrics(self) -> typing.Tuple[list, dict]:
+        return AfmReader.parse_char_metrics(self.section_data("StartCharMetrics", "EndCharMetrics"), self.values)
+
+    @property
+    def widths(self) -> typing.List[float | None]:
+        """ Widths of 256 codes (afm_widths). """
+        return self._char_metrics[0]
+
+    @property
+    def codes(self) -> typing.Dict[bytes, int]:
+        """ Codes of encoded glyphs by name. """
+        return self._char_metrics[1]
+
+    @functools.cached_property
+    def metrics(self) -> AfmMetrics:
+        """ Widths and kerns (only kern_limit biggest ones if set, see TopKerns). """
+        afm_codes = self.codes
+        kerns_start = self.locate("StartKernPairs")[1]
+        kerns_end = self.locate("EndKernPairs")[0]
+        if self.kern_workers > 1 and kerns_end - kerns_start >= KERNS_PARALLEL_THRESHOLD:
+            return self.parse_kerns_parallel(kerns_start, kerns_end)
+        chunks = AfmReader.split_lines(self.data, kerns_start, kerns_end, KERNS_CHUNK_SIZE)
+        if self.kern_limit:
+            top_kerns = TopKerns(self.kern_limit)
+            for chunk_start, chunk_end in chunks:
+                columns = [list(column) for column in AfmReader.parse_kern_fields(self.data[chunk_start:chunk_end], afm_codes)]
+                with self.stats.phase("select_kerns"):
+                    top_kerns.extend_columns(*columns)
+            top_kerns.update_values(self.values)
+            metrics = AfmMetrics.from_lists(self.widths, top_kerns.kerns())
+        else:  # parsed in chunks too, so only the compact columns grow with the size of kern table
+            metrics = AfmMetrics.from_lists(self.widths, None)
+            for chunk_start, chunk_end in chunks:
+                AfmReader.parse_kern_columns(self.data[chunk_start:chunk_end], afm_codes, metrics)
+        self.stats.count("glyphs", len(afm_codes))
+        self.stats.count("kern_pairs_read", top_kerns.total if self.kern_limit else metrics.kerns_num)
+        return metrics
+
+    def parse_kerns_parallel(self, kerns_start: int, kerns_end: int) -> AfmMetrics:
+        """
+        Parses KernPairs section split into line aligned chunks by kern_workers processes sharing glyph codes.
+        Results are merged in the order of chunks, so they are the same as of serial parsing.
+        """
+        afm_codes = self.codes
+        chunk_size = max(KERNS_CHUNK_SIZE, (kerns_end - kerns_start) // (4 * self.kern_workers) + 1)
+        jobs = ((bytes(self.data[chunk_start:chunk_end]), self.kern_limit)
+                for chunk_start, chunk_end in AfmReader.split_lines(self.data, kerns_start, kerns_end, chunk_size))
+        metrics = AfmMetrics.from_lists(self.widths, None)
+        top_kerns = TopKerns(self.kern_limit) if self.kern_limit else None
+        with self.stats.phase("parse_kerns_parallel"), concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.kern_workers, initializer=_init_kern_worker, initargs=(afm_codes,)) as executor:
+            for result in executor.map(_parse_kern_chunk, jobs):
+                if top_kerns is not None:
+                    top_kerns.merge(result)
+                else:
+                    metrics.kern_a.extend(result[0])
+                    metrics.kern_b.extend(result[1])
+                    metrics.kern_values.extend(result[2])
+        if top_kerns is not None:
+            top_kerns.update_values(self.values)
+            metrics = AfmMetrics.from_lists(self.widths, top_kerns.kerns())
+        self.stats.count("glyphs", len(afm_codes))
+        self.stats.count("kern_pairs_read", top_kerns.total if top_kerns is not None else metrics.kerns_num)
+        return metrics
+
+
+_kern_worker_codes: typing.Dict[bytes, int] = {}
+
+
+def _init_kern_worker(afm_codes: typing.Dict[bytes, int]):
+    """ Initializer of kern parsing processes, glyph codes are sent once per process instead of once per chunk. """
+    _kern_worker_codes.clear()
+    _kern_worker_codes.update(afm_codes)
+
+
+def _parse_kern_chunk(job: tuple) -> "TopKerns | tuple":
+    """ Process pool entry point, parses chunk of KernPairs: returns kept biggest kerns (TopKerns) or kern columns. """
+    chunk, kern_limit = job
+    with gc_paused():
+        if kern_limit:
+            top_kerns = TopKerns(kern_limit)
+            top_kerns.extend_columns(*AfmReader.parse_kern_fields(chunk, _kern_worker_codes))
+            return top_kerns
+        metrics = AfmMetrics()
+        AfmReader.parse_kern_columns(chunk, _kern_worker_codes, metrics)
+        return metrics.kern_a, metrics.kern_b, metrics.kern_values
+
+
+class MetricsCache:
+    """
+    Cache of parsed AFMs in binary format (see AfmMetrics.to_bytes), so conversions differing only in overrides
+    or order of tables skip parsing. Entries live in directory, named by AFM content hash and kern limit,
+    or with no directory in sidecar files next to AFMs (NAME.afm.a2pm, validated by the hash kept inside).
+    """
+
+    def __init__(self, directory: str | None = None):
+        self.directory = directory or None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, afm_filename: str, afm_digest: bytes, kern_limit: int | None) -> str:
+        """ Returns path of cache entry. """
+        if self.directory is None:
+            return afm_filename + METRICS_SUFFIX
+        key = afm_digest.hex()
+        return os.path.join(self.directory, key[:2], f"{key}-{kern_limit or 0}{METRICS_SUFFIX}")
+
+    def read_afm(self, afm_filename: str, kern_limit: int | None = None, stats: Stats = NO_STATS) -> typing.Tuple[dict, AfmMetrics]:
+        """ Same as AfmReader.read_afm_metrics, but parse result is taken from the cache when valid or stored there. """
+        with open(afm_filename, "rb") as afm_file:
+            afm_data = afm_file.read()
+        afm_digest = hashlib.sha256(afm_data).digest()
+        path = self.path(afm_filename, afm_digest, kern_limit)
+        with stats.phase("load_metrics"):
+            try:
+                with open(path, "rb") as metrics_file:
+                    result = AfmMetrics.from_bytes(metrics_file.read(), afm_digest, kern_limit)
+            except (OSError, ValueError):
+                result = None
+        stats.count("metrics_cache_misses" if result is None else "metrics_cache_hits")
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        afm_values, metrics = AfmReader.parse_afm_metrics(afm_data, kern_limit, stats)
+        with contextlib.suppress(OSError):  # cache is only an optimization
+            write_file_atomic(path, metrics.to_bytes(afm_values, afm_digest, kern_limit))
+        return afm_values, metrics
@@ -0,0 +1,136 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM asyncio API: convert_many converts jobs with bounded concurrency and yields results as they complete.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import time
+import typing
+
+from a2p.common import write_file_atomic
+from a2p.convert import _convert_job, ConvertOptions, request_options
+
+
+async def _async_jobs(jobs: typing.Iterable) -> typing.AsyncIterator:
+    """ Makes an async iterator of a plain iterable. """
+    for job in jobs:
+        yield job
+
+
+def _read_file(filename: str) -> bytes:
+    with open(filename, "rb") as in_file:
+        return in_file.read()
+
+
+async def _convert_job_async(
+    job_id, afm_filename: str, pfm_filename: str, options: ConvertOptions, executor: concurrent.futures.Executor
+) -> dict:
+    """ Converts one AFM file: reads and writes in threads of the loop, converts in executor (see _convert_job). """
+    loop = asyncio.get_running_loop()
+    result = {"id": job_id, "status": "ok", "input": afm_filename, "output": pfm_filename}
+    try:
+        afm_data = await loop.run_in_executor(None, _read_file, afm_filename)
+        converted = await loop.run_in_executor(executor, _convert_job, (afm_data, options))
+        if converted["pfm"] is not None:
+            result["written"] = await loop.run_in_executor(None, write_file_atomic, pfm_filename, converted["pfm"], options.fsync)
+        result.update(size=len(converted["pfm"] or b""), kerns_dropped=converted["kerns_dropped"],
+                      messages=converted["messages"], error=converted["error"])
+    except OSError as exc:
+        result.update(size=0, error=f"{type(exc).__name__}: {exc}")
+    return result
+
+
+async def _timed_job_async(job_id, afm_filename: str, pfm_filename: str, options: ConvertOptions,
+                           executor: concurrent.futures.Executor, *, timeout: float | None) -> dict:
+    """ Runs _convert_job_async with a timeout, always returns a result (status "ok" or "error"). """
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(_convert_job_async(job_id, afm_filename, pfm_filename, options, executor), timeout)
+    except TimeoutError:
+        result = {"id": job_id, "input": afm_filename, "output": pfm_filename, "size": 0,
+                  "error": f"TimeoutError: Job not done in {timeout} s."}
+    result["status"] = "error" if result["error"] else "ok"
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+async def convert_many(
+    jobs: "typing.Iterable | typing.AsyncIterable",
+    options: ConvertOptions = ConvertOptions(),
+    *,
+    concurrency: int | None = None,
+    timeout: float | None = None,
+    executor: concurrent.futures.Executor | None = None,
+) -> typing.AsyncIterator[dict]:
+    """
+    Asyncio API of jobs mode: converts AFM files and yields results (as in jobs mode) in order of completion.
+    Jobs (a plain or async iterable) are AFM paths or objects as in jobs mode ("input", optional "output", "id"
+    and overrides of options, see request_options). At most concurrency jobs (default: number of CPUs) are in flight,
+    the next ones are taken from jobs only when results are consumed. Files are read and written in threads,
+    conversions run in executor (by default a process pool of concurrency workers, shut down at the end).
+    A job not done in timeout seconds gives an error result; a conversion already running in a worker process
+    cannot be stopped, so it still occupies the worker until it ends. Closing or cancelling the iteration
+    cancels all pending jobs.
+    """
+    concurrency = concurrency or os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=concurrency)
+    jobs = aiter(jobs) if hasattr(jobs, "__aiter__") else _async_jobs(jobs)
+    pending = set()
+    job_number = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    job = await anext(jobs)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                job_number += 1
+                job = {"input": job} if isinstance(job, (str, os.PathLike)) else job
+                job_id = job.get("id", job_number)
+                try:
+                    job_options = request_options(job, options)
+                    afm_filename = os.fspath(job["input"])
+                except (KeyError, TypeError, ValueError) as exc:
+                    yield {"id": job_id, "status": "error", "error": f"{type(exc).__name__}: {exc}"}
+                    continue
+                pfm_filename = os.fspath(job.get("output") or os.path.splitext(afm_filename)[0] + ".pfm")
+                pending.add(asyncio.ensure_future(
+                    _timed_job_async(job_id, afm_filename, pfm_filename, job_options, executor, timeout=timeout)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
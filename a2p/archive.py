@@ -0,0 +1,163 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM archive mode: converts AFM members of zip or tar archive into an archive of PFMs, without extracting them.
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import os
+import tarfile
+import time
+import typing
+import zipfile
+
+from a2p.convert import (
+    add_options_arguments, _convert_job, ConvertOptions, map_bounded, options_from_args, print_messages,
+)
+
+
+TAR_WRITE_MODES = {".tar": "w", ".tar.gz": "w:gz", ".tgz": "w:gz", ".tar.bz2": "w:bz2", ".tar.xz": "w:xz"}
+
+
+def iter_archive_afms(archive_filename: str) -> typing.Iterator[typing.Tuple[str, bytes, float]]:
+    """
+    Opens zip or tar (possibly compressed) archive and returns iterator of name, contents and mtime of its AFM members,
+    in archive order. A missing or unreadable archive raises OSError or ValueError here, not on iteration.
+    """
+    if zipfile.is_zipfile(archive_filename):
+        return _iter_zip_afms(zipfile.ZipFile(archive_filename))  # pylint: disable=consider-using-with
+    if tarfile.is_tarfile(archive_filename):  # stream mode, members are read in one pass
+        return _iter_tar_afms(tarfile.open(archive_filename, "r|*"))  # pylint: disable=consider-using-with
+    raise ValueError(f"A2P: Not a zip or tar archive: {archive_filename}")
+
+
+def _iter_zip_afms(archive: zipfile.ZipFile) -> typing.Iterator[typing.Tuple[str, bytes, float]]:
+    with archive:
+        for member in archive.infolist():
+            if not member.is_dir() and member.filename.lower().endswith(".afm"):
+                yield member.filename, archive.read(member), time.mktime(member.date_time + (0, 0, -1))
+
+
+def _iter_tar_afms(archive: tarfile.TarFile) -> typing.Iterator[typing.Tuple[str, bytes, float]]:
+    with archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(".afm"):
+                yield member.name, archive.extractfile(member).read(), member.mtime
+
+
+class ArchiveWriter:
+    """ Writes members into zip or tar archive, the format is chosen by extension of the file name. """
+
+    def __init__(self, archive_filename: str):
+        name = archive_filename.lower()
+        tar_mode = next((mode for extension, mode in TAR_WRITE_MODES.items() if name.endswith(extension)), None)
+        if tar_mode:
+            self.archive = tarfile.open(archive_filename, tar_mode)  # pylint: disable=consider-using-with
+        elif name.endswith(".zip"):
+            self.archive = zipfile.ZipFile(archive_filename, "w", zipfile.ZIP_DEFLATED)  # pylint: disable=consider-using-with
+        else:
+            raise ValueError(f"A2P: Unknown archive type (use .zip, {', '.join(TAR_WRITE_MODES)}): {archive_filename}")
+
+    def add(self, name: str, data: bytes, mtime: float | None = None):
+        """ Adds a member. """
+        mtime = time.time() if mtime is None else mtime
+        if isinstance(self.archive, zipfile.ZipFile):
+            member = zipfile.ZipInfo(name, time.localtime(max(mtime, 315532800))[:6])  # zip dates start in 1980
+            member.compress_type = zipfile.ZIP_DEFLATED
+            self.archive.writestr(member, data)
+        else:
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            member.mtime = mtime
+            self.archive.addfile(member, io.BytesIO(data))
+
+    def close(self):
+        """ Finishes the output archive (zip central directory, tar end blocks). """
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run_archive(archive_filename: str, output_filename: str, options: ConvertOptions, workers: int | None = None) -> int:
+    """
+    Converts AFM members of an archive into PFM members of output archive (names kept, extension changed),
+    without extracting them to disk. Returns number of failures. An unreadable input archive raises OSError
+    or ValueError; the output archive is then not created (or removed if the input breaks while it is written).
+    """
+    start = time.perf_counter()
+    converted = failed = written = 0
+    members = iter_archive_afms(archive_filename)
+    names = collections.deque()
+
+    def jobs():
+        for name, afm_data, mtime in members:
+            names.append((name, mtime))
+            yield afm_data, options
+
+    archive = ArchiveWriter(output_filename)
+    try:
+        with archive:
+            for result in map_bounded(_convert_job, jobs(), workers):
+                name, mtime = names.popleft()
+                print_messages(name, result["messages"])
+                if result["error"]:
+                    failed += 1
+                    print(f"A2P: {name}: {result['error']}")
+                    continue
+                archive.add(os.path.splitext(name)[0] + ".pfm", result["pfm"], mtime)
+                converted += 1
+                written += len(result["pfm"])
+    except BaseException as exc:
+        with contextlib.suppress(OSError):
+            os.remove(output_filename)
+        if isinstance(exc, (tarfile.TarError, zipfile.BadZipFile, EOFError)):
+            raise ValueError(f"A2P: Corrupt archive: {archive_filename}: {exc}") from exc
+        raise
+    print(f"A2P: {converted} of {converted + failed} members converted, {failed} failed, {written} bytes written "
+          f"to {output_filename} in {time.perf_counter() - start:.2f} s.")
+    return failed
+
+
+def archive_main(argv: typing.List[str]) -> int:
+    """ Archive mode: converts AFM members of zip/tar archive into PFM members of another archive. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py archive", description="Converts AFM members of zip or tar archive into an archive of PFMs."
+    )
+    parser.add_argument("input", help="Input zip or tar (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz) archive")
+    parser.add_argument("-o", "--output", help="Output archive, type given by extension", required=True)
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    add_options_arguments(parser)
+    args = parser.parse_args(argv)
+
+    options = options_from_args(args)
+    try:
+        failed = run_archive(args.input, args.output, options, args.jobs)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    return 1 if failed else 0
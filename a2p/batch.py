@@ -0,0 +1,806 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM batch modes: parallel conversion of trees (sharded, incremental, patching or watching), check, verify and info.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import heapq
+import json
+import mmap
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+import typing
+
+from a2p.common import NO_STATS, PFM_KERNS_LIMIT, VERSION, file_digest, fsync_directories, Stats, stats_log
+from a2p.encoding import BUILTIN_ENCODINGS, load_encodings
+from a2p.afm import (
+    AFM_HEADERS_DEFAULTS, AFM_INDEX_SUFFIX, AFM_SECTIONS, KERNS_CHUNK_SIZE, METRICS_SUFFIX, AfmReader, LazyAfm,
+)
+from a2p.pfm import coerce_pfm_value, PfmReader, PfmWriter
+from a2p.convert import (
+    MANIFEST_NAME, add_options_arguments, BuildManifest, conflict_error, convert_afm_data, convert_file, ConvertOptions,
+    find_afm_files, options_from_args, PfmCache, print_messages, run_parallel, split_output_conflicts,
+)
+
+
+SHARD_KERN_COST = 64  # cost of a kern pair in bytes of AFM, for balancing shards (see shard_cost)
+WATCH_INTERVAL = 0.5  # seconds between polls of watch mode
+WATCH_DEBOUNCE = 0.3  # seconds a changed AFM has to stay unchanged before it is converted
+
+
+def _batch_job(job: tuple) -> dict:
+    """ Process pool entry point, converts one file and catches errors so the batch can go on. """
+    afm_filename, pfm_filename, options = job
+    cache = PfmCache.shared(options.cache_dir, options.cache_size) if options.cache_dir else None
+    hits = cache.hits if cache else 0
+    stats = Stats()  # its counters report files written and unchanged, the rest only if asked for
+    start = time.perf_counter()
+    result = {"input": afm_filename, "output": pfm_filename, "size": 0, "error": None}
+    warnings = []
+    try:
+        if options.digest:
+            stat = os.stat(afm_filename)
+            result["afm_size"] = stat.st_size
+            result["afm_mtime_ns"] = stat.st_mtime_ns
+            result["sha256"] = file_digest(afm_filename)
+        result["size"] = convert_file(afm_filename, pfm_filename, options, stats, warnings)
+    except Exception as exc:  # pylint: disable=broad-except
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    result["messages"] = [warning.message for warning in warnings]
+    result["elapsed"] = time.perf_counter() - start
+    for name in ("files_written", "files_unchanged", "bytes_written", "kern_pairs_dropped"):
+        result[name] = stats.counts.get(name, 0)
+    if options.stats:
+        result["stats"] = stats.as_dict()
+    result["cached"] = bool(cache and cache.hits > hits)
+    return result
+
+
+def shard_cost(afm_filename: str) -> int:
+    """
+    Estimated cost of converting AFM file, for balancing shards: its size plus SHARD_KERN_COST per kern pair.
+    The number of pairs is taken from StartKernPairs line (pairs are counted only if it has none), nothing is parsed.
+    """
+    try:
+        with LazyAfm.open(afm_filename) as afm:
+            line_start, line_end = afm.locate("StartKernPairs")
+            fields = bytes(afm.data[line_start:line_end]).split()
+            if len(fields) > 1 and fields[1].isdigit():
+                kerns = int(fields[1])
+            else:
+                kerns = afm.section_data("StartKernPairs", "EndKernPairs").count(b"KPX")
+            return len(afm.data) + SHARD_KERN_COST * kerns
+    except (OSError, RuntimeError):
+        with contextlib.suppress(OSError):
+            return os.path.getsize(afm_filename)
+        return 0
+
+
+def parse_shard(text: str) -> typing.Tuple[int, int]:
+    """ Parses shard given as I/N (I from 1 to N). """
+    try:
+        shard, shards = map(int, text.split("/"))
+    except ValueError:
+        raise ValueError(f"A2P: Shard must be given as I/N, not {text!r}.") from None
+    if not 1 <= shard <= shards:
+        raise ValueError(f"A2P: Shard {shard} out of range 1..{shards}.")
+    return shard, shards
+
+
+def shard_files(
+    files: typing.List[typing.Tuple[str, str]],
+    shard: typing.Tuple[int, int],
+    workers: int | None = None,
+) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Returns (AFM, relative PFM name) pairs of files (see find_afm_files) assigned to shard (I, N): files sorted
+    by cost (see shard_cost) go one by one to the least loaded shard (longest processing time first).
+    Assignment depends only on contents and relative names of files, so every node computes the same partition.
+    """
+    index, shards = shard
+    costs = list(run_parallel(shard_cost, [afm_filename for afm_filename, _ in files], workers))
+    order = sorted(range(len(files)), key=lambda i: (-costs[i], files[i][1], files[i][0]))
+    loads = [(0, i) for i in range(1, shards + 1)]
+    assigned = []
+    for i in order:
+        load, node = heapq.heappop(loads)
+        if node == index:
+            assigned.append(i)
+        heapq.heappush(loads, (load + costs[i], node))
+    return [files[i] for i in sorted(assigned)]
+
+
+def run_batch(
+    sources: typing.Iterable[str],
+    output_dir: str,
+    options: ConvertOptions,
+    *,
+    workers: int | None = None,
+    manifest_path: str | None = None,
+    prune: bool = False,
+    stats: Stats = NO_STATS,
+    shard: typing.Tuple[int, int] | None = None,
+    report: dict | None = None,
+) -> int:
+    """
+    Converts all AFM files found in sources into output_dir using a pool of processes, returns number of failures.
+    With manifest_path only new or changed AFMs are converted (see BuildManifest), PFMs of removed AFMs
+    are reported or, with prune, deleted. Instrumentation data of all files is aggregated in stats.
+    With shard (I, N) only the I-th of N balanced parts of files is converted (see shard_files).
+    Summary (numbers of files, failures...) is put into report dict if given.
+    """
+    start = time.perf_counter()
+    options = options._replace(stats=stats.enabled)
+    files, conflicts = split_output_conflicts(find_afm_files(sources))
+    if shard:
+        all_files = len(files)
+        files = shard_files(files, shard, workers)
+        print(f"A2P: Shard {shard[0]}/{shard[1]}: {len(files)} of {all_files} AFM files.")
+        if shard[0] != 1:  # conflicts are found before sharding, the first shard reports them for all
+            conflicts = []
+    jobs = [(afm_filename, os.path.join(output_dir, pfm_name), options) for afm_filename, pfm_name in files]
+
+    manifest = None
+    skipped = 0
+    if manifest_path:
+        options = options._replace(digest=True)
+        manifest = BuildManifest(manifest_path, options)
+        all_jobs = len(jobs)
+        jobs = [(afm_filename, pfm_filename, options) for afm_filename, pfm_filename, _ in jobs
+                if not manifest.is_current(afm_filename, pfm_filename)]
+        skipped = all_jobs - len(jobs)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+
+    converted = failed = total_size = cached = written = unchanged = kerns_dropped = 0
+    written_files = []
+    failures = []
+    for afm_filename, pfm_name, owner in conflicts:
+        failed += 1
+        failures.append({"input": afm_filename, "error": conflict_error(pfm_name, owner)})
+        print(f"A2P: {afm_filename}: {failures[-1]['error']}")
+    for result in run_parallel(_batch_job, jobs, workers):
+        print_messages(result["input"], result["messages"])
+        if "stats" in result:
+            stats.merge(result["stats"])
+        written += result["files_written"]
+        unchanged += result["files_unchanged"]
+        total_size += result["bytes_written"]
+        kerns_dropped += result["kern_pairs_dropped"]
+        if result["files_written"]:
+            written_files.append(result["output"])
+        if result["error"]:
+            failed += 1
+            failures.append({"input": result["input"], "error": result["error"]})
+            print(f"A2P: {result['input']}: {result['error']}")
+            if manifest:
+                manifest.forget(result["input"])
+        else:
+            converted += 1
+            cached += result["cached"]
+            if manifest:
+                manifest.record(result)
+    if options.fsync:
+        fsync_directories(written_files)
+
+    elapsed = time.perf_counter() - start
+    rate = len(jobs) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"A2P: {converted} of {len(jobs) + len(conflicts)} files converted, {failed} failed, "
+        f"{total_size} bytes written in {elapsed:.2f} s ({rate:.1f} files/s, {workers} workers)."
+    )
+    print(f"A2P: PFM files written: {written}, unchanged (not rewritten): {unchanged}.")
+    if options.cache_dir:
+        print(f"A2P: PFM cache hits: {cached}, misses: {len(jobs) - cached}.")
+    if manifest:
+        removed = manifest.removed()
+        for afm_filename, pfm_filename in removed:
+            if prune:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(pfm_filename)
+                manifest.forget(afm_filename)
+            else:
+                print(f"A2P: {afm_filename} removed, stale PFM: {pfm_filename}")
+        manifest.save()
+        print(f"A2P: {skipped} files up to date (skipped), {converted} rebuilt, {len(removed)} removed"
+              f"{' (PFMs deleted)' if prune else ''}.")
+    if report is not None:
+        report.update(shard=list(shard) if shard else None, files=len(jobs) + len(conflicts) + skipped, converted=converted,
+                      failed=failed, skipped=skipped, files_written=written, files_unchanged=unchanged,
+                      bytes_written=total_size, kerns_dropped=kerns_dropped, failures=failures, workers=workers)
+    return failed
+
+
+def _patch_job(job: tuple) -> dict:
+    """
+    Process pool entry point of patch mode: applies overrides of options to existing PFMs in place (see
+    PfmWriter.patch_pfm), or converts the AFM again if they cannot be patched (missing or invalid PFM, strings).
+    """
+    afm_filename, pfm_filename, options = job
+    start = time.perf_counter()
+    result = {"input": afm_filename, "output": pfm_filename, "patched": False, "fields_changed": 0, "error": None}
+    warnings = []
+    try:
+        if PfmWriter.patchable(options.overrides()):
+            try:
+                result["fields_changed"] = sum(PfmWriter.patch_pfm(output_filename, options.overrides())
+                                               for output_filename in options.output_files(pfm_filename))
+                result["patched"] = True
+            except (OSError, ValueError) as exc:
+                result["fallback"] = f"{type(exc).__name__}: {exc}"
+        if not result["patched"]:
+            if options.digest:
+                stat = os.stat(afm_filename)
+                result.update(afm_size=stat.st_size, afm_mtime_ns=stat.st_mtime_ns, sha256=file_digest(afm_filename))
+            convert_file(afm_filename, pfm_filename, options, warnings=warnings)
+    except Exception as exc:  # pylint: disable=broad-except
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    result["messages"] = [warning.message for warning in warnings]
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def run_patch(
+    sources: typing.Iterable[str],
+    output_dir: str,
+    options: ConvertOptions,
+    workers: int | None = None,
+    manifest_path: str | None = None,
+) -> int:
+    """
+    Patch mode: applies overrides (options.extra_args) to PFMs made earlier by batch mode in output_dir, in parallel.
+    Only fixed size fields are rewritten in place; PFMs which cannot be patched are made again. Returns number of failures.
+    With manifest_path the manifest of incremental mode is kept true: PFMs made again are recorded with these options,
+    entries of patched or failed ones are dropped (the options they were made with are not known), so the next
+    incremental run makes them again.
+    """
+    start = time.perf_counter()
+    files, conflicts = split_output_conflicts(find_afm_files(sources))
+    manifest = None
+    if manifest_path:
+        options = options._replace(digest=True)
+        manifest = BuildManifest(manifest_path, options)
+    jobs = [(afm_filename, os.path.join(output_dir, pfm_name), options) for afm_filename, pfm_name in files]
+    if not PfmWriter.patchable(options.overrides()):
+        print("A2P: Overrides of strings or layout fields cannot be patched, all PFMs are made again.")
+    patched = regenerated = changed = 0
+    failed = len(conflicts)
+    for afm_filename, pfm_name, owner in conflicts:
+        print(f"A2P: {afm_filename}: {conflict_error(pfm_name, owner)}")
+    for result in run_parallel(_patch_job, jobs, workers):
+        print_messages(result["input"], result["messages"])
+        if manifest:
+            if result["error"] or result["patched"]:
+                manifest.forget(result["input"])
+            else:
+                manifest.record(result)
+        if result["error"]:
+            failed += 1
+            print(f"A2P: {result['input']}: {result['error']}")
+            continue
+        if result["patched"]:
+            patched += 1
+            changed += result["fields_changed"]
+        else:
+            regenerated += 1
+            if "fallback" in result:
+                print(f"A2P: {result['output']} made again: {result['fallback']}")
+    if manifest:
+        manifest.save()
+    print(f"A2P: {patched} PFMs patched in place ({changed} fields changed), {regenerated} made again, {failed} failed "
+          f"in {time.perf_counter() - start:.2f} s.")
+    return failed
+
+
+class AfmWatcher:
+    """
+    Finds changes of AFM files in sources by polling: keeps an index of known files with their size and mtime,
+    so every poll costs one stat per file and directory, nothing is read; only directories whose mtime changed
+    are listed again (see walk_afm_files).
+    A changed file is reported when it has not changed again for debounce seconds (a burst of saves gives one event).
+    """
+
+    def __init__(self, sources: typing.Iterable[str], debounce: float = WATCH_DEBOUNCE):
+        self.sources = list(sources)
+        self.debounce = debounce
+        self.known: typing.Dict[str, typing.Tuple[int, int]] = {}  # AFM file: (size, mtime_ns) of the last event
+        self.pending: typing.Dict[str, typing.Tuple[typing.Tuple[int, int], float, float]] = {}  # signature, seen, changed
+        self.pfm_names: typing.Dict[str, str] = {}
+        self.conflicts: typing.Dict[str, typing.Tuple[str, str]] = {}  # AFM not watched: (PFM name, AFM converted into it)
+        self.listings: typing.Dict[str, typing.Tuple[int, bool, list, list]] = {}  # directories (see walk_afm_files)
+        self.scan_files()
+        self.known = {afm_filename: signature for afm_filename, (signature, _, _) in self.pending.items()}
+        self.pending.clear()
+
+    def scan_files(self) -> typing.List[typing.Tuple[str, str]]:
+        """
+        Stats all AFM files, updates pending changes, returns files which disappeared (with relative PFM names).
+        AFMs whose PFM name is taken by another one are not watched, but kept in conflicts (see split_output_conflicts).
+        """
+        now = time.monotonic()
+        files, conflicts = split_output_conflicts(find_afm_files(self.sources, self.listings))
+        self.conflicts = {afm_filename: (pfm_name, owner) for afm_filename, pfm_name, owner in conflicts}
+        found = dict(files)
+        for afm_filename, pfm_name in found.items():
+            try:
+                stat = os.stat(afm_filename)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            self.pfm_names[afm_filename] = pfm_name
+            if self.known.get(afm_filename) == signature:
+                self.pending.pop(afm_filename, None)
+                continue
+            previous = self.pending.get(afm_filename)
+            if previous is None:
+                self.pending[afm_filename] = (signature, now, now)
+            elif previous[0] != signature:
+                self.pending[afm_filename] = (signature, previous[1], now)
+        removed = [(afm_filename, pfm_name) for afm_filename, pfm_name in self.pfm_names.items() if afm_filename not in found]
+        for afm_filename, _ in removed:
+            del self.pfm_names[afm_filename]
+            self.known.pop(afm_filename, None)
+            self.pending.pop(afm_filename, None)
+        return removed
+
+    def poll(self) -> typing.Tuple[typing.List[typing.Tuple[str, str, float]], typing.List[typing.Tuple[str, str]]]:
+        """
+        Scans files, returns changes settled for debounce seconds as (AFM file, relative PFM name, time of first
+        change seen, by time.monotonic) and removed AFM files (see scan_files). Returned changes are considered known.
+        """
+        removed = self.scan_files()
+        now = time.monotonic()
+        settled = []
+        for afm_filename, (signature, seen, changed) in list(self.pending.items()):
+            if now - changed >= self.debounce:
+                settled.append((afm_filename, self.pfm_names[afm_filename], seen))
+                self.known[afm_filename] = signature
+                del self.pending[afm_filename]
+        return settled, removed
+
+
+def run_watch(
+    sources: typing.Iterable[str],
+    output_dir: str,
+    options: ConvertOptions,
+    *,
+    workers: int | None = None,
+    manifest_path: str | None = None,
+    prune: bool = False,
+    interval: float = WATCH_INTERVAL,
+    debounce: float = WATCH_DEBOUNCE,
+    stop: threading.Event | None = None,
+) -> int:
+    """
+    Watch mode: converts sources as batch mode does, then keeps polling them (see AfmWatcher) and reconverts
+    only changed AFMs in a resident pool of processes (in this process for a single worker) until stop is set.
+    Reports latency of every event: time of conversion and time since the change was seen. Returns number of failures.
+    """
+    stop = stop or threading.Event()
+    watcher = AfmWatcher(sources, debounce)  # before converting, so changes made meanwhile are not missed
+    failed = run_batch(sources, output_dir, options, workers=workers, manifest_path=manifest_path, prune=prune)
+    manifest = BuildManifest(manifest_path, options._replace(digest=True)) if manifest_path else None
+    options = options._replace(digest=bool(manifest))
+    workers = workers or os.cpu_count() or 1
+    print(f"A2P: Watching {len(watcher.pfm_names)} AFM files (poll every {interval} s, debounce {debounce} s).", flush=True)
+    reported = set(watcher.conflicts)  # by run_batch
+    with contextlib.ExitStack() as stack:
+        executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=workers)) if workers > 1 else None
+        while not stop.wait(interval):
+            changes, removed = watcher.poll()
+            for afm_filename, (pfm_name, owner) in watcher.conflicts.items():
+                if afm_filename not in reported:
+                    failed += 1
+                    print(f"A2P: {afm_filename}: {conflict_error(pfm_name, owner)}", flush=True)
+            reported = set(watcher.conflicts)
+            for afm_filename, pfm_name in removed:
+                if manifest:
+                    manifest.forget(afm_filename)
+                stale = options.output_files(os.path.join(output_dir, pfm_name))
+                print(f"A2P: {afm_filename} removed{', PFM deleted' if prune else ''}: {', '.join(stale)}", flush=True)
+                if prune:
+                    for pfm_filename in stale:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(pfm_filename)
+                    if options.fsync:
+                        fsync_directories(stale)
+            if not changes:
+                if removed and manifest:
+                    manifest.save()
+                continue
+            jobs = [(afm_filename, os.path.join(output_dir, pfm_name), options) for afm_filename, pfm_name, _ in changes]
+            results = executor.map(_batch_job, jobs) if executor else map(_batch_job, jobs)
+            written_files = []
+            for (_, _, seen), result in zip(changes, results):
+                print_messages(result["input"], result["messages"])
+                if result["files_written"]:
+                    written_files.append(result["output"])
+                latency = (time.monotonic() - seen) * 1000
+                if result["error"]:
+                    failed += 1
+                    print(f"A2P: {result['input']}: {result['error']} ({latency:.0f} ms after change)", flush=True)
+                    if manifest:
+                        manifest.forget(result["input"])
+                    continue
+                state = "converted" if result["files_written"] else "converted, PFM unchanged"
+                print(f"A2P: {result['input']} -> {result['output']} {state} in {result['elapsed'] * 1000:.1f} ms "
+                      f"({latency:.0f} ms after change)", flush=True)
+                if manifest:
+                    manifest.record(result)
+            if options.fsync:
+                fsync_directories(written_files)
+            if manifest:
+                manifest.save()
+    return failed
+
+
+def _verify_job(job: tuple) -> dict:
+    """ Process pool entry point, compares existing PFM with one generated from its AFM. """
+    afm_filename, pfm_filename, options = job
+    result = {"input": afm_filename, "output": pfm_filename, "differences": [], "error": None}
+    try:
+        with open(afm_filename, "rb") as afm_file:
+            afm_data = afm_file.read()
+        expected_data = convert_afm_data(afm_data, options, warnings=[])
+        with open(pfm_filename, "rb") as pfm_file:
+            if os.fstat(pfm_file.fileno()).st_size == 0:
+                raise ValueError("A2P: Not a PFM file (empty).")
+            with mmap.mmap(pfm_file.fileno(), 0, access=mmap.ACCESS_READ) as found_data:
+                with memoryview(found_data) as view:
+                    identical = view == expected_data
+                if not identical:
+                    differences = PfmReader.diff_pfm(PfmReader.parse_pfm(expected_data), PfmReader.parse_pfm(found_data))
+                    result["differences"] = differences or ["binary content differs (extra strings)"]
+    except Exception as exc:  # pylint: disable=broad-except
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def verify_main(argv: typing.List[str]) -> int:
+    """ Verify mode: checks existing PFMs against ones generated from matching AFMs, field by field. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py verify", description="Compares PFM files with ones which would be made from their AFMs."
+    )
+    parser.add_argument("inputs", help="Input AFM files, directories or glob patterns", nargs="+")
+    parser.add_argument("-p", "--pfm-dir", help="Directory of PFM files (laid out as by batch mode)", required=True)
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    add_options_arguments(parser, cache=False)
+    parser.add_argument("--max-differences", help="Differences shown per file (default: %(default)s)", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    options = options_from_args(args)
+    jobs = [(afm_filename, os.path.join(args.pfm_dir, pfm_name), options)
+            for afm_filename, pfm_name in find_afm_files(args.inputs)]
+    identical = different = failed = 0
+    for result in run_parallel(_verify_job, jobs, args.jobs):
+        if result["error"]:
+            failed += 1
+            print(f"A2P: {result['output']}: {result['error']}")
+        elif result["differences"]:
+            different += 1
+            print(f"A2P: {result['output']}: {len(result['differences'])} differences")
+            for difference in result["differences"][:args.max_differences]:
+                print(f"    {difference}")
+        else:
+            identical += 1
+    print(f"A2P: {len(jobs)} PFM files verified in {time.perf_counter() - start:.2f} s: "
+          f"{identical} identical, {different} different, {failed} failed.")
+    return 1 if different or failed else 0
+
+
+def check_afm(afm: "LazyAfm") -> typing.List[dict]:
+    """
+    Lint path of AFM: returns diagnostics (dicts with "severity": "error" or "warning", "code" as of ConvertWarning,
+    "message") of problems the conversion would hit, without making widths and kern tables: only the header
+    and CharMetrics are parsed, kern pairs are counted.
+    """
+    diagnostics = []
+
+    def report(severity: str, code: str, message: str):
+        diagnostics.append({"severity": severity, "code": code, "message": message})
+
+    try:
+        afm_values = afm.values
+    except (ValueError, IndexError) as exc:
+        report("error", "malformed_header", f"Malformed AFM header: {exc}.")
+        return diagnostics
+    for key, value in AFM_HEADERS_DEFAULTS.items():
+        if key not in afm_values:
+            report("warning", "missing_header", f"Missing AFM value: {key}, assuming: {value}.")
+    if "Notice" not in afm_values:
+        report("warning", "missing_header", "Missing AFM value: Notice, assuming empty one.")
+    if "ury" not in afm_values:
+        report("error", "missing_fontbbox", "Missing AFM value: FontBBox.")
+
+    try:
+        afm_codes = afm.codes
+    except (ValueError, IndexError, KeyError, struct.error) as exc:  # e.g. IndexError of a character code over 255
+        report("error", "malformed_char_metrics", f"Malformed AFM char metrics: {type(exc).__name__}: {exc}.")
+        return diagnostics
+    if not afm_codes:
+        report("warning", "no_char_metrics", "No encoded characters, all widths will be the average one.")
+
+    kerns_num = 0
+    kerns_start = afm.locate("StartKernPairs")[1]
+    kerns_end = afm.locate("EndKernPairs")[0]
+    try:
+        for chunk_start, chunk_end in AfmReader.split_lines(afm.data, kerns_start, kerns_end, KERNS_CHUNK_SIZE):
+            kerns_num += AfmReader.count_kern_pairs(afm.data[chunk_start:chunk_end], afm_codes)
+    except ValueError as exc:
+        report("error", "malformed_kerns", f"{exc}.")
+    if kerns_num > PFM_KERNS_LIMIT:
+        report("warning", "kerns_over_limit",
+               f"The number of kerns is {kerns_num} (more than allowed {PFM_KERNS_LIMIT}, only the biggest ones are kept).")
+    return diagnostics
+
+
+def _check_job(afm_filename: str) -> dict:
+    """ Process pool entry point of check mode, lints one AFM file (see check_afm). """
+    result = {"input": afm_filename, "status": "ok", "diagnostics": []}
+    try:
+        with LazyAfm.open(afm_filename, use_index=False) as afm:
+            result["diagnostics"] = check_afm(afm)
+    except (OSError, RuntimeError) as exc:
+        result["diagnostics"] = [{"severity": "error", "code": "unreadable", "message": str(exc)}]
+    except Exception as exc:  # pylint: disable=broad-except  # one bad AFM must not stop checking of others
+        result["diagnostics"].append({"severity": "error", "code": "check_failed", "message": f"{type(exc).__name__}: {exc}"})
+    severities = {diagnostic["severity"] for diagnostic in result["diagnostics"]}
+    result["status"] = "error" if "error" in severities else "warning" if severities else "ok"
+    return result
+
+
+def run_check(sources: typing.Iterable[str], workers: int | None = None, json_file: str | None = None) -> int:
+    """
+    Checks all AFM files found in sources in parallel (see check_afm), prints a summary table of files with problems
+    (or JSON lines of all files into json_file, "-" for stdout), returns the number of files with errors.
+    """
+    start = time.perf_counter()
+    jobs = [afm_filename for afm_filename, _ in find_afm_files(sources)]
+    counts = collections.Counter()
+    codes = collections.Counter()
+    with contextlib.ExitStack() as stack:
+        out_file = None
+        if json_file:
+            out_file = sys.stdout if json_file == "-" else stack.enter_context(open(json_file, "w", encoding="utf-8"))
+        for result in run_parallel(_check_job, jobs, workers):
+            counts[result["status"]] += 1
+            codes.update(diagnostic["code"] for diagnostic in result["diagnostics"])
+            if out_file:
+                out_file.write(json.dumps(result) + "\n")
+            elif result["diagnostics"]:
+                for diagnostic in result["diagnostics"]:
+                    print(f"{result['input']:40s} {diagnostic['severity']:8s} {diagnostic['code']:22s} {diagnostic['message']}")
+    summary = print if not json_file or json_file != "-" else functools.partial(print, file=sys.stderr)
+    summary(f"A2P: {len(jobs)} AFM files checked in {time.perf_counter() - start:.2f} s: {counts['ok']} fine, "
+            f"{counts['warning']} with warnings, {counts['error']} with errors.")
+    if codes:
+        summary("A2P: " + ", ".join(f"{code}: {count}" for code, count in sorted(codes.items())) + ".")
+    return counts["error"]
+
+
+def _info_job(job: tuple) -> dict:
+    """ Process pool entry point of info mode, reads AFM header (and with use_index keeps section index up to date). """
+    afm_filename, fields, use_index, index_dir = job
+    result = {"input": afm_filename}
+    try:
+        with LazyAfm.open(afm_filename, use_index=use_index, index_dir=index_dir) as afm:
+            values = afm.values
+            if use_index and len(afm.sections) < len(AFM_SECTIONS):
+                afm.save_index()
+        result.update((key, value) for key, value in values.items() if not fields or key in fields)
+    except Exception as exc:  # pylint: disable=broad-except
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    return result
+
+
+def info_main(argv: typing.List[str]) -> int:
+    """ Info mode: prints AFM header values as JSON lines, reading only headers of files. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py info", description="Prints header values of AFM files as JSON lines (one per file)."
+    )
+    parser.add_argument("inputs", help="Input AFM files, directories or glob patterns", nargs="+")
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    parser.add_argument("-f", "--field", help="Print only given header value (may be repeated)", action="append",
+                        default=[], dest="fields", metavar="KEY")
+    index_group = parser.add_mutually_exclusive_group()
+    index_group.add_argument("--index", help="Use and write section index files kept in a directory", metavar="DIR")
+    index_group.add_argument("--index-sidecar", help=f"Use and write section index files next to AFMs (NAME.afm{AFM_INDEX_SUFFIX}, "
+                             "written into the input trees)", action="store_true")
+    args = parser.parse_args(argv)
+
+    use_index = args.index is not None or args.index_sidecar
+    jobs = [(afm_filename, frozenset(args.fields), use_index, args.index) for afm_filename, _ in find_afm_files(args.inputs)]
+    failed = 0
+    for result in run_parallel(_info_job, jobs, args.jobs):
+        failed += "error" in result
+        print(json.dumps(result))
+    return 1 if failed else 0
+
+
+def batch_main(argv: typing.List[str]) -> int:
+    """ Batch mode: converts whole trees of AFM files in parallel. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py batch", description="Converts many AFM files (directories or glob patterns) in parallel."
+    )
+    parser.add_argument("inputs", help="Input AFM files, directories or glob patterns", nargs="+")
+    parser.add_argument("-o", "--output-dir", help="Output directory for PFM files (required unless --check)")
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    parser.add_argument("--check", help="Only check AFMs for problems, write nothing (exit status 1 on errors)",
+                        action="store_true")
+    json_group = parser.add_mutually_exclusive_group()
+    json_group.add_argument("--json", help="With --check: write results as JSON lines to stdout (messages go to stderr)",
+                            action="store_const", const="-", dest="json_output")
+    json_group.add_argument("--json-output", help="With --check: write results as JSON lines to a file", metavar="FILE")
+    add_options_arguments(parser)
+    parser.add_argument("--incremental", help="Convert only new or changed AFMs (manifest kept in output directory)",
+                        action="store_true")
+    parser.add_argument("--manifest", help=f"Manifest file of incremental mode (default: OUTPUT_DIR/{MANIFEST_NAME})")
+    parser.add_argument("--prune", help="In incremental mode delete PFMs whose AFMs were removed", action="store_true")
+    parser.add_argument("--encoding", help="Make PFM (NAME-LABEL.pfm) for encoding: " + ", ".join(BUILTIN_ENCODINGS)
+                        + " or .enc file, optionally with :CHARSET (may be repeated)", action="append", default=[],
+                        dest="encodings", metavar="SPEC")
+    parser.add_argument("--stats", help="Write timings and counters as JSON to a file (or stdout: -, messages go to stderr)",
+                        metavar="FILE")
+    parser.add_argument("--fsync", help="Flush written PFMs (and their directories, once each) to disk", action="store_true")
+    metrics_group = parser.add_mutually_exclusive_group()
+    metrics_group.add_argument("--metrics-cache", help="Reuse parsed AFMs kept in a directory", metavar="DIR")
+    metrics_group.add_argument("--metrics-sidecar", help=f"Reuse parsed AFMs kept next to them (NAME.afm{METRICS_SUFFIX})",
+                               action="store_const", const="", dest="metrics_cache")
+    parser.add_argument("--watch", help="After converting keep watching inputs and reconvert AFMs as they change",
+                        action="store_true")
+    parser.add_argument("--shard", help="Convert only I-th of N parts of inputs balanced by size and kerns (I from 1)",
+                        metavar="I/N")
+    parser.add_argument("--report", help="Write summary (files, bytes, kerns dropped, timings, failures) as JSON to a file "
+                        "(see merge-reports)", metavar="FILE")
+    parser.add_argument("--patch", help="Apply --set overrides of fixed size fields to existing PFMs in place "
+                        "(others are made again)", action="store_true")
+    parser.add_argument("--interval", help="Watch mode: seconds between polls (default: %(default)s)", type=float,
+                        default=WATCH_INTERVAL)
+    parser.add_argument("--debounce", help="Watch mode: seconds a changed AFM has to stay unchanged (default: %(default)s)",
+                        type=float, default=WATCH_DEBOUNCE)
+    args = parser.parse_intermixed_args(argv)  # inputs may follow options
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.check:
+        return 1 if run_check(args.inputs, args.jobs, args.json_output) else 0
+    if not args.output_dir:
+        parser.error("the following arguments are required: -o/--output-dir")
+
+    options = options_from_args(args)
+    options = options._replace(encodings=tuple(args.encodings), fsync=args.fsync, metrics_cache=args.metrics_cache)
+    try:
+        load_encodings(options.encodings)
+    except (OSError, ValueError) as exc:
+        parser.error(f"encoding: {exc}")
+    if args.patch:
+        try:
+            for key, value in options.overrides().items():
+                coerce_pfm_value(key, value)
+        except ValueError as exc:
+            parser.error(str(exc))
+        manifest_path = args.manifest or os.path.join(args.output_dir, MANIFEST_NAME)
+        if not args.manifest and not os.path.exists(manifest_path):
+            manifest_path = None  # output directory not built incrementally
+        return 1 if run_patch(args.inputs, args.output_dir, options, args.jobs, manifest_path) else 0
+    manifest_path = args.manifest or (os.path.join(args.output_dir, MANIFEST_NAME) if args.incremental else None)
+    if args.watch:
+        stop = threading.Event()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda *_: stop.set())
+        failed = run_watch(args.inputs, args.output_dir, options, workers=args.jobs, manifest_path=manifest_path,
+                           prune=args.prune, interval=args.interval, debounce=args.debounce, stop=stop)
+        return 1 if failed else 0
+    stats = Stats() if args.stats or args.report else NO_STATS
+    start = time.perf_counter()
+    report = {}
+    with stats_log(args.stats):
+        failed = run_batch(args.inputs, args.output_dir, options, workers=args.jobs, manifest_path=manifest_path,
+                           prune=args.prune, stats=stats, shard=shard, report=report)
+    elapsed = time.perf_counter() - start
+    if args.stats:
+        stats.write_json(args.stats, elapsed=elapsed, failed=failed)
+    if args.report:
+        stats.write_json(args.report, **report, elapsed=elapsed, version=VERSION)
+    return 1 if failed else 0
+
+
+def merge_reports(reports: typing.List[dict]) -> dict:
+    """
+    Combines reports of batch runs (see batch --report), e.g. of all shards: numbers and timings are summed,
+    failures joined; elapsed is the longest run (elapsed_total the sum). Missing and repeated shards are listed.
+    """
+    stats = Stats()
+    merged = {"reports": len(reports), "elapsed": 0.0, "elapsed_total": 0.0, "failures": []}
+    summed = ("files", "converted", "failed", "skipped", "files_written", "files_unchanged", "bytes_written", "kerns_dropped")
+    for name in summed:
+        merged[name] = 0
+    shards = collections.Counter()
+    for report in reports:
+        stats.merge(report)
+        for name in summed:
+            merged[name] += report.get(name, 0)
+        merged["failures"] += report.get("failures", [])
+        merged["elapsed"] = max(merged["elapsed"], report.get("elapsed", 0.0))
+        merged["elapsed_total"] += report.get("elapsed", 0.0)
+        if report.get("shard"):
+            shards[tuple(report["shard"])] += 1
+    counts = {shards_num for _, shards_num in shards}
+    if len(counts) > 1:
+        raise ValueError(f"A2P: Reports of different shardings: {', '.join(f'{i}/{n}' for i, n in sorted(shards))}.")
+    if counts:
+        shards_num = counts.pop()
+        merged["shards"] = shards_num
+        merged["missing_shards"] = [i for i in range(1, shards_num + 1) if (i, shards_num) not in shards]
+        merged["repeated_shards"] = [i for (i, _), count in sorted(shards.items()) if count > 1]
+    merged.update(stats.as_dict())
+    return merged
+
+
+def merge_reports_main(argv: typing.List[str]) -> int:
+    """ Merge reports mode: combines JSON reports of batch runs (shards) into one summary. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py merge-reports", description="Combines reports of batch runs (batch --report), e.g. of shards."
+    )
+    parser.add_argument("reports", help="Report files (JSON)", nargs="+")
+    parser.add_argument("-o", "--output", help="Write merged report as JSON to a file (or stdout: -)")
+    parser.add_argument("--max-failures", help="Failures shown (default: %(default)s)", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    reports = []
+    for filename in args.reports:
+        try:
+            with open(filename, "r", encoding="utf-8") as report_file:
+                reports.append(json.load(report_file))
+        except (OSError, ValueError) as exc:
+            parser.error(f"{filename}: {exc}")
+    try:
+        merged = merge_reports(reports)
+    except ValueError as exc:
+        parser.error(str(exc))
+    log = sys.stderr if args.output == "-" else sys.stdout  # stdout is reserved for JSON then
+    for failure in merged["failures"][:args.max_failures]:
+        print(f"A2P: {failure['input']}: {failure['error']}", file=log)
+    rate = merged["files"] / merged["elapsed"] if merged["elapsed"] > 0 else 0.0
+    print(f"A2P: {merged['reports']} reports: {merged['converted']} of {merged['files']} files converted, "
+          f"{merged['failed']} failed, {merged['skipped']} skipped, {merged['bytes_written']} bytes written, "
+          f"{merged['kerns_dropped']} kerns dropped in {merged['elapsed']:.2f} s ({rate:.1f} files/s, "
+          f"{merged['elapsed_total']:.2f} s in total).", file=log)
+    if merged.get("missing_shards") or merged.get("repeated_shards"):
+        print(f"A2P: Shards of {merged['shards']}: missing {merged['missing_shards']}, repeated {merged['repeated_shards']}.",
+              file=log)
+    if args.output == "-":
+        print(json.dumps(merged, indent=1, sort_keys=True))
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as out_file:
+            json.dump(merged, out_file, indent=1, sort_keys=True)
+    return 1 if merged["failed"] or merged.get("missing_shards") else 0
@@ -0,0 +1,199 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM common parts: version, instrumentation of conversions (see Stats) and atomic file writes.
+"""
+
+import contextlib
+import functools
+import gc
+import hashlib
+import json
+import os
+import sys
+import time
+import typing
+
+
+VERSION = "0.30"
+PFM_KERNS_LIMIT = 512  # kern pairs kept in PFM (the biggest ones), unless the limit is off
+
+STRING_ENCODING = "latin-1"
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """ Pauses cyclic garbage collection, parsers create lots of small objects but no reference cycles. """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Stats:
+    """
+    Instrumentation of conversions: wall time and number of calls per phase, and counters (lines, glyphs, kerns, bytes).
+    An optional hook is called with phase name and its duration after every phase.
+    Disabled instance (NO_STATS, the default everywhere) does nothing, so it costs next to nothing.
+    """
+
+    enabled = True
+
+    def __init__(self, hook: typing.Callable[[str, float], None] | None = None):
+        self.hook = hook
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """ Context manager measuring wall time of a phase. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.hook:
+                self.hook(name, elapsed)
+
+    def count(self, name: str, value: int = 1):
+        """ Increments a counter. """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        """ Returns all data (suitable for JSON). """
+        return {"times": dict(self.times), "calls": dict(self.calls), "counts": dict(self.counts)}
+
+    def merge(self, data: dict):
+        """ Adds data of another instance, as returned by as_dict (e.g. from batch workers). """
+        for name, value in data.get("times", {}).items():
+            self.times[name] = self.times.get(name, 0.0) + value
+        for name, value in data.get("calls", {}).items():
+            self.calls[name] = self.calls.get(name, 0) + value
+        for name, value in data.get("counts", {}).items():
+            self.count(name, value)
+
+    def write_json(self, filename: str, **extra):
+        """ Writes data as JSON to a file or to stdout for '-'. """
+        data = {**extra, **self.as_dict()}
+        if filename == "-":
+            print(json.dumps(data, indent=1, sort_keys=True))
+        else:
+            with open(filename, "w", encoding="utf-8") as out_file:
+                json.dump(data, out_file, indent=1, sort_keys=True)
+
+
+class _DisabledStats(Stats):
+    """ Stats which record nothing. """
+
+    enabled = False
+    _no_phase = contextlib.nullcontext()
+
+    def phase(self, name: str):
+        return self._no_phase
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+
+NO_STATS = _DisabledStats()
+
+
+def timed_phase(name: str):
+    """ Decorator of PfmWriter methods, records wall time of the call in writer's stats. """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.stats.enabled:
+                return method(self, *args, **kwargs)
+            with self.stats.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_keyargs(keyargs: typing.Iterable[str]) -> dict:
+    """ Converts command line key:value arguments into a dict of PFM overrides. """
+    extra_args = {}
+    for keyvalue in keyargs:
+        key, value = keyvalue.split(":")
+        extra_args[key] = value
+    return extra_args
+
+
+def write_file_atomic(filename: str, data: bytes, fsync: bool = False) -> bool:
+    """
+    Writes file unless it already has the same content (compared by size, then byte by byte), returns if written.
+    Data goes to a temporary file in the same directory renamed over the target, so the file is never half-written;
+    with fsync its data is flushed to disk before the rename (see fsync_directories for the renames themselves).
+    """
+    with contextlib.suppress(OSError):
+        if os.stat(filename).st_size == len(data):
+            with open(filename, "rb") as old_file:
+                if old_file.read() == data:
+                    return False
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{os.path.basename(filename)}.{os.urandom(6).hex()}.tmp")
+    handle = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(handle, "wb") as temp_file:
+            temp_file.write(data)
+            if fsync:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+        os.replace(temp_path, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def fsync_directories(filenames: typing.Iterable[str]):
+    """ Flushes directory entries (renames of write_file_atomic) of given files to disk, once per directory. """
+    for directory in sorted({os.path.dirname(os.path.abspath(filename)) for filename in filenames}):
+        with contextlib.suppress(OSError):  # not supported on every platform and file system
+            handle = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(handle)
+            finally:
+                os.close(handle)
+
+
+def file_digest(filename: str) -> str:
+    """ Returns SHA-256 of file contents. """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stats_log(stats_filename: str | None) -> typing.ContextManager:
+    """ Returns context sending messages printed within to stderr if JSON of --stats goes to stdout ('-'). """
+    return contextlib.redirect_stdout(sys.stderr) if stats_filename == "-" else contextlib.nullcontext()
@@ -0,0 +1,615 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM conversion: options, PFM cache, build manifest, conversions in memory and of files, finding AFM files.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import struct
+import time
+import typing
+
+from a2p.common import (
+    NO_STATS, PFM_KERNS_LIMIT, STRING_ENCODING, VERSION, file_digest, fsync_directories, parse_keyargs, Stats,
+    write_file_atomic,
+)
+from a2p.encoding import load_encoding, load_encodings
+from a2p.afm import AfmReader, MetricsCache
+from a2p.pfm import PFM_TABLES_LAYOUTS, PFM_TABLES_ORDER, PfmWriter
+
+
+PFM_CACHE_SIZE = 256 << 20  # default size limit of PFM cache, in bytes
+PFM_CACHE_LIMIT_NAME = "max_size"  # file in the cache directory with max_size of its last use (see PfmCache)
+WATCH_MTIME_SLACK = 2.0  # seconds: listings of directories changed more recently are not reused (coarse mtimes)
+MANIFEST_NAME = ".afm2pfm-manifest.json"
+
+
+def walk_afm_files(
+    directory: str,
+    listings: typing.Dict[str, typing.Tuple[int, bool, list, list]] | None = None,
+    rel_directory: str = "",
+) -> typing.Iterator[typing.Tuple[str, str]]:
+    """
+    Yields AFM files of a directory tree with their paths relative to it, in sorted order, top-down as os.walk
+    (symbolic links to directories not followed).
+    With listings (directory: mtime_ns, if reusable, subdirectories, AFM names) kept between calls, only directories
+    whose mtime changed are listed again, the others cost one stat.
+    """
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except OSError:
+        return
+    listing = listings.get(directory) if listings is not None else None
+    if listing is None or listing[0] != mtime_ns or not listing[1]:
+        subdirs, names = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    with contextlib.suppress(OSError):
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                        elif entry.name.lower().endswith(".afm"):
+                            names.append(entry.name)
+        except OSError:
+            return
+        reusable = time.time_ns() - mtime_ns > WATCH_MTIME_SLACK * 1e9  # a change within the same mtime tick is seen
+        listing = (mtime_ns, reusable, sorted(subdirs), sorted(names))
+        if listings is not None:
+            listings[directory] = listing
+    for name in listing[3]:
+        yield os.path.join(directory, name), os.path.join(rel_directory, name)
+    for name in listing[2]:
+        yield from walk_afm_files(os.path.join(directory, name), listings, os.path.join(rel_directory, name))
+
+
+def find_afm_files(
+    sources: typing.Iterable[str],
+    listings: typing.Dict[str, typing.Tuple[int, bool, list, list]] | None = None,
+) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Expands files, directories and glob patterns into a list of (AFM path, relative PFM path) pairs.
+    Directories are searched recursively and their subdirectory structure is kept in PFM paths
+    (listings of directories may be reused between calls, see walk_afm_files).
+    """
+    found = {}
+    for source in sources:
+        if os.path.isdir(source):
+            for afm_filename, rel_name in walk_afm_files(source, listings):
+                found.setdefault(afm_filename, rel_name)
+        else:
+            for afm_filename in sorted(glob.glob(source)) if glob.has_magic(source) else [source]:
+                if os.path.isfile(afm_filename):
+                    found.setdefault(afm_filename, os.path.basename(afm_filename))
+                elif not glob.has_magic(source):
+                    raise FileNotFoundError(f"A2P: No such AFM file or directory: {source}")
+    return [(afm_filename, os.path.splitext(rel_name)[0] + ".pfm") for afm_filename, rel_name in found.items()]
+
+
+def split_output_conflicts(
+    files: typing.List[typing.Tuple[str, str]],
+) -> typing.Tuple[typing.List[typing.Tuple[str, str]], typing.List[typing.Tuple[str, str, str]]]:
+    """
+    Splits (AFM, relative PFM name) pairs of find_afm_files into ones with distinct outputs and conflicting ones,
+    e.g. of overlapping trees: (AFM, relative PFM name, AFM converted into it) of every later AFM mapped to a PFM
+    name already taken (compared as the file system does, see os.path.normcase). The first AFM in sources order wins.
+    """
+    owners = {}
+    unique, conflicts = [], []
+    for afm_filename, pfm_name in files:
+        owner = owners.setdefault(os.path.normcase(pfm_name), afm_filename)
+        if owner == afm_filename:
+            unique.append((afm_filename, pfm_name))
+        else:
+            conflicts.append((afm_filename, pfm_name, owner))
+    return unique, conflicts
+
+
+def conflict_error(pfm_name: str, owner: str) -> str:
+    """ Returns error message of an AFM not converted because its PFM name is taken (see split_output_conflicts). """
+    return f"OutputConflict: {pfm_name} is already made from {owner}, not overwritten."
+
+
+class ConvertOptions(typing.NamedTuple):
+    """ Options of AFM to PFM conversion shared by all files of a batch. """
+    extra_args: dict | None = None  # overrides of AFM values (see overrides), None for none
+    no_kern_limit: bool = False
+    tables_order: int = PFM_TABLES_ORDER
+    cache_dir: str | None = None
+    cache_size: int = PFM_CACHE_SIZE
+    digest: bool = False  # report size, mtime and hash of converted AFMs (for BuildManifest)
+    stats: bool = False  # report instrumentation data of conversions (see Stats)
+    encodings: tuple = ()  # encoding specs (see load_encoding), one PFM per encoding instead of the AFM's own one
+    fsync: bool = False  # flush written PFMs to disk (see write_file_atomic)
+    metrics_cache: str | None = None  # directory of parsed AFMs cache, "" for sidecar files (see MetricsCache)
+
+    def overrides(self) -> dict:
+        """ Returns overrides of AFM values given in extra_args, an empty dict if none. """
+        return self.extra_args or {}
+
+    def params_digest(self) -> str:
+        """ Returns a hash of VERSION and all options which influence the PFM. """
+        params = [VERSION, self.tables_order, bool(self.no_kern_limit), sorted(self.overrides().items())]
+        for spec in self.encodings:
+            encoding = load_encoding(spec)
+            params.append([encoding.label, encoding.charset, [name and name.decode("latin-1") for name in encoding.vector]])
+        return hashlib.sha256(json.dumps(params).encode("utf-8")).hexdigest()
+
+    def output_files(self, pfm_filename: str) -> typing.List[str]:
+        """ Returns PFM files made for one AFM: pfm_filename itself, or one per encoding (NAME-LABEL.pfm). """
+        if not self.encodings:
+            return [pfm_filename]
+        stem, extension = os.path.splitext(pfm_filename)
+        return [f"{stem}-{encoding.label}{extension}" for encoding in load_encodings(self.encodings)]
+
+
+def add_options_arguments(parser: argparse.ArgumentParser, cache: bool = True, defaults_of: str | None = None):
+    """
+    Adds command line arguments of ConvertOptions shared by modes (see options_from_args): --nokernlimit, --order,
+    --set and with cache --cache-dir and --cache-size; defaults_of names what they are defaults of (e.g. requests).
+    """
+    suffix = f" (default of {defaults_of})" if defaults_of else ""
+    parser.add_argument("--nokernlimit", help="Do not obey the limit of 512 kerns" + suffix, action="store_true")
+    parser.add_argument("--order", help="Order of PFM tables: 0 - according to PFM doc, 1 - according to Y&Y" + suffix,
+                        type=int, choices=sorted(PFM_TABLES_LAYOUTS), default=PFM_TABLES_ORDER)
+    parser.add_argument("--set", help="Additional key:value argument (may be repeated)", action="append", default=[],
+                        dest="keyargs", metavar="KEY:VALUE")
+    if cache:
+        parser.add_argument("--cache-dir", help="Directory of PFM cache shared between runs")
+        parser.add_argument("--cache-size", help="Size limit of PFM cache in MiB (default: %(default)s)", type=int,
+                            default=PFM_CACHE_SIZE >> 20)
+
+
+def options_from_args(args: argparse.Namespace) -> ConvertOptions:
+    """ Returns ConvertOptions given by command line arguments added by add_options_arguments. """
+    cache_size = getattr(args, "cache_size", PFM_CACHE_SIZE >> 20) << 20
+    return ConvertOptions(parse_keyargs(args.keyargs), args.nokernlimit, args.order, getattr(args, "cache_dir", None), cache_size)
+
+
+class PfmCache:
+    """
+    Content addressed on-disk cache of PFM files, keyed by AFM contents, conversion options and VERSION.
+    Entries are written to temporary files and renamed, so many processes can safely share one directory.
+    When the cache grows over max_size bytes, least recently used entries are evicted.
+    """
+
+    _instances: typing.Dict[typing.Tuple[str, int], "PfmCache"] = {}
+
+    def __init__(self, directory: str, max_size: int = PFM_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = None  # estimated, other processes may write too
+        self.puts_since_scan = 0
+
+    @classmethod
+    def shared(cls, directory: str, max_size: int = PFM_CACHE_SIZE) -> "PfmCache":
+        """ Returns cache instance shared by all callers in this process. """
+        key = (directory, max_size)
+        if key not in cls._instances:
+            cls._instances[key] = cls(directory, max_size)
+            cls._instances[key].check_max_size()
+        return cls._instances[key]
+
+    def check_max_size(self):
+        """ Evicts entries at once when max_size is lower than at the last use, a cache of only hits would not shrink. """
+        path = os.path.join(self.directory, PFM_CACHE_LIMIT_NAME)
+        try:
+            with open(path, "rb") as limit_file:
+                previous = int(limit_file.read())
+        except (OSError, ValueError):
+            previous = None
+        if previous == self.max_size:
+            return
+        if previous is None or previous > self.max_size:
+            self.evict()
+        with contextlib.suppress(OSError):
+            write_file_atomic(path, str(self.max_size).encode("ascii"))
+
+    @staticmethod
+    def make_key(afm_data: bytes, options: ConvertOptions) -> str:
+        """ Returns a hash of AFM contents and of all options which influence the PFM. """
+        digest = hashlib.sha256(options.params_digest().encode("ascii"))
+        digest.update(b"\0")
+        digest.update(afm_data)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        """ Returns path of cache entry. """
+        return os.path.join(self.directory, key[:2], key + ".pfm")
+
+    def get(self, key: str) -> bytes | None:
+        """ Returns cached PFM or None, a hit marks the entry as recently used. """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as pfm_file:
+                pfm_data = pfm_file.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pfm_data
+
+    def put(self, key: str, pfm_data: bytes):
+        """ Stores PFM in the cache (errors are ignored, cache is only an optimization). """
+        path = self.path(key)
+        try:
+            write_file_atomic(path, pfm_data)
+        except OSError:
+            return
+        self.puts_since_scan += 1
+        if self.size is not None:
+            self.size += len(pfm_data)
+        if self.size is None or self.size > self.max_size or self.puts_since_scan >= 256:
+            self.evict()
+
+    def evict(self):
+        """
+        Scans the cache and removes least recently used entries until it is below 90% of max_size.
+        Temporary files are skipped, other processes may be just writing them.
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".pfm") or name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed by another process
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self.size = sum(size for _, _, size in entries)
+        self.puts_since_scan = 0
+        if self.size <= self.max_size:
+            return
+        entries.sort()
+        for _, path, size in entries:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            self.size -= size
+
+    def stats(self) -> dict:
+        """ Returns counters for logging. """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class BuildManifest:
+    """
+    Manifest of incremental batch conversion, stored as JSON: for every converted AFM its size, mtime
+    and content hash, the options used and the produced PFM. Inputs matching their entry need no conversion.
+    """
+
+    def __init__(self, path: str, options: ConvertOptions):
+        self.path = path
+        self.options = options
+        self.options_digest = options.params_digest()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+            self.entries = manifest.get("entries", {})
+
+    def is_current(self, afm_filename: str, pfm_filename: str) -> bool:
+        """ Checks if PFM was made from the same AFM with the same options (AFM hash is checked when mtime differs). """
+        entry = self.entries.get(os.path.abspath(afm_filename))
+        if (not entry or entry["options"] != self.options_digest
+                or entry["output"] != os.path.abspath(pfm_filename)
+                or not all(map(os.path.isfile, self.options.output_files(pfm_filename)))):
+            return False
+        stat = os.stat(afm_filename)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns != entry["mtime_ns"]:
+            if file_digest(afm_filename) != entry["sha256"]:
+                return False
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def record(self, result: dict):
+        """ Records successful conversion reported by a batch job (see _batch_job). """
+        self.entries[os.path.abspath(result["input"])] = {
+            "size": result["afm_size"],
+            "mtime_ns": result["afm_mtime_ns"],
+            "sha256": result["sha256"],
+            "options": self.options_digest,
+            "output": os.path.abspath(result["output"]),
+        }
+
+    def forget(self, afm_filename: str):
+        """ Removes entry (e.g. of a failed conversion). """
+        self.entries.pop(os.path.abspath(afm_filename), None)
+
+    def removed(self) -> typing.List[typing.Tuple[str, str]]:
+        """ Returns (AFM, PFM) pairs of entries whose AFM does not exist anymore. """
+        return [(afm_filename, pfm_filename) for afm_filename, entry in self.entries.items()
+                if not os.path.exists(afm_filename) for pfm_filename in self.options.output_files(entry["output"])]
+
+    def save(self):
+        """ Writes manifest atomically (see write_file_atomic), flushed to disk with fsync of options. """
+        data = json.dumps({"version": VERSION, "entries": self.entries}, indent=1, sort_keys=True).encode("utf-8")
+        if write_file_atomic(self.path, data, self.options.fsync) and self.options.fsync:
+            fsync_directories([self.path])
+
+
+def convert_afm_data(
+    afm_data: bytes,
+    options: ConvertOptions,
+    stats: Stats = NO_STATS,
+    warnings: list | None = None,
+) -> bytes:
+    """ Converts AFM given as bytes into PFM, entirely in memory (warnings are collected if a list is given). """
+    kern_limit = None if options.no_kern_limit else PFM_KERNS_LIMIT
+    afm_values, metrics = AfmReader.parse_afm_metrics(afm_data, kern_limit, stats)
+    pfm_writer = PfmWriter(tables_order=options.tables_order, stats=stats, warnings=warnings)
+    pfm_writer.prepare_metrics(afm_values, metrics, options.overrides(), options.no_kern_limit)
+    return pfm_writer.serialize_pfm()
+
+
+def convert_afm_encodings(
+    afm_data: bytes,
+    options: ConvertOptions,
+    stats: Stats = NO_STATS,
+    warnings: list | None = None,
+) -> typing.List[bytes]:
+    """ Converts AFM given as bytes into PFMs of all encodings given in options, the AFM is parsed only once. """
+    glyphs = AfmReader.parse_afm_glyphs(afm_data, stats)
+    pfm_writer = PfmWriter(tables_order=options.tables_order, stats=stats, warnings=warnings)
+    pfms = []
+    for spec in options.encodings:
+        afm_values, afm_widths, afm_kerns = glyphs.encode(load_encoding(spec))
+        pfm_writer.prepare_data(afm_values, afm_widths, afm_kerns, options.overrides(), options.no_kern_limit)
+        pfms.append(pfm_writer.serialize_pfm())
+    return pfms
+
+
+def convert(
+    afm: "bytes | str | os.PathLike | typing.IO",
+    *,
+    no_kern_limit: bool = False,
+    tables_order: int = PFM_TABLES_ORDER,
+    extra_args: dict | None = None,
+    encoding: str | None = None,
+    warnings: list | None = None,
+    stats: Stats = NO_STATS,
+) -> bytes:
+    """
+    Library API: converts AFM into PFM in memory and returns it, nothing is printed or written.
+    AFM is given as bytes (or any buffer), str with its text, path (os.PathLike) or a stream open in binary or text mode.
+    Options are the same as of batch mode, encoding is an encoding spec (see load_encoding).
+    Problems which do not stop the conversion are appended to warnings list (as ConvertWarning) if given.
+    Errors of AFM or options (including an encoding file which can not be read) raise ValueError
+    (OSError for an AFM path which can not be read);
+    the function is safe to call from many threads.
+    """
+    if isinstance(afm, str):
+        afm_data = afm.encode(STRING_ENCODING)
+    elif isinstance(afm, os.PathLike):
+        with open(afm, "rb") as afm_file:
+            afm_data = afm_file.read()
+    elif hasattr(afm, "read"):
+        afm_data = afm.read()
+        if isinstance(afm_data, str):
+            afm_data = afm_data.encode(STRING_ENCODING)
+    else:
+        afm_data = bytes(afm)
+    if tables_order not in PFM_TABLES_LAYOUTS:
+        raise ValueError(f"A2P: Unknown order of PFM tables: {tables_order!r}.")
+    options = ConvertOptions(dict(extra_args or {}), no_kern_limit, tables_order, encodings=(encoding,) if encoding else ())
+    warnings = [] if warnings is None else warnings
+    if encoding:
+        try:
+            load_encoding(encoding)
+        except OSError as exc:
+            raise ValueError(f"A2P: Can not read encoding {encoding}: {exc}") from exc
+    try:
+        if encoding:
+            return convert_afm_encodings(afm_data, options, stats, warnings)[0]
+        return convert_afm_data(afm_data, options, stats, warnings)
+    except KeyError as exc:
+        raise ValueError(f"A2P: Missing AFM value: {exc.args[0]}.") from exc
+    except struct.error as exc:  # e.g. an override too big for its PFM field
+        raise ValueError(f"A2P: Value out of range of PFM field: {exc}.") from exc
+    except IndexError as exc:  # e.g. a character code over 255
+        raise ValueError(f"A2P: Malformed AFM: {exc}.") from exc
+    except RuntimeError as exc:  # e.g. empty or not an AFM at all
+        raise ValueError(str(exc)) from exc
+
+
+def convert_afm_cached(
+    afm_data: bytes,
+    options: ConvertOptions,
+    stats: Stats = NO_STATS,
+    warnings: list | None = None,
+) -> bytes:
+    """ Converts AFM given as bytes into PFM through the cache set in options (see PfmCache), cached ones give no warnings. """
+    cache = PfmCache.shared(options.cache_dir, options.cache_size)
+    key = cache.make_key(afm_data, options)
+    pfm_data = cache.get(key)
+    stats.count("cache_misses" if pfm_data is None else "cache_hits")
+    if pfm_data is None:
+        pfm_data = convert_afm_data(afm_data, options, stats, warnings)
+        cache.put(key, pfm_data)
+    return pfm_data
+
+
+def convert_file(
+    afm_filename: str,
+    pfm_filename: str,
+    options: ConvertOptions,
+    stats: Stats = NO_STATS,
+    warnings: list | None = None,
+) -> int:
+    """
+    Converts a single AFM file into PFM one (through the cache if set in options), returns the size of written PFM.
+    Warnings are collected if a list is given (see PfmWriter.warn).
+    """
+    if options.encodings:
+        return convert_file_encodings(afm_filename, pfm_filename, options, stats, warnings)
+    if options.cache_dir:
+        with open(afm_filename, "rb") as afm_file:
+            afm_data = afm_file.read()
+        pfm_data = convert_afm_cached(afm_data, options, stats, warnings)
+    else:
+        kern_limit = None if options.no_kern_limit else PFM_KERNS_LIMIT
+        if options.metrics_cache is not None:
+            afm_values, metrics = MetricsCache(options.metrics_cache).read_afm(afm_filename, kern_limit, stats)
+        else:
+            afm_values, metrics = AfmReader.read_afm_metrics(afm_filename, kern_limit, stats)
+        pfm_writer = PfmWriter(tables_order=options.tables_order, stats=stats, warnings=warnings)
+        pfm_writer.prepare_metrics(afm_values, metrics, options.overrides(), options.no_kern_limit)
+        pfm_data = pfm_writer.serialize_pfm()
+
+    with stats.phase("write_pfm"):
+        written = write_file_atomic(pfm_filename, pfm_data, options.fsync)
+    stats.count("files")
+    stats.count("files_written" if written else "files_unchanged")
+    if written:
+        stats.count("bytes_written", len(pfm_data))
+    return len(pfm_data)
+
+
+def convert_file_encodings(
+    afm_filename: str,
+    pfm_filename: str,
+    options: ConvertOptions,
+    stats: Stats = NO_STATS,
+    warnings: list | None = None,
+) -> int:
+    """ Converts AFM file into PFMs of all encodings given in options (see ConvertOptions.output_files), returns total size. """
+    with open(afm_filename, "rb") as afm_file:
+        afm_data = afm_file.read()
+    pfms = None
+    if options.cache_dir:
+        cache = PfmCache.shared(options.cache_dir, options.cache_size)
+        keys = [cache.make_key(afm_data, options._replace(encodings=(spec,))) for spec in options.encodings]
+        pfms = [cache.get(key) for key in keys]
+        stats.count("cache_hits", sum(pfm_data is not None for pfm_data in pfms))
+        if None in pfms:
+            stats.count("cache_misses", pfms.count(None))
+            pfms = convert_afm_encodings(afm_data, options, stats, warnings)
+            for key, pfm_data in zip(keys, pfms):
+                cache.put(key, pfm_data)
+    else:
+        pfms = convert_afm_encodings(afm_data, options, stats, warnings)
+
+    with stats.phase("write_pfm"):
+        for output_filename, pfm_data in zip(options.output_files(pfm_filename), pfms):
+            written = write_file_atomic(output_filename, pfm_data, options.fsync)
+            stats.count("files")
+            stats.count("files_written" if written else "files_unchanged")
+            if written:
+                stats.count("bytes_written", len(pfm_data))
+    return sum(map(len, pfms))
+
+
+def print_messages(afm_filename: str, messages: typing.Iterable[str]):
+    """ Prints warnings of a worker's conversion (see _batch_job) prefixed with the name of the AFM file. """
+    for message in messages:
+        print(f"A2P: {afm_filename}: {message.removeprefix('A2P: ')}")
+
+
+def run_parallel(function: typing.Callable, jobs: list, workers: int | None = None) -> typing.Iterator:
+    """ Runs function for all jobs in a pool of processes (or in this process for a single worker), yields results. """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    if workers == 1:
+        yield from map(function, jobs)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(function, jobs, chunksize=max(1, len(jobs) // (workers * 16)))
+
+
+def _convert_job(job: tuple) -> dict:
+    """
+    Process pool entry point, converts AFM given as bytes and catches errors.
+    Warnings of the converter are returned as messages instead of being printed.
+    """
+    afm_data, options = job
+    stats = Stats()
+    result = {"pfm": None, "error": None, "messages": []}
+    warnings = []
+    try:
+        if options.cache_dir:
+            result["pfm"] = convert_afm_cached(afm_data, options, stats, warnings)
+        else:
+            result["pfm"] = convert_afm_data(afm_data, options, stats, warnings)
+    except Exception as exc:  # pylint: disable=broad-except
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    result["messages"] = [warning.message for warning in warnings]
+    result["kerns_dropped"] = stats.counts.get("kern_pairs_dropped", 0)
+    return result
+
+
+def request_options(request: dict, defaults: ConvertOptions) -> ConvertOptions:
+    """
+    Returns conversion options of a request (JSON object) given over defaults:
+    "nokernlimit" (bool), "order" (int) and "set" (object or list of KEY:VALUE strings).
+    """
+    options = defaults
+    if "nokernlimit" in request:
+        options = options._replace(no_kern_limit=bool(request["nokernlimit"]))
+    if "order" in request:
+        if request["order"] not in PFM_TABLES_LAYOUTS:
+            raise ValueError(f"A2P: Unknown order of PFM tables: {request['order']!r}.")
+        options = options._replace(tables_order=request["order"])
+    if "set" in request:
+        extra_args = request["set"]
+        if isinstance(extra_args, list):
+            extra_args = parse_keyargs(extra_args)
+        elif not isinstance(extra_args, dict):
+            raise ValueError("A2P: Request 'set' must be an object or a list of KEY:VALUE strings.")
+        options = options._replace(extra_args={**options.overrides(), **extra_args})
+    return options
+
+
+def map_bounded(function: typing.Callable, jobs: typing.Iterable, workers: int | None = None) -> typing.Iterator:
+    """
+    Like run_parallel, but jobs are taken lazily and results yielded in order as soon as possible,
+    with at most a few jobs per worker in flight (so large inputs are not all held in memory).
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(function, jobs)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append(executor.submit(function, job))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,396 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM daemon mode (serve) and its client, jobs mode converting JSON lines jobs read from stdin.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import pathlib
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import typing
+
+from a2p.common import write_file_atomic
+from a2p.convert import add_options_arguments, _convert_job, ConvertOptions, options_from_args, request_options
+
+
+DAEMON_PIPELINE_DEPTH = 64  # requests of one connection read ahead of their responses
+DAEMON_MAX_HEADER = 64 << 10  # bytes of request header line
+DAEMON_MAX_REQUEST = 64 << 20  # bytes of AFM data in one request
+DAEMON_LATENCY_WINDOW = 10000  # latest requests used for latency percentiles
+
+
+def latency_percentiles(latencies: typing.Iterable[float]) -> dict:
+    """ Returns nearest-rank percentiles (and maximum) of latencies, in milliseconds. """
+    values = sorted(latencies)
+    if not values:
+        return {}
+    percentiles = {f"p{int(fraction * 100)}": values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+                   for fraction in (0.5, 0.9, 0.99)}
+    percentiles["max"] = values[-1] * 1000
+    return percentiles
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Connection of the daemon. Protocol: every request is a JSON header line followed by "length" bytes of AFM data,
+    every response is a JSON header line followed by "length" bytes of PFM data (for status "ok").
+    Requests are read ahead (pipelining) and converted in parallel, responses are written in the order of requests.
+    """
+
+    def handle(self):
+        self.server.connection_opened(self.connection)
+        pending = queue.Queue(maxsize=DAEMON_PIPELINE_DEPTH)
+        writer = threading.Thread(target=self.write_responses, args=(pending,), daemon=True)
+        writer.start()
+        try:
+            while True:
+                line = self.rfile.readline(DAEMON_MAX_HEADER + 1)
+                if not line.strip():
+                    if not line:
+                        break
+                    continue
+                received = time.perf_counter()
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("A2P: Request header must be a JSON object.")
+                    pending.put((request, received, self.dispatch(request)))
+                except (ValueError, EOFError) as exc:  # framing is lost, the connection is closed
+                    pending.put((request if isinstance(request, dict) else {}, received, {"error": f"Malformed request: {exc}"}))
+                    break
+        except OSError:
+            pass
+        finally:
+            pending.put(None)
+            writer.join()
+            self.server.connection_closed(self.connection)
+
+    def dispatch(self, request: dict):
+        """ Starts processing of a request, returns a future or a ready response. """
+        operation = request.get("op", "convert")
+        if operation == "stats":
+            return {"status": "ok", "stats": self.server.stats()}
+        if operation == "ping":
+            return {"status": "ok"}
+        length = request.get("length", 0)
+        if not isinstance(length, int) or not 0 <= length <= DAEMON_MAX_REQUEST:
+            raise ValueError(f"A2P: Improper request length: {length!r}.")
+        afm_data = self.rfile.read(length)
+        if len(afm_data) < length:
+            raise EOFError("A2P: Connection closed inside of request data.")
+        if operation != "convert":
+            return {"error": f"Unknown operation: {operation!r}"}
+        try:
+            options = request_options(request, self.server.options)
+        except ValueError as exc:
+            return {"error": str(exc)}
+        return self.server.executor.submit(_convert_job, (afm_data, options))
+
+    def write_responses(self, pending: queue.Queue):
+        """ Writes responses of pending requests in order, records their latency. """
+        broken = False
+        while (item := pending.get()) is not None:
+            request, received, response = item
+            if isinstance(response, concurrent.futures.Future):
+                try:
+                    response = response.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    response = {"error": f"{type(exc).__name__}: {exc}"}
+            pfm_data = response.pop("pfm", None) or b""
+            header = {"id": request.get("id"), "status": "error" if response.get("error") else "ok", **response}
+            if header["status"] == "ok":
+                header.pop("error", None)
+                header["length"] = len(pfm_data)
+            if broken:
+                continue
+            try:
+                self.wfile.write(json.dumps(header).encode("utf-8") + b"\n" + pfm_data)
+                self.wfile.flush()
+            except OSError:
+                broken = True  # client is gone, its requests are still drained
+            self.server.record(time.perf_counter() - received, header["status"] == "ok")
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Conversion daemon listening on a Unix domain socket (address given as path) or on TCP (address as (host, port)).
+    Connections are served by threads, conversions by a pool of worker processes.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+    allow_reuse_address = True
+
+    def __init__(self, address: str | typing.Tuple[str, int], options: ConvertOptions, workers: int | None = None):
+        if isinstance(address, str):
+            self.address_family = socket.AF_UNIX
+            socket_path = pathlib.Path(address)
+            if socket_path.is_socket():
+                with socket.socket(socket.AF_UNIX) as probe:
+                    if probe.connect_ex(address) == 0:
+                        raise RuntimeError(f"A2P: Daemon already listening on: {address}")
+                socket_path.unlink()  # stale socket of a daemon which did not stop cleanly
+        self.options = options
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=DAEMON_LATENCY_WINDOW)
+        super().__init__(address, _DaemonHandler)
+
+    def connection_opened(self, connection: socket.socket):
+        """ Registers an open client connection, so stop can shut down reading of its requests. """
+        with self.lock:
+            self.connections.add(connection)
+
+    def connection_closed(self, connection: socket.socket):
+        """ Unregisters a client connection closed by either side. """
+        with self.lock:
+            self.connections.discard(connection)
+
+    def record(self, latency: float, succeeded: bool):
+        """ Records a finished request. """
+        with self.lock:
+            self.requests += 1
+            self.errors += not succeeded
+            self.latencies.append(latency)
+
+    def stats(self) -> dict:
+        """ Returns number of requests, errors, connections and latency percentiles (in ms). """
+        with self.lock:
+            return {
+                "uptime": time.time() - self.started,
+                "requests": self.requests,
+                "errors": self.errors,
+                "connections": len(self.connections),
+                "latency_ms": latency_percentiles(self.latencies),
+            }
+
+    def stop(self):
+        """
+        Graceful shutdown (safe to call from a signal handler): stops accepting connections and reading requests,
+        requests already read are converted and answered before connections are closed.
+        """
+        threading.Thread(target=self.shutdown).start()
+        with self.lock:
+            for connection in self.connections:
+                with contextlib.suppress(OSError):
+                    connection.shutdown(socket.SHUT_RD)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        if self.address_family == socket.AF_UNIX:
+            with contextlib.suppress(OSError):
+                os.unlink(self.server_address)
+
+
+class DaemonClient:
+    """ Client of DaemonServer, address as for the server. Errors reported by the daemon are raised as RuntimeError. """
+
+    def __init__(self, address: str | typing.Tuple[str, int]):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.rfile = self.socket.makefile("rb")
+        self.ids = itertools.count()
+
+    def close(self):
+        """ Closes the connection to the daemon. """
+        self.rfile.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, operation: str = "convert", afm_data: bytes = b"", **options) -> int:
+        """ Sends a request without waiting for its response (pipelining), returns its id. """
+        request_id = next(self.ids)
+        header = {"id": request_id, "op": operation, "length": len(afm_data), **options}
+        self.socket.sendall(json.dumps(header).encode("utf-8") + b"\n" + afm_data)
+        return request_id
+
+    def receive(self) -> typing.Tuple[dict, bytes]:
+        """ Returns next response: its header and PFM data. """
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError("A2P: Daemon closed the connection.")
+        header = json.loads(line)
+        return header, self.rfile.read(header.get("length", 0)) if header["status"] == "ok" else b""
+
+    def convert(self, afm_data: bytes, **options) -> bytes:
+        """ Converts AFM data into PFM, options as in request_options. """
+        self.send("convert", afm_data, **options)
+        header, pfm_data = self.receive()
+        if header["status"] != "ok":
+            raise RuntimeError(header["error"])
+        return pfm_data
+
+    def convert_many(self, afm_data_list: typing.Iterable[bytes], **options) -> typing.Iterator[typing.Tuple[dict, bytes]]:
+        """ Converts many AFMs over one connection with requests pipelined, yields responses in order. """
+        sent = queue.Queue()
+
+        def sender():
+            for afm_data in afm_data_list:
+                sent.put(self.send("convert", afm_data, **options))
+            sent.put(None)
+
+        thread = threading.Thread(target=sender, daemon=True)
+        thread.start()
+        while sent.get() is not None:
+            yield self.receive()
+        thread.join()
+
+    def stats(self) -> dict:
+        """ Returns statistics of the daemon. """
+        self.send("stats")
+        return self.receive()[0]["stats"]
+
+
+def parse_address(socket_path: str | None, port: int | None, host: str) -> str | typing.Tuple[str, int]:
+    """ Returns daemon address given by command line options. """
+    if (socket_path is None) == (port is None):
+        raise ValueError("A2P: Give either a Unix socket path or a TCP port.")
+    return socket_path if socket_path is not None else (host, port)
+
+
+def serve_main(argv: typing.List[str]) -> int:
+    """ Daemon mode: converts AFMs sent over a Unix domain or TCP socket until SIGTERM or SIGINT. """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py serve", description="Runs a conversion daemon on a Unix domain socket or local TCP port."
+    )
+    parser.add_argument("-s", "--socket", help="Path of Unix domain socket to listen on")
+    parser.add_argument("-p", "--port", help="TCP port to listen on", type=int)
+    parser.add_argument("--host", help="TCP address to listen on (default: %(default)s)", default="127.0.0.1")
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    add_options_arguments(parser, defaults_of="requests")
+    args = parser.parse_args(argv)
+
+    try:
+        address = parse_address(args.socket, args.port, args.host)
+    except ValueError as exc:
+        parser.error(str(exc))
+    options = options_from_args(args)
+    with DaemonServer(address, options, args.jobs) as server:
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda *_: server.stop())
+        print(f"A2P: Listening on: {address}", flush=True)
+        server.serve_forever()
+        stats = server.stats()
+    print(f"A2P: Daemon stopped after {stats['requests']} requests ({stats['errors']} failed).")
+    return 0
+
+
+def _stream_job(job: tuple) -> dict:
+    """ Process pool entry point of jobs mode, converts one AFM file into PFM one, catches errors. """
+    job_id, afm_filename, pfm_filename, options = job
+    start = time.perf_counter()
+    result = {"id": job_id, "status": "ok", "input": afm_filename, "output": pfm_filename}
+    try:
+        with open(afm_filename, "rb") as afm_file:
+            afm_data = afm_file.read()
+        converted = _convert_job((afm_data, options))
+        if converted["pfm"] is not None:
+            result["written"] = write_file_atomic(pfm_filename, converted["pfm"], options.fsync)
+        result.update(size=len(converted["pfm"] or b""), kerns_dropped=converted["kerns_dropped"],
+                      messages=converted["messages"], error=converted["error"])
+    except OSError as exc:
+        result.update(size=0, error=f"{type(exc).__name__}: {exc}")
+    result["status"] = "error" if result["error"] else "ok"
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def jobs_main(argv: typing.List[str]) -> int:
+    """
+    Jobs mode: reads jobs from stdin, one JSON object per line: "input" AFM path, optional "output" PFM path, "id",
+    and overrides as in request_options. Writes one JSON result per job (in order of completion) to stdout.
+    """
+    parser = argparse.ArgumentParser(
+        prog="afm2pfm.py jobs", description="Converts AFM files given as JSON lines on stdin, reports JSON lines on stdout."
+    )
+    parser.add_argument("-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int)
+    parser.add_argument("--max-in-flight", help="Jobs submitted ahead of their results (default: 4 per worker)", type=int)
+    add_options_arguments(parser, defaults_of="jobs")
+    args = parser.parse_args(argv)
+
+    defaults = options_from_args(args)
+    workers = args.jobs or os.cpu_count() or 1
+    slots = threading.BoundedSemaphore(args.max_in_flight or 4 * workers)
+    output_lock = threading.Lock()
+    counts = {"ok": 0, "error": 0}
+
+    def report(result: dict):
+        with output_lock:
+            counts[result["status"]] += 1
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+
+    def finished(future: concurrent.futures.Future):
+        try:
+            report(future.result())
+        except Exception as exc:  # pylint: disable=broad-except
+            report({"id": future.job_id, "status": "error", "error": f"{type(exc).__name__}: {exc}"})
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for line_number, line in enumerate(sys.stdin, 1):
+            if not line.strip():
+                continue
+            job_id = line_number
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict) or not isinstance(job.get("input"), str):
+                    raise ValueError("A2P: Job must be a JSON object with 'input' path.")
+                job_id = job.get("id", line_number)
+                options = request_options(job, defaults)
+            except ValueError as exc:
+                report({"id": job_id, "status": "error", "error": str(exc)})
+                continue
+            pfm_filename = job.get("output") or os.path.splitext(job["input"])[0] + ".pfm"
+            slots.acquire()  # pylint: disable=consider-using-with
+            future = executor.submit(_stream_job, (job_id, job["input"], pfm_filename, options))
+            future.job_id = job_id
+            future.add_done_callback(finished)
+    print(f"A2P: {counts['ok'] + counts['error']} jobs done in {time.perf_counter() - start:.2f} s, "
+          f"{counts['error']} failed.", file=sys.stderr)
+    return 1 if counts["error"] else 0
@@ -0,0 +1,135 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM encodings: vectors of built-in code pages and .enc files, for PFMs of other than the AFM's own encoding.
+"""
+
+import collections
+import functools
+import os
+import re
+import typing
+
+
+GLYPH_NAMES = {  # Unicode to glyph names (Adobe Glyph List) of characters of built-in encodings
+    **dict(zip(range(0x20, 0x7F), (
+        "space exclam quotedbl numbersign dollar percent ampersand quotesingle parenleft parenright asterisk plus comma "
+        "hyphen period slash zero one two three four five six seven eight nine colon semicolon less equal greater "
+        "question at A B C D E F G H I J K L M N O P Q R S T U V W X Y Z bracketleft backslash bracketright "
+        "asciicircum underscore grave a b c d e f g h i j k l m n o p q r s t u v w x y z braceleft bar braceright "
+        "asciitilde").split())),
+    **dict(zip(range(0xA0, 0x100), (
+        "space exclamdown cent sterling currency yen brokenbar section dieresis copyright ordfeminine guillemotleft "
+        "logicalnot hyphen registered macron degree plusminus twosuperior threesuperior acute mu paragraph "
+        "periodcentered cedilla onesuperior ordmasculine guillemotright onequarter onehalf threequarters questiondown "
+        "Agrave Aacute Acircumflex Atilde Adieresis Aring AE Ccedilla Egrave Eacute Ecircumflex Edieresis Igrave "
+        "Iacute Icircumflex Idieresis Eth Ntilde Ograve Oacute Ocircumflex Otilde Odieresis multiply Oslash Ugrave "
+        "Uacute Ucircumflex Udieresis Yacute Thorn germandbls agrave aacute acircumflex atilde adieresis aring ae "
+        "ccedilla egrave eacute ecircumflex edieresis igrave iacute icircumflex idieresis eth ntilde ograve oacute "
+        "ocircumflex otilde odieresis divide oslash ugrave uacute ucircumflex udieresis yacute thorn ydieresis").split())),
+    0x0102: "Abreve", 0x0103: "abreve", 0x0104: "Aogonek", 0x0105: "aogonek", 0x0106: "Cacute", 0x0107: "cacute",
+    0x010C: "Ccaron", 0x010D: "ccaron", 0x010E: "Dcaron", 0x010F: "dcaron", 0x0110: "Dcroat", 0x0111: "dcroat",
+    0x0118: "Eogonek", 0x0119: "eogonek", 0x011A: "Ecaron", 0x011B: "ecaron", 0x0139: "Lacute", 0x013A: "lacute",
+    0x013D: "Lcaron", 0x013E: "lcaron", 0x0141: "Lslash", 0x0142: "lslash", 0x0143: "Nacute", 0x0144: "nacute",
+    0x0147: "Ncaron", 0x0148: "ncaron", 0x0150: "Ohungarumlaut", 0x0151: "ohungarumlaut", 0x0152: "OE", 0x0153: "oe",
+    0x0154: "Racute", 0x0155: "racute", 0x0158: "Rcaron", 0x0159: "rcaron", 0x015A: "Sacute", 0x015B: "sacute",
+    0x015E: "Scedilla", 0x015F: "scedilla", 0x0160: "Scaron", 0x0161: "scaron", 0x0162: "Tcommaaccent",
+    0x0163: "tcommaaccent", 0x0164: "Tcaron", 0x0165: "tcaron", 0x016E: "Uring", 0x016F: "uring",
+    0x0170: "Uhungarumlaut", 0x0171: "uhungarumlaut", 0x0178: "Ydieresis", 0x0179: "Zacute", 0x017A: "zacute",
+    0x017B: "Zdotaccent", 0x017C: "zdotaccent", 0x017D: "Zcaron", 0x017E: "zcaron", 0x0192: "florin",
+    0x02C6: "circumflex", 0x02C7: "caron", 0x02D8: "breve", 0x02D9: "dotaccent", 0x02DB: "ogonek", 0x02DC: "tilde",
+    0x02DD: "hungarumlaut", 0x2013: "endash", 0x2014: "emdash", 0x2018: "quoteleft", 0x2019: "quoteright",
+    0x201A: "quotesinglbase", 0x201C: "quotedblleft", 0x201D: "quotedblright", 0x201E: "quotedblbase",
+    0x2020: "dagger", 0x2021: "daggerdbl", 0x2022: "bullet", 0x2026: "ellipsis", 0x2030: "perthousand",
+    0x2039: "guilsinglleft", 0x203A: "guilsinglright", 0x20AC: "Euro", 0x2122: "trademark",
+}
+BUILTIN_ENCODINGS = {  # name: (Python codec, PFM CharSet)
+    "winansi": ("cp1252", 0),  # ANSI_CHARSET
+    "latin2": ("cp1250", 238),  # EASTEUROPE_CHARSET
+}
+ENCODING_FILE_CHARSET = 255  # default CharSet of custom encodings (OEM_CHARSET, i.e. no translation by Windows)
+
+
+class Encoding(typing.NamedTuple):
+    """ Encoding vector: glyph names (bytes, None for .notdef) of 256 codes, with PFM CharSet and a label for file names. """
+    label: str
+    vector: typing.Tuple[bytes | None, ...]
+    charset: int
+
+
+def codepage_encoding(codec: str) -> typing.Tuple[bytes | None, ...]:
+    """ Returns encoding vector of a single byte Python codec (named after GLYPH_NAMES). """
+    vector = [None] * 256
+    for code in range(256):
+        try:
+            name = GLYPH_NAMES.get(ord(bytes([code]).decode(codec)))
+        except UnicodeDecodeError:
+            continue
+        if name:
+            vector[code] = name.encode("ascii")
+    return tuple(vector)
+
+
+def parse_encoding_file(enc_data: bytes) -> typing.Tuple[bytes | None, ...]:
+    """ Parses PostScript encoding vector (.enc file: /Name [ /glyph ... ] def) of 256 glyph names. """
+    enc_data = re.sub(rb"%[^\r\n]*", b"", enc_data)
+    start = enc_data.find(b"[")
+    end = enc_data.find(b"]", start)
+    if start < 0 or end < 0:
+        raise ValueError("A2P: Malformed encoding file (no vector in [ ]).")
+    names = re.findall(rb"/([^\s/\[\]{}()<>%]+)", enc_data[start + 1:end])
+    if len(names) != 256:
+        raise ValueError(f"A2P: Malformed encoding file ({len(names)} glyph names instead of 256).")
+    return tuple(None if name == b".notdef" else name for name in names)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_encoding(spec: str, mtime_ns: int | None) -> Encoding:  # pylint: disable=unused-argument
+    """ Loads encoding (cached, mtime_ns is only a part of the cache key, so a changed .enc file is loaded again). """
+    name, _, charset = spec.rpartition(":") if re.search(r":\d+$", spec) else (spec, "", "")
+    if name.lower() in BUILTIN_ENCODINGS:
+        codec, default_charset = BUILTIN_ENCODINGS[name.lower()]
+        return Encoding(name.lower(), codepage_encoding(codec), int(charset) if charset else default_charset)
+    with open(name, "rb") as enc_file:
+        vector = parse_encoding_file(enc_file.read())
+    label = os.path.splitext(os.path.basename(name))[0]
+    return Encoding(label, vector, int(charset) if charset else ENCODING_FILE_CHARSET)
+
+
+def load_encoding(spec: str) -> Encoding:
+    """
+    Returns encoding given as name of built-in one (see BUILTIN_ENCODINGS) or path of .enc file,
+    optionally followed by :CHARSET. Encodings are parsed once per process.
+    """
+    name = spec.rpartition(":")[0] if re.search(r":\d+$", spec) else spec
+    mtime_ns = None if name.lower() in BUILTIN_ENCODINGS else os.stat(name).st_mtime_ns
+    return _load_encoding(spec, mtime_ns)
+
+
+def load_encodings(specs: typing.Iterable[str]) -> typing.List[Encoding]:
+    """ Returns encodings of specs (see load_encoding), their labels have to differ as they name the PFM files. """
+    encodings = [load_encoding(spec) for spec in specs]
+    labels = collections.Counter(encoding.label for encoding in encodings)
+    repeated = sorted(label for label, count in labels.items() if count > 1)
+    if repeated:
+        raise ValueError(f"A2P: Encodings with the same label (PFM file name): {', '.join(repeated)}.")
+    return encodings
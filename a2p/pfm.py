@@ -0,0 +1,690 @@
+# MIT License
+#
+# Copyright (c) 2023 GUST (Piotr Strzelczyk)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+AFM2PFM PFM format: layout of PFM files, making them out of AFM data (see PfmWriter) and reading them (see PfmReader).
+"""
+
+import functools
+import math
+import mmap
+import os
+import re
+import struct
+import typing
+
+from a2p.common import NO_STATS, PFM_KERNS_LIMIT, STRING_ENCODING, Stats, timed_phase, write_file_atomic
+from a2p.afm import AFM_HEADERS_DEFAULTS, WEIGTHS, AfmMetrics
+
+
+PFM_HEADER = [
+    ('H', 'Version'),
+    ('I', 'Size'),
+    ('60s', 'Copyright'),
+    ('H', 'Type'),
+    ('H', 'Points'),
+    ('H', 'VertRes'),
+    ('H', 'HorizRes'),
+    ('H', 'Ascent'),
+    ('H', 'InternalLeading'),
+    ('H', 'ExternalLeading'),
+    ('B', 'Italic'),
+    ('B', 'Underline'),
+    ('B', 'Stikeout'),
+    ('H', 'Weight'),
+    ('B', 'CharSet'),
+    ('H', 'PixWidth'),
+    ('H', 'PixHeight'),
+    ('B', 'PitchAndFamily'),
+    ('H', 'AvgWidth'),
+    ('H', 'MaxWidth'),
+    ('B', 'FirstChar'),
+    ('B', 'LastChar'),
+    ('B', 'DefaultChar'),
+    ('B', 'BreakChar'),
+    ('H', 'WidthBytes'),
+    ('I', 'Device'),
+    ('I', 'Face'),
+    ('I', 'BitsPointer'),
+    ('I', 'BitsOffset'),
+    ('H', 'SizeFields'),
+    ('I', 'ExtMetricOffset'),
+    ('I', 'ExtentTable'),
+    ('I', 'OriginTable'),
+    ('I', 'PairKernTable'),
+    ('I', 'TrackKernTable'),
+    ('I', 'DriverInfo'),
+    ('I', 'Reserved'),
+]
+PFM_EXTMETRIC = [
+    ('h', 'Size_ext'),
+    ('h', 'PointSize'),
+    ('h', 'Orientation'),
+    ('h', 'MasterHeight'),
+    ('h', 'MinScale'),
+    ('h', 'MaxScale'),
+    ('h', 'MasterUnits'),
+    ('h', 'CapHeight'),
+    ('h', 'XHeight'),
+    ('h', 'LowerCaseAscent'),
+    ('h', 'LowerCaseDescent'),
+    ('h', 'Slant'),
+    ('h', 'SuperScript'),
+    ('h', 'SubScript'),
+    ('h', 'SuperScriptSize'),
+    ('h', 'SubScriptSize'),
+    ('h', 'UnderlineOffset'),
+    ('h', 'UnderlineWidth'),
+    ('h', 'DoubleUpperUnderlineOffset'),
+    ('h', 'DoubleLowerUnderlineOffset'),
+    ('h', 'DoubleUpperUnderlineWidth'),
+    ('h', 'DoubleLowerUnderlineWidth'),
+    ('h', 'StrikeOutOffset'),
+    ('h', 'StrikeOutWidth'),
+    ('H', 'KernPairs'),
+    ('H', 'KernTracks'),
+]
+PFM_STRINGS = [  # strings with variable length
+    ('Device', 'DeviceName'),
+    ('Face', 'WindowsName'),
+    ('DriverInfo', 'PostscriptName')
+]
+PAT_LENGTHS = {'B': 1, 'h': 2, 'H': 2, 'I': 4, '60s': 60}
+PFM_LAYOUT_FIELDS = {  # fixed size fields describing the layout of file, PFM cannot be patched with other values of them
+    'Version', 'Size', 'FirstChar', 'LastChar', 'Device', 'Face', 'ExtMetricOffset', 'ExtentTable', 'OriginTable',
+    'PairKernTable', 'TrackKernTable', 'DriverInfo', 'Size_ext', 'KernPairs', 'KernTracks',
+}
+
+PFM_TABLES_ORDER = 1  # default order of tables, see PFM_TABLES_LAYOUTS
+PFM_TABLES_LAYOUTS = {  # tables following the header, named by header pointer fields ('Extra' has no pointer)
+    0: ('Device', 'Face', 'ExtMetricOffset', 'ExtentTable', 'DriverInfo', 'PairKernTable', 'Extra'),  # PFM doc
+    1: ('ExtMetricOffset', 'Device', 'Face', 'DriverInfo', 'Extra', 'ExtentTable', 'PairKernTable'),  # Y&Y
+}
+PFM_EXTRA_VALUES = {
+    'Info': 'JNSteam'
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def pfm_table_struct(pattern: str, count: int) -> struct.Struct:
+    """ Returns (cached) compiled struct for a table of count records of given pattern. """
+    return struct.Struct('<' + pattern * count)
+
+
+class PfmLayout:
+    """
+    Precompiled layout of PFM file: structs of fixed size blocks (header and extmetric) and order of tables.
+    Layouts are built once per tables order (see PFM_LAYOUTS) and shared by all writers, do not modify them.
+    """
+
+    def __init__(self, tables_order: int):
+        self.tables_order = tables_order
+        self.tables = PFM_TABLES_LAYOUTS[tables_order]
+        self.head_names = tuple(name for _, name in PFM_HEADER)
+        self.head_struct = struct.Struct('<' + ''.join(pat for pat, _ in PFM_HEADER))
+        self.ext_names = tuple(name for _, name in PFM_EXTMETRIC)
+        self.ext_struct = struct.Struct('<' + ''.join(pat for pat, _ in PFM_EXTMETRIC))
+        self.string_names = tuple(name for _, name in PFM_STRINGS)
+        self.string_pointers = dict(PFM_STRINGS)
+        self.names = self.head_names + self.ext_names + self.string_names
+        self.template = {name: pat for pat, name in PFM_HEADER + PFM_EXTMETRIC}
+
+        # header fields get absolute offsets, extmetric fields offsets relative to ExtMetricOffset
+        self.offsets = {}
+        for block in (PFM_HEADER, PFM_EXTMETRIC):
+            offset = 0
+            for pat, name in block:
+                self.offsets[name] = offset
+                offset += PAT_LENGTHS[pat]
+
+
+PFM_LAYOUTS = {tables_order: PfmLayout(tables_order) for tables_order in PFM_TABLES_LAYOUTS}
+
+
+def coerce_pfm_value(name: str, value):
+    """
+    Converts override into the type of PFM field: int for numeric fields (given as int or as string, decimal or 0x
+    hexadecimal), 60 bytes for Copyright; strings are kept and values of unknown fields are returned as they are.
+    A value of other type than the field raises ValueError.
+    """
+    pattern = PFM_LAYOUTS[PFM_TABLES_ORDER].template.get(name)
+    if pattern is None:
+        if (name in dict(PFM_STRINGS).values() or name in PFM_EXTRA_VALUES) and not isinstance(value, str):
+            raise ValueError(f"A2P: Value of {name} must be a string, not {value!r}.")
+        return value
+    if pattern == '60s':
+        if isinstance(value, str):
+            return (value + " " * 60)[:60].encode(STRING_ENCODING)
+        if isinstance(value, bytes):
+            return value
+        raise ValueError(f"A2P: Value of {name} must be a string, not {value!r}.")
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value, 16) if value.lower().startswith("0x") else int(value)
+    except (AttributeError, ValueError):
+        raise ValueError(f"A2P: Value of {name} must be an integer, not {value!r}.") from None
+
+
+class ConvertWarning(typing.NamedTuple):
+    """
+    Problem found during conversion which does not stop it (see PfmWriter.warn), codes are:
+    "missing_header" (details: key, default), "kerns_over_limit" (kerns, limit) and "kerns_reduced" (dropped, max_dropped).
+    """
+    code: str
+    message: str
+    details: dict
+
+
+class PfmWriter:
+    """
+    Simple PFM file writer, converts fonts information given in data structures
+    and writes a binary PFM file (needed to install Type 1 font in Windows).
+    One writer can be reused for many fonts, every call of prepare_data starts from a clean state.
+    Warnings are printed, unless a list is given to collect them (as ConvertWarning) instead.
+    """
+
+    def __init__(
+        self,
+        verbose: bool = False,
+        tables_order: int = PFM_TABLES_ORDER,
+        stats: Stats = NO_STATS,
+        warnings: list | None = None,
+    ):
+        self.verbose = verbose
+        self.layout = PFM_LAYOUTS[tables_order]
+        self.stats = stats
+        self.warnings = warnings
+        self.reset()
+
+    def warn(self, code: str, message: str, **details):
+        """ Reports a problem which does not stop the conversion (see ConvertWarning). """
+        if self.warnings is None:
+            print(message)
+        else:
+            self.warnings.append(ConvertWarning(code, message, details))
+
+    def reset(self, tables_order: int | None = None):
+        """ Forgets all data of previously prepared font, optionally switches the order of tables. """
+        if tables_order is not None:
+            self.layout = PFM_LAYOUTS[tables_order]
+        self.pfm_names = list(self.layout.names)
+        self.pfm_offsets = dict(self.layout.offsets)
+        self.pfm_template = dict(self.layout.template)
+        self.pfm_values = {}
+        self.calculated_size = 0
+
+        self.pfm_head_length = self.layout.head_struct.size
+        self.pfm_ext_offset = 0
+        self.pfm_ext_length = self.layout.ext_struct.size
+        self.pfm_extra_values_start = len(self.layout.names)
+
+        self.pfm_widths_offset = 0
+        self.pfm_widths_length = 0
+        self.pfm_widths = []
+
+        self.pfm_kerns_num = 0
+        self.pfm_kerns_offset = 0
+        self.pfm_kerns_length = 0
+        self.pfm_kerns_dropped = 0
+        self.pfm_kerns = AfmMetrics()
+
+    def set_default_values(self):
+        """ Set some default values, most of them will be overwritten later. """
+        self.pfm_values['Version'] = 256
+        self.pfm_values['Type'] = 129
+        self.pfm_values['Points'] = 10
+        self.pfm_values['VertRes'] = 300
+        self.pfm_values['HorizRes'] = 300
+        self.pfm_values['ExternalLeading'] = 0
+        self.pfm_values['Underline'] = 0
+        self.pfm_values['Stikeout'] = 0
+        self.pfm_values['WidthBytes'] = 0
+        self.pfm_values['BitsPointer'] = 0
+        self.pfm_values['BitsOffset'] = 0
+        self.pfm_values['SizeFields'] = 30
+        self.pfm_values['OriginTable'] = 0
+        self.pfm_values['TrackKernTable'] = 0
+        self.pfm_values['Reserved'] = 0
+        self.pfm_values['Size_ext'] = self.pfm_ext_length
+        self.pfm_values['PointSize'] = 200
+        self.pfm_values['Orientation'] = 0
+        self.pfm_values['MasterHeight'] = 1000
+        self.pfm_values['MinScale'] = 4
+        self.pfm_values['MaxScale'] = 900
+        self.pfm_values['MasterUnits'] = 1000
+        self.pfm_values['KernTracks'] = 0
+        self.pfm_values['DeviceName'] = "PostScript"
+
+    def prepare_data(
+        self,
+        afm_values: dict,
+        afm_widths: list,
+        afm_kerns: list,
+        extra_args: dict,
+        no_kern_limit,
+        *,
+        tables_order: int | None = None,
+    ):
+        """
+        Method that gets external data and sets all values needed for PFM file.
+        The order of tables can be chosen per call, by default the writer's one is kept.
+        """
+        self.prepare_metrics(afm_values, AfmMetrics.from_lists(afm_widths, afm_kerns), extra_args, no_kern_limit,
+                             tables_order=tables_order)
+
+    @timed_phase("prepare_data")
+    def prepare_metrics(
+        self,
+        afm_values: dict,
+        metrics: "AfmMetrics",
+        extra_args: dict,
+        no_kern_limit,
+        *,
+        tables_order: int | None = None,
+    ):
+        """ Same as prepare_data for metrics given as AfmMetrics (kerns are pruned and sorted in place). """
+
+        def rounds(x):
+            return round(float(x))
+
+        def ceiling(x):
+            return int(math.ceil(float(x)))
+
+        def floor(x):
+            return int(math.floor(float(x)))
+
+        for key, value in AFM_HEADERS_DEFAULTS.items():
+            if key not in afm_values:
+                self.warn("missing_header", f"Missing AFM value: {key}, assuming: {value}.", key=key, default=value)
+                afm_values[key] = value
+        if 'Notice' not in afm_values:
+            self.warn("missing_header", "Missing AFM value: Notice, assuming empty one.", key="Notice", default="")
+            afm_values['Notice'] = ""
+        if 'ury' not in afm_values:
+            raise ValueError("A2P: Missing AFM value: FontBBox.")
+
+        self.reset(tables_order)
+        self.set_default_values()
+
+        self.pfm_values['PostscriptName'] = afm_values['FontName']
+        self.pfm_values['Copyright'] = (afm_values['Notice'] + " " * 60)[:60].encode(STRING_ENCODING)
+        self.pfm_values['Ascent'] = ceiling(afm_values['ury'])
+        self.pfm_values['InternalLeading'] = max(0, ceiling(afm_values['ury']) - floor(afm_values['lly']) - 1000)
+        self.pfm_values['Italic'] = 1 if float(afm_values['ItalicAngle']) != 0 else 0
+        name_suffix = re.search(
+            r"[^A-Za-z](Light|Regular| Normal|Medium|Book|Demi|Bold|Black)",
+            afm_values['FontName'])
+        self.pfm_values['Weight'] = (
+            WEIGTHS[name_suffix[1]] if name_suffix and name_suffix[1] in WEIGTHS
+            else WEIGTHS['Regular'])
+        self.pfm_values['CharSet'] = 255
+        self.pfm_values['PixWidth'] = max(0, ceiling(afm_values['urx']) - floor(afm_values['llx']))
+        self.pfm_values['PixHeight'] = 1000 + self.pfm_values['InternalLeading']
+        self.pfm_values['PitchAndFamily'] = 16 * 1 + (0 if afm_values['IsFixedPitch'].lower() == 'true' else 1)
+        self.pfm_values['AvgWidth'] = rounds(afm_values["AVG_WIDTH"]) if afm_values["AVG_WIDTH"] else 500
+        self.pfm_values['MaxWidth'] = rounds(afm_values["MAX_WIDTH"])
+        self.pfm_values['FirstChar'] = 0
+        self.pfm_values['LastChar'] = 255
+        self.pfm_values['DefaultChar'] = (
+            afm_values["DEFAULT_CHAR"] if afm_values["DEFAULT_CHAR"] else ord('?')
+        ) - self.pfm_values['FirstChar']
+        self.pfm_values['BreakChar'] = ord(' ') - self.pfm_values['FirstChar']
+        self.pfm_values['CapHeight'] = rounds(afm_values['CapHeight'])
+        self.pfm_values['XHeight'] = rounds(afm_values['XHeight'])
+        self.pfm_values['LowerCaseAscent'] = rounds(afm_values['Ascender'])
+        self.pfm_values['LowerCaseDescent'] = rounds(-float(afm_values['Descender']))
+        self.pfm_values['Slant'] = rounds(10 * float(afm_values['ItalicAngle']))
+        self.pfm_values['SuperScript'] = - rounds(0.8 * float(self.pfm_values['XHeight']))
+        self.pfm_values['SubScript'] = rounds(0.3 * float(self.pfm_values['XHeight']))
+        self.pfm_values['SuperScriptSize'] = 800
+        self.pfm_values['SubScriptSize'] = 800
+        self.pfm_values['UnderlineOffset'] = rounds(-float(afm_values['UnderlinePosition']))
+        self.pfm_values['UnderlineWidth'] = rounds(afm_values['UnderlineThickness'])
+        self.pfm_values['DoubleUpperUnderlineOffset'] = self.pfm_values['UnderlineOffset']
+        self.pfm_values['DoubleLowerUnderlineOffset'] = rounds(
+            self.pfm_values['DoubleUpperUnderlineOffset']
+            + 3 * self.pfm_values['UnderlineWidth'])
+        self.pfm_values['DoubleUpperUnderlineWidth'] = self.pfm_values['UnderlineWidth']
+        self.pfm_values['DoubleLowerUnderlineWidth'] = self.pfm_values['UnderlineWidth']
+        self.pfm_values['StrikeOutOffset'] = rounds(0.6 * float(self.pfm_values['XHeight']))
+        self.pfm_values['StrikeOutWidth'] = self.pfm_values['UnderlineWidth']
+
+        if 'PFMname' in afm_values:
+            self.pfm_values['WindowsName'] = afm_values['PFMname']
+        else:
+            name_suffixes = re.compile(
+                r"([Oo]bli(que)? |[Ii]t(alic)? |[Kk]ursywa |[Ss]lant(ed)? |Lt |[Ll]ight |[Rr]eg(ular)? |[Nn]or(mal)?"
+                r"|Bk |[Bb]ook |Dm |[Dd]emi |Md |[Mm]edium |Bd |[Bb]old |Blk |[Bb]lack |[\ _\-:])+$", re.VERBOSE
+            )
+            self.pfm_values['WindowsName'] = name_suffixes.sub("", afm_values['FontName'])
+
+        if 'PFMbold' in afm_values:
+            self.pfm_values['Weight'] = rounds(afm_values['PFMbold']) if float(afm_values['PFMbold']) > 10 else (
+                WEIGTHS['Regular'] if float(afm_values['PFMbold']) == 0 else WEIGTHS['Bold']
+            )
+
+        if 'PFMitalic' in afm_values:
+            self.pfm_values['Italic'] = 0 if float(afm_values['PFMitalic']) == 0 else 1
+
+        if 'PFMcharset' in afm_values:
+            self.pfm_values['CharSet'] = int(afm_values['PFMcharset'])
+
+        self.prepare_widths(metrics.afm_widths)
+        self.prepare_kerns(metrics, no_kern_limit, afm_values.get("KERNS_TOTAL"), afm_values.get("KERNS_DROPPED_MAX"))
+
+        for key, value in PFM_EXTRA_VALUES.items():
+            self.put_extra_values(key, value)
+
+        for key, value in extra_args.items():
+            if key in self.pfm_values:
+                self.pfm_values[key] = coerce_pfm_value(key, value)
+            else:
+                raise ValueError(f"Unknown key in command line parameter {key}")
+        if self.verbose:
+            for key, value in self.pfm_values.items():
+                print(f"{key:20s} {value}")
+
+        self.calculate_offsets()
+
+    def prepare_widths(self, afm_widths: list):
+        """ Prepare character width table values and template. """
+        pfm_widths_num = self.pfm_values['LastChar'] - self.pfm_values['FirstChar'] + 1
+        self.pfm_widths_length = pfm_widths_num * 2
+        self.pfm_widths = []
+
+        for i in range(self.pfm_values['FirstChar'], self.pfm_values['LastChar'] + 1):
+            if afm_widths[i] is not None:
+                self.pfm_widths.append(round(afm_widths[i]))
+            else:
+                self.pfm_widths.append(self.pfm_values['AvgWidth'])
+
+    @timed_phase("prepare_kerns")
+    def prepare_kerns(
+        self,
+        afm_kerns: "list | AfmMetrics",
+        no_kern_limit: bool,
+        kerns_total: int | None = None,
+        kerns_dropped_max: float | None = None,
+    ):
+        """
+        Prepare kern table values and template.
+        Kerns already pruned by the reader (see TopKerns) give their original number and the biggest dropped value.
+        """
+        if not isinstance(afm_kerns, AfmMetrics):
+            afm_kerns = AfmMetrics.from_lists(None, afm_kerns)
+        if afm_kerns.kerns_num:
+            kerns_total = kerns_total or afm_kerns.kerns_num
+            if kerns_total >= PFM_KERNS_LIMIT:
+                if no_kern_limit:
+                    self.warn("kerns_over_limit",
+                              f"A2P: The number of kerns is {afm_kerns.kerns_num} (more than allowed {PFM_KERNS_LIMIT}).",
+                              kerns=afm_kerns.kerns_num, limit=PFM_KERNS_LIMIT)
+                else:
+                    deleted_max = afm_kerns.select_kerns(PFM_KERNS_LIMIT)
+                    if deleted_max is not None:
+                        kerns_dropped_max = deleted_max
+                    self.pfm_kerns_dropped = kerns_total - afm_kerns.kerns_num
+                    if self.pfm_kerns_dropped:
+                        self.warn(
+                            "kerns_reduced",
+                            f"A2P: The number of kerns reduced by {self.pfm_kerns_dropped} "
+                            f"(values <={kerns_dropped_max} deleted).",
+                            dropped=self.pfm_kerns_dropped, max_dropped=kerns_dropped_max,
+                        )
+            afm_kerns.sort_kerns()
+            self.pfm_kerns_num = afm_kerns.kerns_num
+            self.pfm_kerns_length = self.pfm_kerns_num * 4 + 2  # +2 for undocumented length of kern table
+            self.pfm_kerns = afm_kerns
+
+        self.pfm_values['KernPairs'] = self.pfm_kerns_num
+        self.stats.count("kern_pairs_dropped", self.pfm_kerns_dropped)
+
+    def put_extra_values(self, name, value):
+        """ Prepare extra string values (outside PFM standard strings). """
+        self.pfm_names.append(name)
+        self.pfm_values[name] = value
+        self.pfm_template[name] = f"{1 + len(value)}s"
+
+    @timed_phase("calculate_offsets")
+    def calculate_offsets(self):
+        """ Recalculates lengths of all PFM data blocks and sets pointers to structures. """
+        offset = self.pfm_head_length
+
+        for table in self.layout.tables:
+            if table == 'ExtMetricOffset':
+                self.pfm_values[table] = offset
+                self.pfm_ext_offset = offset
+                for name in self.layout.ext_names:
+                    self.pfm_offsets[name] = offset + self.layout.offsets[name]
+                offset += self.pfm_ext_length
+            elif table == 'ExtentTable':
+                self.pfm_values[table] = offset
+                self.pfm_widths_offset = offset
+                offset += self.pfm_widths_length
+            elif table == 'PairKernTable':
+                if self.pfm_kerns_num > 0:
+                    self.pfm_values[table] = offset
+                    self.pfm_kerns_offset = offset
+                    offset += self.pfm_kerns_length
+                else:
+                    self.pfm_values[table] = 0
+            elif table == 'Extra':
+                for name in self.pfm_names[self.pfm_extra_values_start:]:
+                    self.pfm_offsets[name] = offset
+                    offset += len(self.pfm_values[name]) + 1
+            else:  # pointer to a standard string
+                name = self.layout.string_pointers[table]
+                self.pfm_values[table] = offset
+                self.pfm_offsets[name] = offset
+                offset += len(self.pfm_values[name]) + 1
+
+        self.calculated_size = offset
+        self.pfm_values['Size'] = self.calculated_size
+
+        for name in self.pfm_names[len(self.layout.head_names) + len(self.layout.ext_names):]:
+            self.pfm_template[name] = f"{1 + len(self.pfm_values[name])}s"
+
+    def pack_string_into(self, name: str, buffer, offset: int = 0):
+        """ Packs a string value as zero terminated bytes into buffer at its precomputed offset. """
+        struct.pack_into(self.pfm_template[name], buffer, offset + self.pfm_offsets[name],
+                         self.pfm_values[name].encode(STRING_ENCODING))
+
+    @timed_phase("serialize_pfm")
+    def serialize_pfm_into(self, buffer, offset: int = 0) -> int:
+        """
+        Serialize PFM data directly into a writable buffer (bytearray, memoryview, mmap...) starting at offset.
+        Every block is packed in place at the offset computed by calculate_offsets, returns the size of PFM.
+        """
+        if len(buffer) - offset < self.calculated_size:
+            raise ValueError(f"A2P: Buffer too small for PFM, {self.calculated_size} bytes needed.")
+
+        content_head = [self.pfm_values[name] for name in self.layout.head_names]
+        self.layout.head_struct.pack_into(buffer, offset, *content_head)
+        if self.verbose:
+            print(
+                f"HEADER ({hex(self.pfm_head_length)}):",
+                " ".join([hex(v) if isinstance(v, int) else str(v) for v in content_head])
+            )
+
+        for table in self.layout.tables:
+            if table == 'ExtMetricOffset':
+                content_ext = [self.pfm_values[name] for name in self.layout.ext_names]
+                self.layout.ext_struct.pack_into(buffer, offset + self.pfm_ext_offset, *content_ext)
+                if self.verbose:
+                    print(
+                        f"HEAD_EXT  ({hex(self.pfm_ext_offset + self.pfm_ext_length)}):",
+                        " ".join([hex(v) if isinstance(v, int) else str(v) for v in content_ext])
+                    )
+            elif table == 'ExtentTable':
+                pfm_table_struct('H', len(self.pfm_widths)).pack_into(
+                    buffer, offset + self.pfm_widths_offset, *self.pfm_widths)
+            elif table == 'PairKernTable':
+                if self.pfm_kerns_num > 0:
+                    struct.pack_into('<H', buffer, offset + self.pfm_kerns_offset, self.pfm_kerns_num)
+                    self.pfm_kerns.pack_kerns_into(buffer, offset + self.pfm_kerns_offset + 2)
+            elif table == 'Extra':
+                for name in self.pfm_names[self.pfm_extra_values_start:]:
+                    self.pack_string_into(name, buffer, offset)
+            else:
+                self.pack_string_into(self.layout.string_pointers[table], buffer, offset)
+
+        return self.calculated_size
+
+    def serialize_pfm(self) -> bytes:
+        """ Serialize PFM data into binary format of PFM file, returned as immutable bytes. """
+        new_pfm = bytearray(self.calculated_size)
+        self.serialize_pfm_into(new_pfm)
+        return bytes(new_pfm)
+
+    def make_pfm(self, output_file: str | typing.BinaryIO, fsync: bool = False) -> bool:
+        """
+        Method for PFM serialization and write it to a file (given by name or as a binary stream).
+        A file is replaced atomically and not touched at all if its content is the same (see write_file_atomic).
+        Returns if anything was written.
+        """
+        pfm_data = self.serialize_pfm()
+        with self.stats.phase("write_pfm"):
+            if hasattr(output_file, "write"):
+                output_file.write(pfm_data)
+                written = True
+            else:
+                written = write_file_atomic(output_file, pfm_data, fsync)
+                print(f"PFM written to: {output_file}" if written else f"PFM unchanged: {output_file}")
+        self.stats.count("files_written" if written else "files_unchanged")
+        if written:
+            self.stats.count("bytes_written", len(pfm_data))
+        return written
+
+    @staticmethod
+    def patchable(overrides: dict) -> bool:
+        """ Checks if overrides change only fixed size fields which are not part of the layout (see patch_pfm). """
+        template = PFM_LAYOUTS[PFM_TABLES_ORDER].template
+        return all(name in template and name not in PFM_LAYOUT_FIELDS for name in overrides)
+
+    @staticmethod
+    def patch_pfm(pfm_filename: str, overrides: dict) -> int:
+        """
+        Rewrites fixed size fields of existing PFM in place (memory mapped) at their known offsets, the rest
+        of the file is not touched. The file is validated first (Version and Size), ValueError is raised
+        if it is not a valid PFM or overrides are not patchable (see patchable, strings need a new PFM).
+        Returns the number of fields changed, nothing is written if the PFM already has the values.
+        """
+        if not PfmWriter.patchable(overrides):
+            raise ValueError("A2P: Only fixed size fields can be patched: "
+                             + ", ".join(sorted(name for name in overrides if not PfmWriter.patchable({name: 0}))))
+        layout = PFM_LAYOUTS[PFM_TABLES_ORDER]  # fixed structures are the same for all orders
+        fields = []
+        for name, value in overrides.items():
+            value = coerce_pfm_value(name, value)
+            try:
+                fields.append((name, struct.pack('<' + layout.template[name], value)))
+            except struct.error as exc:
+                raise ValueError(f"A2P: Improper value of {name}: {value!r} ({exc}).") from None
+        with open(pfm_filename, "r+b") as pfm_file:
+            size = os.fstat(pfm_file.fileno()).st_size
+            if size < layout.head_struct.size:
+                raise ValueError("A2P: Not a PFM file (too short).")
+            with mmap.mmap(pfm_file.fileno(), 0, access=mmap.ACCESS_WRITE) as pfm_data:
+                version, pfm_size = struct.unpack_from("<HI", pfm_data, 0)
+                ext_offset = struct.unpack_from("<I", pfm_data, layout.offsets['ExtMetricOffset'])[0]
+                if version != 256 or pfm_size != size:
+                    raise ValueError(f"A2P: Not a PFM file (version {version:#x}, size {pfm_size} in header, {size} in fact).")
+                if ext_offset < layout.head_struct.size or ext_offset + layout.ext_struct.size > size:
+                    raise ValueError("A2P: Not a PFM file (extmetric out of file).")
+                changed = 0
+                for name, packed in fields:
+                    offset = layout.offsets[name] + (ext_offset if name in layout.ext_names else 0)
+                    if pfm_data[offset:offset + len(packed)] != packed:
+                        pfm_data[offset:offset + len(packed)] = packed
+                        changed += 1
+                if changed:
+                    pfm_data.flush()
+        return changed
+
+
+class PfmReader:
+    """
+    Simple PFM file reader, decodes PFM with the same structure definitions as PfmWriter into data structures:
+    dict with header, extmetric and string values, list of widths and list of kerns.
+    Extra strings (outside PFM standard) have no pointers in the header and are not decoded.
+    """
+
+    @staticmethod
+    def parse_pfm(pfm_data) -> typing.Tuple[dict, list, list]:
+        """ Decodes PFM given as bytes-like object (bytes, mmap...), values are unpacked in place. """
+        layout = PFM_LAYOUTS[PFM_TABLES_ORDER]  # fixed structures are the same for all orders
+        size = len(pfm_data)
+        if size < layout.head_struct.size:
+            raise ValueError("A2P: Not a PFM file (too short).")
+        pfm_values = dict(zip(layout.head_names, layout.head_struct.unpack_from(pfm_data, 0)))
+        if pfm_values['Size'] != size:
+            raise ValueError(f"A2P: Not a PFM file (size {pfm_values['Size']} in header, {size} in fact).")
+        pfm_values.update(zip(layout.ext_names, layout.ext_struct.unpack_from(pfm_data, pfm_values['ExtMetricOffset'])))
+
+        for pointer, name in PFM_STRINGS:
+            offset = pfm_values[pointer]
+            end = pfm_data.find(b"\0", offset)
+            pfm_values[name] = pfm_data[offset:end if end >= 0 else size].decode(STRING_ENCODING)
+
+        pfm_widths = []
+        if pfm_values['ExtentTable']:
+            widths_num = pfm_values['LastChar'] - pfm_values['FirstChar'] + 1
+            pfm_widths = list(pfm_table_struct('H', widths_num).unpack_from(pfm_data, pfm_values['ExtentTable']))
+
+        pfm_kerns = []
+        if pfm_values['PairKernTable']:
+            offset = pfm_values['PairKernTable']
+            kerns_num = struct.unpack_from('<H', pfm_data, offset)[0]
+            flat = pfm_table_struct('BBh', kerns_num).unpack_from(pfm_data, offset + 2)
+            pfm_kerns = list(zip(flat[0::3], flat[1::3], flat[2::3]))
+
+        return pfm_values, pfm_widths, pfm_kerns
+
+    @staticmethod
+    def read_pfm(pfm_filename: str) -> typing.Tuple[dict, list, list]:
+        """ Reads PFM from memory mapped file (see parse_pfm). """
+        with open(pfm_filename, "rb") as pfm_file:
+            if os.fstat(pfm_file.fileno()).st_size == 0:
+                return PfmReader.parse_pfm(b"")
+            with mmap.mmap(pfm_file.fileno(), 0, access=mmap.ACCESS_READ) as pfm_data:
+                return PfmReader.parse_pfm(pfm_data)
+
+    @staticmethod
+    def diff_pfm(expected: typing.Tuple[dict, list, list], found: typing.Tuple[dict, list, list]) -> typing.List[str]:
+        """ Compares two decoded PFMs field by field, returns descriptions of differences. """
+        differences = []
+        expected_values, expected_widths, expected_kerns = expected
+        found_values, found_widths, found_kerns = found
+        for name in dict.fromkeys([*expected_values, *found_values]):
+            if expected_values.get(name) != found_values.get(name):
+                differences.append(f"{name}: expected {expected_values.get(name)!r}, found {found_values.get(name)!r}")
+        if len(expected_widths) != len(found_widths):
+            differences.append(f"widths: expected {len(expected_widths)}, found {len(found_widths)}")
+        for i, (expected_width, found_width) in enumerate(zip(expected_widths, found_widths)):
+            if expected_width != found_width:
+                differences.append(f"width[{i}]: expected {expected_width}, found {found_width}")
+        expected_kerns = {(a, b): kern for a, b, kern in expected_kerns}
+        found_kerns = {(a, b): kern for a, b, kern in found_kerns}
+        for pair in sorted(expected_kerns.keys() | found_kerns.keys()):
+            if expected_kerns.get(pair) != found_kerns.get(pair):
+                differences.append(f"kern{pair}: expected {expected_kerns.get(pair)}, found {found_kerns.get(pair)}")
+        return differences
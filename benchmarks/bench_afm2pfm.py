@@ -0,0 +1,184 @@
+"""
+Benchmarks of AFM2PFM: synthetic AFM generator and timings of parsing, preparing and serializing PFM data,
+and of the end-to-end command line run. Results are written as JSON, so they can be compared between commits:
+
+    python benchmarks/bench_afm2pfm.py -o before.json
+    python benchmarks/bench_afm2pfm.py -o after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import afm2pfm  # noqa: E402  pylint: disable=wrong-import-position
+
+SCENARIOS = {  # name: glyphs, kern pairs, length of Notice, missing headers
+    "tiny": (60, 0, 40, False),
+    "latin": (250, 1000, 60, False),
+    "missing-headers": (250, 1000, 0, True),
+    "long-notice": (250, 1000, 2000, False),
+    "kern-10k": (400, 10_000, 60, False),
+    "kern-100k": (1000, 100_000, 60, False),
+    "kern-250k": (2000, 250_000, 60, False),
+}
+
+
+def make_synthetic_afm(
+    glyphs: int,
+    kerns: int,
+    notice_length: int = 60,
+    missing_headers: bool = False,
+    seed: int = 0,
+) -> bytes:
+    """
+    Generates AFM with given number of glyphs (the first 256 are encoded, the rest is not) and kern pairs.
+    Missing headers leave only FontName and FontBBox (and Notice if notice_length), so AFM_HEADERS_DEFAULTS are used
+    for the rest.
+    """
+    rnd = random.Random(seed)
+    names = ["space", "X", "bullet"] + [f"glyph{i:05d}" for i in range(max(0, glyphs - 3))]
+    lines = ["StartFontMetrics 4.1", "Comment Synthetic AFM for benchmarks"]
+    lines.append("FontName Synthetic-BoldItalic")
+    if not missing_headers:
+        lines += [
+            "FullName Synthetic Bold Italic", "FamilyName Synthetic", "Weight Bold", "ItalicAngle -12",
+            "IsFixedPitch false", "UnderlinePosition -100", "UnderlineThickness 50", "Version 001.000",
+            "EncodingScheme FontSpecific", "CapHeight 700", "XHeight 500", "Ascender 750", "Descender -250",
+        ]
+    if notice_length:
+        lines.append("Notice " + ("Copyright (c) Synthetic Foundry. " * (notice_length // 33 + 1))[:notice_length])
+    lines.append("FontBBox -150 -250 1150 950")
+    lines.append(f"StartCharMetrics {len(names)}")
+    for i, name in enumerate(names):
+        code = 32 + i if 32 + i < 256 else -1
+        lines.append(f"C {code} ; WX {rnd.randint(200, 1000)} ; N {name} ; B 10 -20 {rnd.randint(150, 950)} 700 ;")
+    lines.append("EndCharMetrics")
+    if kerns:
+        lines += ["StartKernData", f"StartKernPairs {kerns}"]
+        for _ in range(kerns):
+            lines.append(f"KPX {rnd.choice(names)} {rnd.choice(names)} {rnd.randint(-200, 120)}")
+        lines += ["EndKernPairs", "EndKernData"]
+    lines += ["EndFontMetrics", ""]
+    return "\n".join(lines).encode(afm2pfm.STRING_ENCODING)
+
+
+def measure(function: typing.Callable, setup: typing.Callable | None = None, repeat: int = 5) -> dict:
+    """ Returns the best wall time of repeated calls and peak of memory allocated by one call. """
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def bench_scenario(name: str, afm_data: bytes, work_dir: str, repeat: int) -> dict:
+    """ Runs all benchmarks of one scenario. """
+    afm_filename = os.path.join(work_dir, f"{name}.afm")
+    pfm_filename = os.path.join(work_dir, f"{name}.pfm")
+    with open(afm_filename, "wb") as afm_file:
+        afm_file.write(afm_data)
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    results = {"afm_bytes": len(afm_data)}
+
+    with quiet:
+        results["read_afm"] = measure(lambda: afm2pfm.AfmReader.read_afm(afm_filename), repeat=repeat)
+        results["read_afm_mmap"] = measure(lambda: afm2pfm.AfmReader.read_afm_mmap(afm_filename), repeat=repeat)
+        results["read_afm_mmap_top512"] = measure(
+            lambda: afm2pfm.AfmReader.read_afm_mmap(afm_filename, afm2pfm.PFM_KERNS_LIMIT), repeat=repeat)
+        results["read_afm_metrics"] = measure(lambda: afm2pfm.AfmReader.read_afm_metrics(afm_filename), repeat=repeat)
+
+        parsed = afm2pfm.AfmReader.parse_afm(afm_data)
+
+        def fresh_copy():
+            afm_values, afm_widths, afm_kerns = parsed
+            return dict(afm_values), list(afm_widths), list(afm_kerns)
+
+        pfm_writer = afm2pfm.PfmWriter()
+        results["prepare_data"] = measure(
+            lambda *data: pfm_writer.prepare_data(*data, {}, False), fresh_copy, repeat=repeat)
+        results["prepare_data_nokernlimit"] = measure(
+            lambda *data: pfm_writer.prepare_data(*data, {}, True), fresh_copy, repeat=repeat)
+        pfm_writer.prepare_data(*fresh_copy(), {}, False)
+        results["serialize_pfm"] = measure(pfm_writer.serialize_pfm, repeat=repeat)
+        results["pfm_bytes"] = pfm_writer.calculated_size
+        results["kerns_dropped"] = pfm_writer.pfm_kerns_dropped
+
+    command = [sys.executable, afm2pfm.__file__, afm_filename, pfm_filename]
+    results["cli"] = measure(
+        lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL), repeat=max(1, repeat // 2))
+    del results["cli"]["peak_bytes"]  # memory of the child process is not traced
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    """ Prints ratios of timings to the baseline ones (>1 means slower than baseline), to stderr to keep JSON apart. """
+    for scenario, phases in results["scenarios"].items():
+        for phase, values in phases.items():
+            old = baseline.get("scenarios", {}).get(scenario, {}).get(phase)
+            if isinstance(values, dict) and isinstance(old, dict) and old.get("seconds"):
+                ratio = values["seconds"] / old["seconds"]
+                flag = "  <-- slower" if ratio > 1.1 else ""
+                print(f"{scenario:16s} {phase:26s} {old['seconds'] * 1000:9.2f} ms -> "
+                      f"{values['seconds'] * 1000:9.2f} ms  x{ratio:.2f}{flag}", file=sys.stderr)
+
+
+def main():
+    """ Runs benchmarks and writes results. """
+    parser = argparse.ArgumentParser(description="Benchmarks of AFM2PFM.")
+    parser.add_argument("-o", "--output", help="Output JSON file (default: stdout)")
+    parser.add_argument("-s", "--scenario", help="Run only given scenarios", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("-r", "--repeat", help="Repetitions of every measurement (default: %(default)s)", type=int,
+                        default=5)
+    parser.add_argument("--compare", help="Baseline JSON file to compare with")
+    args = parser.parse_args()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    results = {
+        "version": afm2pfm.VERSION,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.scenario or SCENARIOS:
+            glyphs, kerns, notice_length, missing_headers = SCENARIOS[name]
+            afm_data = make_synthetic_afm(glyphs, kerns, notice_length, missing_headers)
+            results["scenarios"][name] = bench_scenario(name, afm_data, work_dir, args.repeat)
+            print(f"{name}: done", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out_file:
+            json.dump(results, out_file, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Fixtures of AFM2PFM tests. PFMs in data were made by the original single-file afm2pfm.py (ver. 0.30) from AFMs
+next to them (small_overrides.pfm with WindowsName:Overridden, kerns_nokernlimit.pfm with --nokernlimit),
+so conversions are checked to stay byte-identical to it.
+"""
+
+import os
+import shutil
+
+import pytest
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+AFM_NAMES = ("plain", "small", "kerns", "headers")
+
+
+@pytest.fixture
+def data_path():
+    """ Returns path of a file in the data directory. """
+    return lambda name: os.path.join(DATA_DIR, name)
+
+
+@pytest.fixture
+def read_data():
+    """ Returns contents of a file in the data directory. """
+
+    def read(name: str) -> bytes:
+        with open(os.path.join(DATA_DIR, name), "rb") as data_file:
+            return data_file.read()
+
+    return read
+
+
+@pytest.fixture
+def afm_tree(tmp_path):
+    """ Returns a directory with all AFMs of data, kerns.afm in a subdirectory. """
+    tree = tmp_path / "afm"
+    (tree / "sub").mkdir(parents=True)
+    for name in AFM_NAMES:
+        shutil.copy(os.path.join(DATA_DIR, name + ".afm"), tree / ("sub" if name == "kerns" else "") / (name + ".afm"))
+    return tree
+
+
+@pytest.fixture
+def afm_text(read_data):
+    """ Returns text of small.afm with first occurrences of strings replaced ((old, new) pairs), e.g. to break it. """
+
+    def text(*replacements: tuple) -> str:
+        afm = read_data("small.afm").decode("latin-1")
+        for old, new in replacements:
+            assert old in afm
+            afm = afm.replace(old, new, 1)
+        return afm
+
+    return text
@@ -0,0 +1,132 @@
+""" Tests of AFM parsers (a2p.afm). """
+
+import hashlib
+import random
+
+import pytest
+
+import a2p.afm
+from a2p.afm import AfmMetrics, AfmReader, LazyAfm, MetricsCache, TopKerns
+from a2p.common import PFM_KERNS_LIMIT
+
+
+@pytest.mark.parametrize("afm_name", ["plain.afm", "small.afm", "kerns.afm", "headers.afm"])
+@pytest.mark.parametrize("kern_limit", [None, PFM_KERNS_LIMIT])
+def test_parsers_agree(data_path, read_data, afm_name, kern_limit):
+    expected = AfmReader.read_afm(data_path(afm_name), kern_limit)
+    assert AfmReader.parse_afm(read_data(afm_name), kern_limit) == expected
+    assert AfmReader.read_afm_mmap(data_path(afm_name), kern_limit) == expected
+    afm_values, metrics = AfmReader.read_afm_metrics(data_path(afm_name), kern_limit)
+    assert (afm_values, metrics.afm_widths, metrics.afm_kerns) == expected
+
+
+def test_parallel_kern_parsing(monkeypatch, data_path):
+    monkeypatch.setattr(a2p.afm, "KERNS_PARALLEL_THRESHOLD", 0)
+    monkeypatch.setattr(a2p.afm, "KERNS_CHUNK_SIZE", 4096)
+    for kern_limit in (None, PFM_KERNS_LIMIT):
+        afm_values, metrics = AfmReader.read_afm_metrics(data_path("kerns.afm"), kern_limit, kern_workers=2)
+        assert (afm_values, metrics.afm_widths, metrics.afm_kerns) == AfmReader.read_afm(data_path("kerns.afm"), kern_limit)
+
+
+def test_top_kerns_is_stable_sort():
+    generator = random.Random(5)
+    kerns = [(generator.randrange(256), generator.randrange(256), float(generator.randint(-20, 20))) for _ in range(3000)]
+    expected = sorted(range(len(kerns)), key=lambda i: -abs(kerns[i][2]))[:100]
+    for extend in ("extend", "extend_columns"):
+        top_kerns = TopKerns(100)
+        for start in range(0, len(kerns), 700):
+            chunk = kerns[start:start + 700]
+            if extend == "extend":
+                top_kerns.extend(chunk)
+            else:
+                top_kerns.extend_columns(*zip(*chunk))
+        assert top_kerns.kerns() == [kerns[i] for i in sorted(expected)]
+        assert top_kerns.total == len(kerns)
+
+
+def test_top_kerns_merge():
+    kerns = [(i % 256, i // 256, float(i % 37 - 18)) for i in range(2000)]
+    single = TopKerns(50)
+    single.extend(kerns)
+    merged = TopKerns(50)
+    for start in range(0, len(kerns), 300):
+        chunk = TopKerns(50)
+        chunk.extend(kerns[start:start + 300])
+        merged.merge(chunk)
+    assert merged.kerns() == single.kerns()
+    assert (merged.total, merged.dropped_max) == (single.total, single.dropped_max)
+
+
+def test_metrics_round_trip(data_path):
+    afm_values, metrics = AfmReader.read_afm_metrics(data_path("kerns.afm"), PFM_KERNS_LIMIT)
+    digest = hashlib.sha256(b"AFM").digest()
+    data = metrics.to_bytes(afm_values, digest, PFM_KERNS_LIMIT)
+    loaded_values, loaded = AfmMetrics.from_bytes(data, digest, PFM_KERNS_LIMIT)
+    assert loaded_values == afm_values
+    assert (loaded.afm_widths, loaded.afm_kerns) == (metrics.afm_widths, metrics.afm_kerns)
+    with pytest.raises(ValueError):
+        AfmMetrics.from_bytes(data, hashlib.sha256(b"other AFM").digest(), PFM_KERNS_LIMIT)
+
+
+@pytest.mark.parametrize("directory", [True, False])
+def test_metrics_cache(tmp_path, afm_tree, directory):
+    cache = MetricsCache(str(tmp_path / "cache") if directory else None)
+    afm_filename = str(afm_tree / "sub" / "kerns.afm")
+    expected = AfmReader.read_afm_metrics(afm_filename, PFM_KERNS_LIMIT)
+    for _ in range(2):
+        afm_values, metrics = cache.read_afm(afm_filename, PFM_KERNS_LIMIT)
+        assert (afm_values, metrics.afm_widths, metrics.afm_kerns) == (expected[0], expected[1].afm_widths,
+                                                                       expected[1].afm_kerns)
+    assert (cache.hits, cache.misses) == (1, 1)
+    with open(afm_filename, "a", encoding="latin-1") as afm_file:
+        afm_file.write("Comment changed\n")
+    cache.read_afm(afm_filename, PFM_KERNS_LIMIT)
+    assert cache.misses == 2
+
+
+def test_lazy_afm_index(tmp_path, afm_tree):
+    afm_filename = str(afm_tree / "small.afm")
+    with LazyAfm.open(afm_filename, index_dir=str(tmp_path / "index")) as afm:
+        values = afm.values
+        afm.save_index()
+        sections = afm.index()
+    with LazyAfm.open(afm_filename, use_index=True, index_dir=str(tmp_path / "index")) as afm:
+        assert afm.sections == sections
+        assert afm.values == values
+    assert not (afm_tree / "small.afm.a2pidx").exists()
+    with open(afm_filename, "a", encoding="latin-1") as afm_file:
+        afm_file.write("Comment changed\n")
+    with LazyAfm.open(afm_filename, use_index=True, index_dir=str(tmp_path / "index")) as afm:
+        assert not afm.sections
+
+
+def test_read_afm_header(data_path):
+    values = AfmReader.read_afm_header(data_path("small.afm"))
+    assert values["FontName"] == "TestSans-BoldItalic"
+    assert values["ury"] == 900.0
+
+
+def test_not_an_afm(tmp_path):
+    (tmp_path / "bad.afm").write_text("garbage\n")
+    with pytest.raises(RuntimeError):
+        AfmReader.read_afm(str(tmp_path / "bad.afm"))
+    with pytest.raises(RuntimeError):
+        AfmReader.parse_afm(b"garbage\n")
+
+
+def test_blank_header_lines(tmp_path, read_data, afm_text):
+    (tmp_path / "blank.afm").write_text(afm_text(("Weight Bold\n", "Weight Bold\n  \t\n\n")), encoding="latin-1")
+    afm_filename = str(tmp_path / "blank.afm")
+    expected = AfmReader.read_afm(afm_filename)
+    assert expected == AfmReader.parse_afm(read_data("small.afm"))
+    assert AfmReader.parse_afm((tmp_path / "blank.afm").read_bytes()) == expected
+    assert AfmReader.read_afm_mmap(afm_filename) == expected
+    assert AfmReader.read_afm_header(afm_filename)["Weight"] == "Bold"
+
+
+@pytest.mark.parametrize("old, new", [("FontBBox -100 -250 1100 900", "FontBBox -100 -250"), ("Weight Bold", "Weight")])
+def test_malformed_header_line(tmp_path, afm_text, old, new):
+    (tmp_path / "bad.afm").write_text(afm_text((old, new)), encoding="latin-1")
+    for read in (AfmReader.read_afm, AfmReader.read_afm_mmap, AfmReader.read_afm_header):
+        with pytest.raises(ValueError, match=f"line {1 + afm_text().split(chr(10)).index(old)}: {new}"):
+            read(str(tmp_path / "bad.afm"))
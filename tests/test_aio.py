@@ -0,0 +1,53 @@
+""" Tests of asyncio API (a2p.aio). """
+
+import asyncio
+
+from a2p.aio import convert_many
+from a2p.convert import ConvertOptions
+
+
+async def collect(jobs, options=ConvertOptions(), **kwargs) -> list:
+    """ Returns all results of convert_many. """
+    return [result async for result in convert_many(jobs, options, **kwargs)]
+
+
+def test_convert_many(tmp_path, afm_tree, read_data):
+    jobs = [{"input": str(afm_tree / "small.afm"), "output": str(tmp_path / "small.pfm"), "id": "a"},
+            {"input": afm_tree / "sub" / "kerns.afm", "output": str(tmp_path / "kerns.pfm"), "nokernlimit": True},
+            str(afm_tree / "plain.afm"),
+            str(tmp_path / "missing.afm"),
+            {"output": "x.pfm"},
+            {"input": str(afm_tree / "small.afm"), "order": 9}]
+    results = {result["id"]: result for result in asyncio.run(collect(jobs, concurrency=2))}
+    assert [results[job_id]["status"] for job_id in ("a", 2, 3, 4, 5, 6)] == ["ok", "ok", "ok", "error", "error", "error"]
+    assert (tmp_path / "small.pfm").read_bytes() == read_data("small.pfm")
+    assert (tmp_path / "kerns.pfm").read_bytes() == read_data("kerns_nokernlimit.pfm")
+    assert (afm_tree / "plain.pfm").read_bytes() == read_data("plain.pfm")
+
+
+def test_convert_many_async_source(afm_tree):
+    pulled = 0
+
+    async def jobs():
+        nonlocal pulled
+        for _ in range(50):
+            pulled += 1
+            yield str(afm_tree / "small.afm")
+
+    async def take(count: int) -> int:
+        results = convert_many(jobs(), concurrency=2)
+        taken = 0
+        async for _ in results:
+            taken += 1
+            if taken == count:
+                break
+        await results.aclose()
+        return taken
+
+    assert asyncio.run(take(3)) == 3
+    assert pulled < 10
+
+
+def test_convert_many_timeout(afm_tree):
+    results = asyncio.run(collect([str(afm_tree / "sub" / "kerns.afm")], concurrency=1, timeout=1e-6))
+    assert results[0]["status"] == "error" and results[0]["error"].startswith("TimeoutError")
@@ -0,0 +1,68 @@
+""" Tests of archive mode (a2p.archive). """
+
+import tarfile
+import zipfile
+
+import pytest
+
+from a2p.archive import archive_main, ArchiveWriter, iter_archive_afms
+
+
+def write_archive(filename, members: dict):
+    """ Writes archive of given members (name: data). """
+    with ArchiveWriter(str(filename)) as archive:
+        for name, data in members.items():
+            archive.add(name, data, 1700000000)
+
+
+def read_archive(filename) -> dict:
+    """ Returns members (name: data) of zip or tar archive. """
+    if zipfile.is_zipfile(filename):
+        with zipfile.ZipFile(filename) as archive:
+            return {name: archive.read(name) for name in archive.namelist()}
+    with tarfile.open(filename) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive}
+
+
+@pytest.mark.parametrize("input_name, output_name", [("in.zip", "out.tar.gz"), ("in.tar.xz", "out.zip"), ("in.tar", "out.tgz")])
+def test_archive_matches_original(tmp_path, read_data, capsys, input_name, output_name):
+    write_archive(tmp_path / input_name, {"fonts/small.afm": read_data("small.afm"), "kerns.AFM": read_data("kerns.afm"),
+                                          "readme.txt": b"text", "bad.afm": b"junk\n"})
+    assert [name for name, _, _ in iter_archive_afms(str(tmp_path / input_name))] == ["fonts/small.afm", "kerns.AFM", "bad.afm"]
+    assert archive_main([str(tmp_path / input_name), "-o", str(tmp_path / output_name), "-j", "1"]) == 1
+    assert read_archive(tmp_path / output_name) == {"fonts/small.pfm": read_data("small.pfm"), "kerns.pfm": read_data("kerns.pfm")}
+    assert "2 of 3 members converted, 1 failed" in capsys.readouterr().out
+
+
+def test_archive_writer_rejects_unknown_type(tmp_path):
+    with pytest.raises(ValueError):
+        ArchiveWriter(str(tmp_path / "out.rar"))
+
+
+@pytest.mark.parametrize("input_name", ["missing.zip", "small.afm", "directory"])
+def test_bad_input_archive(tmp_path, read_data, capsys, input_name):
+    (tmp_path / "small.afm").write_bytes(read_data("small.afm"))
+    (tmp_path / "directory").mkdir()
+    with pytest.raises(SystemExit) as exit_info:
+        archive_main([str(tmp_path / input_name), "-o", str(tmp_path / "out.zip"), "-j", "1"])
+    assert exit_info.value.code == 2
+    assert input_name in capsys.readouterr().err
+    assert not (tmp_path / "out.zip").exists()
+
+
+def test_corrupt_input_archive(tmp_path, read_data, capsys):
+    write_archive(tmp_path / "in.tar", {f"font{i}.afm": read_data("kerns.afm") for i in range(3)})
+    data = (tmp_path / "in.tar").read_bytes()
+    (tmp_path / "in.tar").write_bytes(data[:len(data) // 2])
+    with pytest.raises(SystemExit):
+        archive_main([str(tmp_path / "in.tar"), "-o", str(tmp_path / "out.zip"), "-j", "1"])
+    assert "Corrupt archive" in capsys.readouterr().err
+    assert not (tmp_path / "out.zip").exists()
+
+
+def test_unknown_output_type_keeps_file(tmp_path, read_data):
+    write_archive(tmp_path / "in.zip", {"small.afm": read_data("small.afm")})
+    (tmp_path / "out.rar").write_bytes(b"keep")
+    with pytest.raises(SystemExit):
+        archive_main([str(tmp_path / "in.zip"), "-o", str(tmp_path / "out.rar"), "-j", "1"])
+    assert (tmp_path / "out.rar").read_bytes() == b"keep"
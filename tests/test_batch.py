@@ -0,0 +1,198 @@
+""" Tests of batch modes (a2p.batch): batch, incremental, shards and reports, check, verify, patch, info and watch. """
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import afm2pfm
+from a2p.batch import (
+    AfmWatcher, batch_main, info_main, merge_reports, merge_reports_main, parse_shard, run_batch, run_watch, shard_files,
+    verify_main,
+)
+from a2p.convert import ConvertOptions, find_afm_files
+from a2p.pfm import PfmReader
+
+TREE_PFMS = {"headers.pfm": "headers.pfm", "plain.pfm": "plain.pfm", "small.pfm": "small.pfm", "sub/kerns.pfm": "kerns.pfm"}
+
+
+def output_files(directory) -> dict:
+    """ Returns contents of PFM files in directory by relative path. """
+    return {path.relative_to(directory).as_posix(): path.read_bytes() for path in directory.rglob("*.pfm")}
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_batch_matches_original(tmp_path, afm_tree, read_data, capsys, jobs):
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", jobs]) == 0
+    assert output_files(tmp_path / "out") == {name: read_data(pfm_name) for name, pfm_name in TREE_PFMS.items()}
+    assert "4 of 4 files converted, 0 failed" in capsys.readouterr().out
+
+
+def test_batch_failures(tmp_path, afm_tree, capsys):
+    (afm_tree / "bad.afm").write_text("garbage\n")
+    report = {}
+    assert run_batch([str(afm_tree)], str(tmp_path / "out"), ConvertOptions(), workers=1, report=report) == 1
+    assert report["failed"] == 1 and report["converted"] == 4
+    assert report["failures"][0]["input"].endswith("bad.afm")
+    assert "bad.afm: RuntimeError" in capsys.readouterr().out
+
+
+def test_batch_cache(tmp_path, afm_tree, read_data, capsys):
+    for _ in range(2):
+        assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--cache-dir", str(tmp_path / "cache")]) == 0
+    assert "PFM cache hits: 4, misses: 0." in capsys.readouterr().out
+    assert output_files(tmp_path / "out")["sub/kerns.pfm"] == read_data("kerns.pfm")
+
+
+def test_incremental(tmp_path, afm_tree, capsys):
+    arguments = [str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--incremental"]
+    assert batch_main(arguments) == 0
+    assert batch_main(arguments) == 0
+    assert "4 files up to date (skipped), 0 rebuilt, 0 removed." in capsys.readouterr().out
+    with open(afm_tree / "small.afm", "a", encoding="latin-1") as afm_file:
+        afm_file.write("Comment changed\n")
+    os.remove(afm_tree / "plain.afm")
+    assert batch_main(arguments) == 0
+    output = capsys.readouterr().out
+    assert "2 files up to date (skipped), 1 rebuilt, 1 removed." in output
+    assert "plain.afm removed, stale PFM" in output
+    assert (tmp_path / "out" / "plain.pfm").exists()
+    assert batch_main(arguments + ["--prune"]) == 0
+    assert not (tmp_path / "out" / "plain.pfm").exists()
+    assert batch_main(arguments + ["--set", "Weight:600"]) == 0
+    assert "0 files up to date (skipped), 3 rebuilt" in capsys.readouterr().out
+
+
+def test_shards_cover_all_files(tmp_path, afm_tree, read_data):
+    files = find_afm_files([str(afm_tree)])
+    shards = [shard_files(files, (i, 3)) for i in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == sorted(files)
+    assert shard_files(files, (2, 3)) == shards[1]
+    for i in (1, 2, 3):
+        assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--shard", f"{i}/3",
+                           "--report", str(tmp_path / f"report{i}.json")]) == 0
+    assert output_files(tmp_path / "out") == {name: read_data(pfm_name) for name, pfm_name in TREE_PFMS.items()}
+    reports = [json.loads((tmp_path / f"report{i}.json").read_text()) for i in (1, 2, 3)]
+    merged = merge_reports(reports)
+    assert (merged["files"], merged["converted"], merged["shards"], merged["missing_shards"]) == (4, 4, 3, [])
+    assert merge_reports(reports[:2])["missing_shards"] == [3]
+    assert merge_reports_main([str(tmp_path / "report1.json"), str(tmp_path / "report2.json")]) == 1
+    assert merge_reports_main([str(tmp_path / f"report{i}.json") for i in (1, 2, 3)]) == 0
+
+
+@pytest.mark.parametrize("text", ["0/3", "4/3", "1", "a/b"])
+def test_parse_shard_rejects(text):
+    with pytest.raises(ValueError):
+        parse_shard(text)
+
+
+def test_check(afm_tree, capsys):
+    (afm_tree / "bad.afm").write_text("garbage\n")
+    assert batch_main([str(afm_tree), "--check", "-j", "1"]) == 1
+    output = capsys.readouterr().out
+    assert "5 AFM files checked" in output
+    assert "missing_header" in output and "kerns_over_limit" in output and "unreadable" in output
+
+
+def test_check_character_code_over_255(tmp_path, afm_tree, afm_text, capsys):
+    (afm_tree / "code300.afm").write_text(afm_text(("C 34 ;", "C 300 ;")), encoding="latin-1")
+    assert batch_main([str(afm_tree), "--check", "-j", "1", "--json-output", str(tmp_path / "check.json")]) == 1
+    results = {result["input"]: result for result in map(json.loads, (tmp_path / "check.json").read_text().splitlines())}
+    assert len(results) == 5
+    result = results[str(afm_tree / "code300.afm")]
+    assert result["status"] == "error"
+    assert "malformed_char_metrics" in [diagnostic["code"] for diagnostic in result["diagnostics"]]
+    assert "5 AFM files checked" in capsys.readouterr().out
+    assert run_batch([str(afm_tree)], str(tmp_path / "out"), ConvertOptions(), workers=1) == 1
+
+
+def test_check_json_on_stdout(afm_tree, capsys):
+    assert afm2pfm.main(["batch", "--json", str(afm_tree / "small.afm"), "--check", str(afm_tree / "plain.afm"), "-j", "1"]) == 0
+    captured = capsys.readouterr()
+    assert sorted(json.loads(line)["input"] for line in captured.out.splitlines()) == [str(afm_tree / "plain.afm"),
+                                                                                       str(afm_tree / "small.afm")]
+    assert "This is afm2pfm" in captured.err and "2 AFM files checked" in captured.err
+
+
+def test_verify(tmp_path, afm_tree, capsys):
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1"]) == 0
+    assert verify_main([str(afm_tree), "-p", str(tmp_path / "out"), "-j", "1"]) == 0
+    assert "4 identical, 0 different, 0 failed" in capsys.readouterr().out
+    (tmp_path / "out" / "small.pfm").write_bytes((tmp_path / "out" / "plain.pfm").read_bytes())
+    os.remove(tmp_path / "out" / "headers.pfm")
+    assert verify_main([str(afm_tree), "-p", str(tmp_path / "out"), "-j", "1"]) == 1
+    assert "2 identical, 1 different, 1 failed" in capsys.readouterr().out
+
+
+def test_patch(tmp_path, afm_tree, capsys):
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1"]) == 0
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--patch", "--set", "Weight:600"]) == 0
+    assert "4 PFMs patched in place" in capsys.readouterr().out
+    assert verify_main([str(afm_tree), "-p", str(tmp_path / "out"), "-j", "1", "--set", "Weight:600"]) == 0
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--patch", "--set", "WindowsName:Name"]) == 0
+    assert "0 PFMs patched in place (0 fields changed), 4 made again" in capsys.readouterr().out
+    assert PfmReader.read_pfm(str(tmp_path / "out" / "small.pfm"))[0]["WindowsName"] == "Name"
+
+
+def test_patch_keeps_manifest_true(tmp_path, afm_tree, capsys):
+    arguments = [str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1"]
+    assert batch_main(arguments + ["--incremental", "--set", "Weight:600"]) == 0
+    assert batch_main(arguments + ["--patch", "--set", "Weight:700"]) == 0
+    assert batch_main(arguments + ["--incremental", "--set", "Weight:600"]) == 0
+    assert "0 files up to date (skipped), 4 rebuilt" in capsys.readouterr().out
+    assert verify_main([str(afm_tree), "-p", str(tmp_path / "out"), "-j", "1", "--set", "Weight:600"]) == 0
+    assert batch_main(arguments + ["--patch", "--set", "WindowsName:Name"]) == 0
+    assert batch_main(arguments + ["--incremental", "--set", "WindowsName:Name"]) == 0
+    assert "4 files up to date (skipped), 0 rebuilt" in capsys.readouterr().out
+    assert verify_main([str(afm_tree), "-p", str(tmp_path / "out"), "-j", "1", "--set", "WindowsName:Name"]) == 0
+
+
+def test_patch_without_manifest(tmp_path, afm_tree):
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1"]) == 0
+    assert batch_main([str(afm_tree), "-o", str(tmp_path / "out"), "-j", "1", "--patch", "--set", "WindowsName:Name"]) == 0
+    assert not list((tmp_path / "out").glob(".*manifest*"))
+
+
+def test_info(tmp_path, afm_tree, capsys):
+    assert info_main([str(afm_tree / "small.afm"), "-f", "FontName", "--index", str(tmp_path / "index")]) == 0
+    assert json.loads(capsys.readouterr().out) == {"input": str(afm_tree / "small.afm"), "FontName": "TestSans-BoldItalic"}
+    assert list((tmp_path / "index").rglob("*.a2pidx"))
+
+
+def test_watcher(afm_tree):
+    watcher = AfmWatcher([str(afm_tree)], debounce=0)
+    assert watcher.poll() == ([], [])
+    time.sleep(0.01)
+    with open(afm_tree / "small.afm", "a", encoding="latin-1") as afm_file:
+        afm_file.write("Comment changed\n")
+    os.remove(afm_tree / "plain.afm")
+    changes, removed = watcher.poll()
+    assert [(afm_filename, pfm_name) for afm_filename, pfm_name, _ in changes] == [(str(afm_tree / "small.afm"), "small.pfm")]
+    assert removed == [(str(afm_tree / "plain.afm"), "plain.pfm")]
+    assert watcher.poll() == ([], [])
+
+
+def test_watch(tmp_path, afm_tree, read_data, capsys):
+    stop = threading.Event()
+    failed = []
+    thread = threading.Thread(target=lambda: failed.append(run_watch(
+        [str(afm_tree)], str(tmp_path / "out"), ConvertOptions(), workers=1, prune=True, interval=0.02, debounce=0.05,
+        stop=stop)))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while "Watching" not in capsys.readouterr().out and time.monotonic() < deadline:
+            time.sleep(0.02)
+        (afm_tree / "new.afm").write_bytes(read_data("kerns.afm"))
+        os.remove(afm_tree / "plain.afm")
+        while (not (tmp_path / "out" / "new.pfm").exists() or (tmp_path / "out" / "plain.pfm").exists()) \
+                and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        thread.join()
+    assert failed == [0]
+    assert (tmp_path / "out" / "new.pfm").read_bytes() == read_data("kerns.pfm")
+    assert not (tmp_path / "out" / "plain.pfm").exists()
@@ -0,0 +1,197 @@
+""" Tests of conversion API (a2p.convert) and of the single-file command line. """
+
+import io
+import json
+import pathlib
+import shutil
+
+import pytest
+
+import afm2pfm
+from a2p.common import Stats
+from a2p.convert import (
+    BuildManifest, convert, convert_afm_cached, convert_file, ConvertOptions, find_afm_files, PfmCache, request_options,
+    split_output_conflicts,
+)
+from a2p.pfm import ConvertWarning, PfmReader
+
+GOLDEN = [  # AFM, PFM made by the original afm2pfm.py, keyword arguments of convert
+    ("plain.afm", "plain.pfm", {}),
+    ("small.afm", "small.pfm", {}),
+    ("kerns.afm", "kerns.pfm", {}),
+    ("headers.afm", "headers.pfm", {}),
+    ("kerns.afm", "kerns_nokernlimit.pfm", {"no_kern_limit": True}),
+    ("small.afm", "small_overrides.pfm", {"extra_args": {"WindowsName": "Overridden"}}),
+]
+
+
+@pytest.mark.parametrize("afm_name, pfm_name, kwargs", GOLDEN)
+def test_convert_matches_original(read_data, afm_name, pfm_name, kwargs):
+    assert convert(read_data(afm_name), **kwargs) == read_data(pfm_name)
+
+
+@pytest.mark.parametrize("afm_name, pfm_name, kwargs", GOLDEN)
+def test_convert_file_matches_original(tmp_path, data_path, read_data, afm_name, pfm_name, kwargs):
+    options = ConvertOptions(kwargs.get("extra_args"), kwargs.get("no_kern_limit", False))
+    pfm_filename = str(tmp_path / "out.pfm")
+    assert convert_file(data_path(afm_name), pfm_filename, options, warnings=[]) == len(read_data(pfm_name))
+    assert pathlib.Path(pfm_filename).read_bytes() == read_data(pfm_name)
+
+
+@pytest.mark.parametrize("afm_name, arguments, pfm_name", [
+    ("small.afm", [], "small.pfm"),
+    ("kerns.afm", ["--nokernlimit"], "kerns_nokernlimit.pfm"),
+    ("small.afm", ["WindowsName:Overridden"], "small_overrides.pfm"),
+    ("small.afm", ["--order", "1", "WindowsName:Overridden"], "small_overrides.pfm"),
+])
+def test_command_line_matches_original(tmp_path, data_path, read_data, capsys, afm_name, arguments, pfm_name):
+    pfm_filename = str(tmp_path / "out.pfm")
+    assert afm2pfm.main([data_path(afm_name), pfm_filename, *arguments]) == 0
+    assert pathlib.Path(pfm_filename).read_bytes() == read_data(pfm_name)
+    assert "This is afm2pfm" in capsys.readouterr().out
+
+
+def test_command_line_metrics_cache(tmp_path, data_path, read_data, capsys):
+    for _ in range(2):
+        afm2pfm.main([data_path("kerns.afm"), str(tmp_path / "out.pfm"), "--metrics-cache", str(tmp_path / "cache"),
+                      "--stats", str(tmp_path / "stats.json")])
+        assert (tmp_path / "out.pfm").read_bytes() == read_data("kerns.pfm")
+    counts = json.loads((tmp_path / "stats.json").read_text())["counts"]
+    assert counts["metrics_cache_hits"] == 1
+    capsys.readouterr()
+
+
+def test_command_line_stats_on_stdout(tmp_path, data_path, capsys):
+    assert afm2pfm.main([data_path("small.afm"), str(tmp_path / "out.pfm"), "--stats", "-"]) == 0
+    captured = capsys.readouterr()
+    assert "This is afm2pfm" in captured.err
+    assert json.loads(captured.out)["counts"]["bytes_written"] == (tmp_path / "out.pfm").stat().st_size
+
+
+def test_convert_inputs(tmp_path, data_path, read_data):
+    afm_data = read_data("small.afm")
+    expected = read_data("small.pfm")
+    assert convert(afm_data.decode("latin-1")) == expected
+    assert convert(pathlib.Path(data_path("small.afm"))) == expected
+    assert convert(io.BytesIO(afm_data)) == expected
+    assert convert(io.StringIO(afm_data.decode("latin-1"))) == expected
+    assert convert(memoryview(afm_data)) == expected
+
+
+def test_convert_tables_order(read_data):
+    order_0 = convert(read_data("kerns.afm"), tables_order=0)
+    order_1 = convert(read_data("kerns.afm"), tables_order=1)
+    assert order_0 != order_1
+    values_0, *tables_0 = PfmReader.parse_pfm(order_0)
+    values_1, *tables_1 = PfmReader.parse_pfm(order_1)
+    assert tables_0 == tables_1
+    assert values_0["ExtMetricOffset"] != values_1["ExtMetricOffset"]
+    assert values_0["WindowsName"] == values_1["WindowsName"]
+
+
+def test_convert_warnings(read_data, capsys):
+    warnings = []
+    convert(read_data("headers.afm"), warnings=warnings)
+    assert ConvertWarning("missing_header", "Missing AFM value: Weight, assuming: 400.",
+                          {"key": "Weight", "default": 400}) in warnings
+    assert not capsys.readouterr().out
+
+
+def test_convert_kern_limit(read_data):
+    stats = Stats()
+    pfm_values, _, pfm_kerns = PfmReader.parse_pfm(convert(read_data("kerns.afm"), stats=stats))
+    assert len(pfm_kerns) == 512
+    assert stats.counts["kern_pairs_dropped"] > 0
+    dropped = min(abs(kern) for _, _, kern in pfm_kerns)
+    _, _, all_kerns = PfmReader.parse_pfm(convert(read_data("kerns.afm"), no_kern_limit=True))
+    assert len(all_kerns) > 512
+    assert all(abs(kern) <= dropped for _, _, kern in set(all_kerns) - set(pfm_kerns))
+    assert pfm_values["PairKernTable"]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"tables_order": 5},
+    {"extra_args": {"Foo": 1}},
+    {"extra_args": {"WindowsName": 5}},
+    {"extra_args": {"Copyright": 5}},
+    {"extra_args": {"Weight": 1.5}},
+    {"extra_args": {"Weight": 1 << 20}},
+    {"encoding": "nosuch"},
+    {"encoding": "missing.enc"},
+])
+def test_convert_bad_options(read_data, kwargs):
+    with pytest.raises(ValueError):
+        convert(read_data("small.afm"), **kwargs)
+
+
+def test_convert_missing_encoding_chains_cause(tmp_path, read_data):
+    with pytest.raises(ValueError) as exc_info:
+        convert(read_data("small.afm"), encoding=str(tmp_path / "missing.enc"))
+    assert isinstance(exc_info.value.__cause__, FileNotFoundError)
+
+
+@pytest.mark.parametrize("afm_data", [b"", b"junk\n", b"StartFontMetrics 2.0\nEndFontMetrics\n"])
+def test_convert_bad_afm(afm_data):
+    with pytest.raises(ValueError):
+        convert(afm_data)
+
+
+def test_pfm_cache(tmp_path, read_data):
+    options = ConvertOptions(cache_dir=str(tmp_path))
+    cache = PfmCache.shared(options.cache_dir, options.cache_size)
+    for _ in range(2):
+        assert convert_afm_cached(read_data("small.afm"), options) == read_data("small.pfm")
+    assert (cache.hits, cache.misses) == (1, 1)
+    other = options._replace(extra_args={"WindowsName": "Overridden"})
+    assert cache.make_key(read_data("small.afm"), options) != cache.make_key(read_data("small.afm"), other)
+
+
+def test_pfm_cache_eviction(tmp_path):
+    cache = PfmCache(str(tmp_path), max_size=10000)
+    for i in range(30):
+        cache.put(f"{i:064x}", bytes(1000))
+    assert cache.size <= 10000
+    assert cache.evictions >= 20
+    assert cache.get(f"{29:064x}") == bytes(1000)
+
+
+def test_build_manifest(tmp_path, afm_tree):
+    options = ConvertOptions(digest=True)
+    manifest = BuildManifest(str(tmp_path / "manifest.json"), options)
+    afm_filename = str(afm_tree / "small.afm")
+    pfm_filename = str(tmp_path / "small.pfm")
+    assert not manifest.is_current(afm_filename, pfm_filename)
+    convert_file(afm_filename, pfm_filename, options, warnings=[])
+    stat = (afm_tree / "small.afm").stat()
+    manifest.record({"input": afm_filename, "output": pfm_filename, "afm_size": stat.st_size,
+                     "afm_mtime_ns": stat.st_mtime_ns, "sha256": afm2pfm.file_digest(afm_filename)})
+    manifest.save()
+    manifest = BuildManifest(str(tmp_path / "manifest.json"), options)
+    assert manifest.is_current(afm_filename, pfm_filename)
+    assert not BuildManifest(str(tmp_path / "manifest.json"), options._replace(no_kern_limit=True)).is_current(
+        afm_filename, pfm_filename)
+    (afm_tree / "small.afm").write_text("changed")
+    assert not manifest.is_current(afm_filename, pfm_filename)
+
+
+def test_find_afm_files(afm_tree):
+    files = dict(find_afm_files([str(afm_tree)]))
+    assert sorted(files.values()) == ["headers.pfm", "plain.pfm", "small.pfm", "sub/kerns.pfm"]
+    (afm_tree / "other").mkdir()
+    shutil.copy(afm_tree / "sub" / "kerns.afm", afm_tree / "other")
+    first, second = str(afm_tree / "sub" / "kerns.afm"), str(afm_tree / "other" / "kerns.afm")
+    files, conflicts = split_output_conflicts(find_afm_files([str(afm_tree / "sub"), str(afm_tree / "other")]))
+    assert files == [(first, "kerns.pfm")]
+    assert conflicts == [(second, "kerns.pfm", first)]
+
+
+def test_request_options():
+    defaults = ConvertOptions({"Weight": 700})
+    options = request_options({"nokernlimit": True, "order": 1, "set": ["WindowsName:Name"]}, defaults)
+    assert options.no_kern_limit and options.tables_order == 1
+    assert options.overrides() == {"Weight": 700, "WindowsName": "Name"}
+    assert defaults.overrides() == {"Weight": 700}
+    with pytest.raises(ValueError):
+        request_options({"order": 7}, defaults)
+    with pytest.raises(ValueError):
+        request_options({"set": 5}, defaults)
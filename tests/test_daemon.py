@@ -0,0 +1,80 @@
+""" Tests of daemon and jobs modes (a2p.daemon). """
+
+import io
+import json
+import socket
+import sys
+import threading
+
+import pytest
+
+from a2p.convert import ConvertOptions
+from a2p.daemon import DaemonClient, DaemonServer, jobs_main, latency_percentiles, parse_address
+
+
+@pytest.fixture(name="daemon")
+def daemon_fixture(tmp_path):
+    """ Runs a daemon with one worker on a Unix socket, yields its address. """
+    address = str(tmp_path / "a2p.sock")
+    server = DaemonServer(address, ConvertOptions(), workers=1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield address
+    server.stop()
+    thread.join()
+    server.server_close()
+
+
+def test_daemon_convert(daemon, read_data):
+    with DaemonClient(daemon) as client:
+        assert client.convert(read_data("small.afm")) == read_data("small.pfm")
+        assert client.convert(read_data("kerns.afm"), nokernlimit=True) == read_data("kerns_nokernlimit.pfm")
+        assert client.convert(read_data("small.afm"), set=["WindowsName:Overridden"]) == read_data("small_overrides.pfm")
+        with pytest.raises(RuntimeError):
+            client.convert(read_data("small.afm"), order=7)
+        with pytest.raises(RuntimeError):
+            client.convert(b"junk\n")
+        responses = list(client.convert_many([read_data("plain.afm"), b"junk\n", read_data("kerns.afm")]))
+        assert [header["status"] for header, _ in responses] == ["ok", "error", "ok"]
+        assert responses[2][1] == read_data("kerns.pfm")
+        stats = client.stats()
+    assert stats["requests"] >= 7  # a request is recorded after its response is written
+    assert set(stats["latency_ms"]) == {"p50", "p90", "p99", "max"}
+
+
+def test_daemon_malformed_request(daemon):
+    with socket.socket(socket.AF_UNIX) as connection:
+        connection.connect(daemon)
+        connection.sendall(b"{nope\n")
+        assert json.loads(connection.makefile("rb").readline())["status"] == "error"
+
+
+def test_daemon_already_running(daemon):
+    with pytest.raises(RuntimeError):
+        DaemonServer(daemon, ConvertOptions(), workers=1)
+
+
+def test_parse_address():
+    assert parse_address("a.sock", None, "localhost") == "a.sock"
+    assert parse_address(None, 8000, "localhost") == ("localhost", 8000)
+    with pytest.raises(ValueError):
+        parse_address("a.sock", 8000, "localhost")
+
+def test_latency_percentiles():
+    assert not latency_percentiles([])
+    assert latency_percentiles([i / 1000 for i in range(1, 101)]) == pytest.approx({"p50": 51, "p90": 91, "p99": 100, "max": 100})
+
+
+def test_jobs(tmp_path, afm_tree, read_data, monkeypatch, capsys):
+    jobs = [{"input": str(afm_tree / "small.afm"), "output": str(tmp_path / "small.pfm"), "id": "a"},
+            {"input": str(afm_tree / "sub" / "kerns.afm"), "output": str(tmp_path / "kerns.pfm"), "nokernlimit": True},
+            {"input": str(tmp_path / "missing.afm")},
+            {"output": "x.pfm"}]
+    monkeypatch.setattr(sys, "stdin", io.StringIO("\n".join(json.dumps(job) for job in jobs) + "\n\n"))
+    assert jobs_main(["-j", "1"]) == 1
+    captured = capsys.readouterr()
+    results = {result["id"]: result for result in map(json.loads, captured.out.splitlines())}
+    assert [results[job_id]["status"] for job_id in ("a", 2, 3, 4)] == ["ok", "ok", "error", "error"]
+    assert (tmp_path / "small.pfm").read_bytes() == read_data("small.pfm")
+    assert (tmp_path / "kerns.pfm").read_bytes() == read_data("kerns_nokernlimit.pfm")
+    assert "4 jobs done" in captured.err
@@ -0,0 +1,57 @@
+""" Tests of encodings (a2p.encoding) and of PFMs made for them. """
+
+import pytest
+
+from a2p.afm import AfmReader
+from a2p.convert import convert, convert_afm_encodings, ConvertOptions
+from a2p.encoding import load_encoding, load_encodings, parse_encoding_file
+from a2p.pfm import PfmReader
+
+
+def write_enc(path, names: dict):
+    """ Writes .enc file with glyph names of given codes, .notdef elsewhere. """
+    vector = " ".join(f"/{names.get(code, '.notdef')}" for code in range(256))
+    path.write_text(f"% test encoding\n/TestEncoding [ {vector} ] def\n", encoding="ascii")
+
+
+def test_builtin_encodings():
+    winansi = load_encoding("winansi")
+    assert (winansi.label, winansi.charset) == ("winansi", 0)
+    assert winansi.vector[ord("A")] == b"A"
+    assert winansi.vector[0x95] == b"bullet"
+    latin2 = load_encoding("latin2:0")
+    assert (latin2.label, latin2.charset) == ("latin2", 0)
+    assert latin2.vector[0xA3] == b"Lslash"
+
+
+def test_encoding_file(tmp_path):
+    write_enc(tmp_path / "custom.enc", {65: "bullet", 66: "X"})
+    encoding = load_encoding(str(tmp_path / "custom.enc"))
+    assert (encoding.label, encoding.charset) == ("custom", 255)
+    assert encoding.vector[65] == b"bullet" and encoding.vector[67] is None
+    with pytest.raises(ValueError):
+        parse_encoding_file(b"/Broken [ /a /b ] def")
+
+
+def test_encodings_with_same_label(tmp_path):
+    (tmp_path / "other").mkdir()
+    write_enc(tmp_path / "custom.enc", {})
+    write_enc(tmp_path / "other" / "custom.enc", {})
+    with pytest.raises(ValueError):
+        load_encodings([str(tmp_path / "custom.enc"), str(tmp_path / "other" / "custom.enc")])
+    with pytest.raises(ValueError):
+        load_encodings(["winansi", "winansi:238"])
+
+
+def test_convert_encodings(tmp_path, read_data):
+    write_enc(tmp_path / "custom.enc", {65: "bullet", 66: "X"})
+    options = ConvertOptions(encodings=("winansi", "latin2", str(tmp_path / "custom.enc")))
+    pfms = convert_afm_encodings(read_data("small.afm"), options, warnings=[])
+    charsets = [PfmReader.parse_pfm(pfm_data)[0]["CharSet"] for pfm_data in pfms]
+    assert charsets == [0, 238, 255]
+    afm_widths = AfmReader.parse_afm(read_data("small.afm"))[1]  # bullet at 33, X at 32
+    pfm_values, pfm_widths, _ = PfmReader.parse_pfm(pfms[2])
+    assert pfm_widths[65 - pfm_values["FirstChar"]] == round(afm_widths[33])
+    assert pfm_widths[66 - pfm_values["FirstChar"]] == round(afm_widths[32])
+    assert pfms[0] == convert(read_data("small.afm"), encoding="winansi")
+    assert options.output_files("out/small.pfm") == ["out/small-winansi.pfm", "out/small-latin2.pfm", "out/small-custom.pfm"]
@@ -0,0 +1,115 @@
+""" Tests of PFM writer and reader (a2p.pfm). """
+
+import io
+import shutil
+
+import pytest
+
+from a2p.afm import AfmReader
+from a2p.common import PFM_KERNS_LIMIT, write_file_atomic
+from a2p.pfm import coerce_pfm_value, PfmReader, PfmWriter
+
+
+def test_writer_reuse(data_path, read_data):
+    pfm_writer = PfmWriter(warnings=[])
+    for afm_name, pfm_name in [("kerns.afm", "kerns.pfm"), ("plain.afm", "plain.pfm"), ("small.afm", "small.pfm"),
+                               ("headers.afm", "headers.pfm"), ("kerns.afm", "kerns.pfm")]:
+        afm_values, metrics = AfmReader.read_afm_metrics(data_path(afm_name), PFM_KERNS_LIMIT)
+        pfm_writer.prepare_metrics(afm_values, metrics, {}, False)
+        assert pfm_writer.serialize_pfm() == read_data(pfm_name)
+
+
+def test_prepare_data_matches_prepare_metrics(data_path, read_data):
+    pfm_writer = PfmWriter(warnings=[])
+    pfm_writer.prepare_data(*AfmReader.read_afm(data_path("kerns.afm")), {}, True)
+    assert pfm_writer.serialize_pfm() == read_data("kerns_nokernlimit.pfm")
+    pfm_writer.prepare_data(*AfmReader.read_afm(data_path("kerns.afm")), {}, True, tables_order=0)
+    assert pfm_writer.serialize_pfm() != read_data("kerns_nokernlimit.pfm")
+
+
+def test_serialize_into_buffer(data_path, read_data):
+    pfm_writer = PfmWriter(warnings=[])
+    pfm_writer.prepare_metrics(*AfmReader.read_afm_metrics(data_path("small.afm"), PFM_KERNS_LIMIT), {}, False)
+    pfm_data = pfm_writer.serialize_pfm()
+    assert isinstance(pfm_data, bytes)
+    buffer = bytearray(10 + len(pfm_data))
+    assert pfm_writer.serialize_pfm_into(buffer, 10) == len(pfm_data)
+    assert buffer[10:] == pfm_data
+    stream = io.BytesIO()
+    pfm_writer.make_pfm(stream)
+    assert stream.getvalue() == read_data("small.pfm")
+
+
+def test_reader(data_path, read_data):
+    afm_values, afm_widths, afm_kerns = AfmReader.read_afm(data_path("kerns.afm"))
+    pfm_values, pfm_widths, pfm_kerns = PfmReader.read_pfm(data_path("kerns_nokernlimit.pfm"))
+    assert pfm_values["Size"] == len(read_data("kerns_nokernlimit.pfm"))
+    assert pfm_values["WindowsName"] == "TestSansW"
+    widths = afm_widths[pfm_values["FirstChar"]:pfm_values["LastChar"] + 1]
+    assert [pfm_width for pfm_width, width in zip(pfm_widths, widths) if width is not None] == [
+        round(width) for width in widths if width is not None]
+    assert sorted(pfm_kerns) == sorted((a, b, round(kern)) for a, b, kern in afm_kerns)
+    assert PfmReader.parse_pfm(read_data("kerns.pfm")) == PfmReader.read_pfm(data_path("kerns.pfm"))
+
+
+def test_reader_diff(data_path):
+    expected = PfmReader.read_pfm(data_path("small.pfm"))
+    found = PfmReader.read_pfm(data_path("small_overrides.pfm"))
+    assert not PfmReader.diff_pfm(expected, expected)
+    differences = PfmReader.diff_pfm(expected, found)
+    assert any(difference.startswith("WindowsName:") for difference in differences)
+
+
+@pytest.mark.parametrize("pfm_data", [b"", b"\0" * 200, b"\0\1" + bytes(300)])
+def test_reader_rejects_garbage(pfm_data):
+    with pytest.raises(ValueError):
+        PfmReader.parse_pfm(pfm_data)
+
+
+def test_make_pfm_skips_identical(tmp_path, data_path, capsys):
+    pfm_writer = PfmWriter(warnings=[])
+    pfm_writer.prepare_metrics(*AfmReader.read_afm_metrics(data_path("small.afm"), PFM_KERNS_LIMIT), {}, False)
+    assert pfm_writer.make_pfm(str(tmp_path / "small.pfm"))
+    mtime_ns = (tmp_path / "small.pfm").stat().st_mtime_ns
+    assert not pfm_writer.make_pfm(str(tmp_path / "small.pfm"))
+    assert (tmp_path / "small.pfm").stat().st_mtime_ns == mtime_ns
+    assert "PFM unchanged" in capsys.readouterr().out
+    assert not write_file_atomic(str(tmp_path / "small.pfm"), (tmp_path / "small.pfm").read_bytes())
+    assert not [path for path in tmp_path.iterdir() if path.name.endswith(".tmp")]
+
+
+def test_patch_pfm(tmp_path, data_path):
+    shutil.copy(data_path("small.pfm"), tmp_path / "small.pfm")
+    overrides = {"Weight": 600, "Ascent": 800}
+    assert PfmWriter.patchable(overrides)
+    assert PfmWriter.patch_pfm(str(tmp_path / "small.pfm"), overrides) == 2
+    assert PfmWriter.patch_pfm(str(tmp_path / "small.pfm"), overrides) == 0
+    pfm_values, _, _ = PfmReader.read_pfm(str(tmp_path / "small.pfm"))
+    assert (pfm_values["Weight"], pfm_values["Ascent"]) == (600, 800)
+    pfm_writer = PfmWriter(warnings=[])
+    pfm_writer.prepare_metrics(*AfmReader.read_afm_metrics(data_path("small.afm"), PFM_KERNS_LIMIT), overrides, False)
+    assert (tmp_path / "small.pfm").read_bytes() == pfm_writer.serialize_pfm()
+
+
+def test_patch_pfm_rejects(tmp_path, data_path):
+    shutil.copy(data_path("small.pfm"), tmp_path / "small.pfm")
+    assert not PfmWriter.patchable({"WindowsName": "Name"})
+    with pytest.raises(ValueError):
+        PfmWriter.patch_pfm(str(tmp_path / "small.pfm"), {"WindowsName": "Name"})
+    with pytest.raises(ValueError):
+        PfmWriter.patch_pfm(str(tmp_path / "small.pfm"), {"Weight": 1 << 20})
+    (tmp_path / "bad.pfm").write_bytes(bytes(500))
+    with pytest.raises(ValueError):
+        PfmWriter.patch_pfm(str(tmp_path / "bad.pfm"), {"Weight": 700})
+
+
+def test_coerce_pfm_value():
+    assert coerce_pfm_value("Weight", "700") == 700
+    assert coerce_pfm_value("CharSet", "0xEE") == 238
+    assert coerce_pfm_value("Copyright", "Me") == b"Me" + b" " * 58
+    assert coerce_pfm_value("WindowsName", "Name") == "Name"
+    assert coerce_pfm_value("Weight", 700) == 700
+    assert coerce_pfm_value("Foo", 5) == 5
+    for name, value in [("Weight", "bold"), ("Weight", 1.5), ("WindowsName", 5), ("Copyright", 5), ("Info", b"x")]:
+        with pytest.raises(ValueError):
+            coerce_pfm_value(name, value)